@@ -0,0 +1,7 @@
+"""
+Benchmarks of the parsers on synthetic data. Generators build realistic inputs (mBank billings, pattern and index
+rules, NBP rates, Baselinker orders) at a configurable scale, and stand-ins serve them from memory instead of Google
+Sheets and HTTP APIs, so the Steps pipelines run end to end offline and every step's time and memory is recorded.
+
+Run with `python main.py -v 0 benchmark --rows 10000 100000 --rules 100 1000`.
+"""
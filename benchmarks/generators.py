@@ -0,0 +1,218 @@
+"""
+Generators of synthetic, but realistically shaped inputs. Every generator takes a seed, so runs at the same scale
+always process the same data.
+"""
+
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+MERCHANTS = [
+    "Allegro", "Biedronka", "Lidl", "Zabka", "Orlen", "BP", "Shell", "Rossmann", "Empik", "IKEA", "Castorama",
+    "Leroy Merlin", "Media Markt", "NKON", "Botland", "TME", "Kamami", "PayU", "Przelewy24", "InPost", "DPD", "Poczta",
+]
+CITIES = ["Warszawa", "Krakow", "Gdansk", "Wroclaw", "Poznan", "Lodz", "Lublin", "Katowice"]
+DESCRIPTION_TEMPLATES = [
+    "ZAKUP PRZY UZYCIU KARTY {merchant} {number} {city}",
+    "PRZELEW WYCHODZACY {merchant} FAKTURA {number}",
+    "PRZELEW PRZYCHODZACY {merchant} ZAMOWIENIE {number}",
+    "PLATNOSC BLIK {merchant} {number}",
+]
+MBANK_CATEGORIES = ["Jedzenie", "Paliwo", "Zakupy", "Wplywy", "Przelewy", "Inne", "Elektronika", "Transport"]
+ACCOUNTS = ["eKonto 1234", "mBiznes konto 5678", "Konto walutowe EUR 9012"]
+CATEGORIES = ["Materialy", "Ogniwa", "Transport", "Marketing", "Biuro", "Paliwo", "Sprzedaz", "Podatki", "Inne"]
+
+COUNTRIES = ["Polska", "Niemcy", "Czechy", "Słowacja", "Francja", "Włochy", "Hiszpania", "Austria"]
+ORDER_SOURCES = ["shop", "allegro", "ebay", "amazon", "manual"]
+PRODUCT_BRANDS = ["Bosch", "Makita", "DeWalt", "Milwaukee", "Ryobi", "Hitachi", "Metabo", "Einhell"]
+BILLING_HEADER = ["#Data operacji", "#Opis operacji", "#Rachunek", "#Kategoria", "#Kwota"]
+
+
+def merchant_names(count: int) -> List[str]:
+    """
+    Distinct merchant names - base names suffixed with a number once the base list is exhausted.
+    """
+    return [
+        MERCHANTS[i % len(MERCHANTS)] if i < len(MERCHANTS) else f"{MERCHANTS[i % len(MERCHANTS)]} {i}"
+        for i in range(count)
+    ]
+
+
+def mbank_transactions(rows: int, seed: int = 0, start: str = "2019-01-01", merchants: int = 500) -> pd.DataFrame:
+    """
+    Raw transactions in the shape of mBank export columns, spread evenly over the years since `start`.
+    """
+    rng = np.random.default_rng(seed)
+    names = np.array(merchant_names(merchants), dtype=object)
+    dates = pd.Timestamp(start) + pd.to_timedelta(np.sort(rng.integers(0, 5 * 365, rows)), unit="D")
+
+    templates = rng.integers(0, len(DESCRIPTION_TEMPLATES), rows)
+    merchant = names[rng.zipf(1.3, rows) % merchants]
+    numbers = rng.integers(1000, 99999, rows)
+    cities = np.array(CITIES, dtype=object)[rng.integers(0, len(CITIES), rows)]
+    descriptions = [
+        DESCRIPTION_TEMPLATES[template].format(merchant=name.upper(), number=number, city=city)
+        for template, name, number, city in zip(templates, merchant, numbers, cities)
+    ]
+
+    amounts = np.round(rng.lognormal(4, 1.2, rows) * np.where(rng.random(rows) < 0.8, -1, 1), 2)
+    currencies = np.where(rng.random(rows) < 0.9, "PLN", "EUR")
+    formatted_amounts = [
+        f"{amount:,.2f}".replace(",", " ").replace(".", ",") + f" {currency}"
+        for amount, currency in zip(amounts, currencies)
+    ]
+    return pd.DataFrame({
+        "#Data operacji": dates.strftime("%Y-%m-%d"),
+        "#Opis operacji": descriptions,
+        "#Rachunek": np.array(ACCOUNTS, dtype=object)[rng.integers(0, len(ACCOUNTS), rows)],
+        "#Kategoria": np.array(MBANK_CATEGORIES, dtype=object)[rng.integers(0, len(MBANK_CATEGORIES), rows)],
+        "#Kwota": formatted_amounts,
+    })
+
+
+def mbank_billing_values(transactions: pd.DataFrame) -> List[list]:
+    """
+    Values of a MbankBilling worksheet - the export preamble pasted above transactions, as users do it.
+    """
+    preamble = [
+        ["mBank S.A. Bankowość Detaliczna", "", "", "", ""],
+        ["#Za okres:", transactions["#Data operacji"].min(), transactions["#Data operacji"].max(), "", ""],
+        ["", "", "", "", ""],
+    ]
+    return preamble + [BILLING_HEADER] + transactions[BILLING_HEADER].values.tolist()
+
+
+def mbank_billing_worksheets(rows: int, seed: int = 0, merchants: int = 500) -> Dict[str, List[list]]:
+    """
+    Billings split into one worksheet per year, with a few transactions repeated in the following year's statement.
+    """
+    transactions = mbank_transactions(rows, seed, merchants=merchants)
+    years = transactions["#Data operacji"].str[:4]
+    worksheets = {}
+    for year in sorted(years.unique()):
+        billing = transactions[years == year]
+        overlap = transactions[(years < year) & (years.shift(-10) == year)]
+        worksheets[f"MbankBilling {year}"] = mbank_billing_values(pd.concat([overlap, billing]))
+    return worksheets
+
+
+def pattern_rules(count: int, seed: int = 0, merchants: int = 500) -> List[list]:
+    """
+    PatternRules worksheet values. Most rules match merchants in descriptions, some are narrowed down by mBank
+    category, amount or year, and a few refer to the category set by previous rules.
+    """
+    rng = np.random.default_rng(seed)
+    names = merchant_names(max(count, merchants))
+    values = [["id", "result_value", "description", "mbank_category", "category", "PLN", "year"]]
+    for rule_id in range(count):
+        kind = rng.random()
+        row = [rule_id, str(rng.choice(CATEGORIES)), names[rule_id % len(names)].lower(), "", "", "", ""]
+        if kind < 0.15:
+            row[3] = str(rng.choice(MBANK_CATEGORIES))
+        elif kind < 0.25:
+            row[5] = f"< {-int(rng.integers(50, 500))}"
+        elif kind < 0.3:
+            row[6] = int(rng.integers(2019, 2024))
+        elif kind < 0.33:
+            row[2], row[4] = "", str(rng.choice(CATEGORIES)).lower()
+        values.append(row)
+    return values
+
+
+def index_rules(count: int, transactions: int, seed: int = 0) -> List[list]:
+    rng = np.random.default_rng(seed)
+    ids = rng.choice(transactions, size=min(count, transactions), replace=False)
+    return [["id", "result_value"]] + [[int(i), str(rng.choice(CATEGORIES))] for i in sorted(ids)]
+
+
+def category_mapping() -> List[list]:
+    groups = {
+        "Materialy": "Produkcja", "Ogniwa": "Produkcja", "Transport": "Logistyka", "Marketing": "Sprzedaz",
+        "Biuro": "Administracja", "Paliwo": "Logistyka", "Sprzedaz": "Sprzedaz", "Podatki": "Administracja",
+    }
+    return [["Detailed", "level_1", "level_2"]] + [
+        [category, group, "Koszty" if group != "Sprzedaz" else "Przychody"] for category, group in groups.items()
+    ]
+
+
+def manual_entries(count: int = 20, seed: int = 0) -> List[list]:
+    rng = np.random.default_rng(seed)
+    dates = pd.Timestamp("2019-01-01") + pd.to_timedelta(rng.integers(0, 5 * 365, count), unit="D")
+    return [["date", "description", "amount", "currency", "category"]] + [
+        [date.strftime("%Y-%m-%d"), "Gotowka", float(-rng.integers(10, 1000)), "PLN", str(rng.choice(CATEGORIES))]
+        for date in dates
+    ]
+
+
+def nbp_rates(start, end, currency: str = "EUR", seed: int = 0) -> pd.DataFrame:
+    """
+    Mid rates in the shape returned by NBPApi.get_rates - published on working days only, random walk around a
+    realistic level of the currency.
+    """
+    levels = {"EUR": 4.4, "USD": 4.0, "GBP": 5.1, "CZK": 0.18}
+    dates = pd.bdate_range(pd.Timestamp(start) - pd.Timedelta(days=7), end)
+    rng = np.random.default_rng(seed + sum(map(ord, currency)))
+    walk = np.cumsum(rng.normal(0, 0.002, len(dates)))
+    return pd.DataFrame({"date": dates, "rate": np.round(levels.get(currency, 1.0) * np.exp(walk), 4)})
+
+
+def baselinker_orders(lines: int, seed: int = 0, products: int = 2000, start: str = "2021-01-01") -> List[dict]:
+    """
+    Payload of Baselinker getOrders - orders with one to three products, `lines` order lines in total.
+    """
+    rng = np.random.default_rng(seed)
+    catalogue = [
+        (f"Akumulator {brand} {voltage}V {capacity}Ah {variant}", attributes)
+        for brand, voltage, capacity, variant, attributes in zip(
+            rng.choice(PRODUCT_BRANDS, products),
+            rng.choice([10.8, 12, 14.4, 18, 36], products),
+            rng.choice([1.5, 2, 3, 4, 5, 6], products),
+            rng.integers(100, 999, products),
+            rng.choice(["", "Li-ion", "Ni-MH"], products),
+        )
+    ]
+    start_timestamp = int(pd.Timestamp(start).timestamp())
+
+    orders, order_id = [], 1000000
+    while lines > 0:
+        order_products = min(lines, int(rng.integers(1, 4)))
+        order_id += 1
+        # Popular products are ordered much more often, every product appears at most once in an order
+        product_ids = dict.fromkeys(rng.zipf(1.2, order_products) % products)
+        items = [
+            {
+                "order_product_id": order_id * 10 + i,
+                "product_id": str(product_id),
+                "variant_id": "0",
+                "name": catalogue[product_id][0],
+                "attributes": catalogue[product_id][1],
+                "price_brutto": float(np.round(rng.uniform(50, 900), 2)),
+                "quantity": int(rng.integers(1, 4)),
+            }
+            for i, product_id in enumerate(product_ids)
+        ]
+        lines -= len(items)
+        orders.append({
+            "order_id": order_id,
+            "order_source": str(rng.choice(ORDER_SOURCES)),
+            "date_confirmed": start_timestamp + int(rng.integers(0, 3 * 365 * 86400)),
+            "currency": str(rng.choice(["PLN", "EUR"], p=[0.85, 0.15])),
+            "payment_done": sum(item["price_brutto"] * item["quantity"] for item in items),
+            "delivery_country": str(rng.choice(COUNTRIES)),
+            "products": items,
+        })
+    return orders
+
+
+def baselinker_product_map(orders: List[dict], mapped_share: float = 0.7, seed: int = 0) -> List[list]:
+    rng = np.random.default_rng(seed)
+    names = sorted({(item["name"], item["attributes"]) for order in orders for item in order["products"]})
+    values = [["name", "attributes", "master_product", "battery_type", "battery_size"]]
+    for name, attributes in names:
+        if rng.random() < mapped_share:
+            _, brand, voltage, capacity, _ = name.split(" ")
+            values.append([name, attributes, f"{brand} {voltage}", attributes or "Li-ion", capacity])
+        else:
+            values.append([name, attributes, "", "", ""])
+    return values
@@ -0,0 +1,191 @@
+"""
+Running parsers against generated data and collecting per step metrics. Every benchmark runs in its own temporary
+working directory with its own cache root, so neither earlier benchmarks nor real caches of the project skew results
+(unless repeated runs are requested - the following repetitions then measure warm caches).
+"""
+
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import partial
+from itertools import product
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+from unittest import mock
+
+import pandas as pd
+
+from benchmarks import generators
+from benchmarks.stand_ins import InMemoryConnection, InMemorySpreadsheet, LocalBaselinkerAPI, LocalNBPApi
+from src.utils.cache import CACHE_ROOT_ENV
+from src.utils.paths import RESULTS_DIR
+from src.utils.steps import Steps
+
+BENCHMARKS_DIR = RESULTS_DIR / "benchmarks"
+ISO_CODES = {
+    "Polska": "PL", "Niemcy": "DE", "Czechy": "CZ", "Słowacja": "SK", "Francja": "FR", "Włochy": "IT",
+    "Hiszpania": "ES", "Austria": "AT",
+}
+
+
+@dataclass
+class BenchmarkCase:
+    parser: str
+    rows: int
+    rules: int = 0
+    repetition: int = 0
+    seed: int = 0
+    step_metrics: List[dict] = field(default_factory=list)
+
+    @property
+    def total_time(self) -> float:
+        return sum(metrics["elapsed_time"] or 0 for metrics in self.step_metrics)
+
+
+@contextmanager
+def isolated_directory():
+    previous, previous_cache_root = Path.cwd(), os.environ.get(CACHE_ROOT_ENV)
+    with tempfile.TemporaryDirectory(prefix="citylion-benchmark-") as directory:
+        os.chdir(directory)
+        # Caches of parsers created inside use the root of this directory
+        os.environ[CACHE_ROOT_ENV] = str(Path(directory) / "cache")
+        try:
+            yield Path(directory)
+        finally:
+            os.chdir(previous)
+            if previous_cache_root is None:
+                os.environ.pop(CACHE_ROOT_ENV, None)
+            else:
+                os.environ[CACHE_ROOT_ENV] = previous_cache_root
+
+
+def mbank_spreadsheet(rows: int, rules: int, seed: int = 0) -> InMemorySpreadsheet:
+    worksheets = generators.mbank_billing_worksheets(rows, seed, merchants=max(500, rules))
+    worksheets.update({
+        "ManualEntries": generators.manual_entries(seed=seed),
+        "PatternRules": generators.pattern_rules(rules, seed, merchants=max(500, rules)),
+        "IndexRules": generators.index_rules(max(1, rules // 10), rows, seed),
+        "CategoryMapping": generators.category_mapping(),
+        **{title: [] for title in ["NotMapped", "ParsedData", "Warnings"]},
+    })
+    return InMemorySpreadsheet(f"mbank-{rows}-{rules}", worksheets)
+
+
+def baselinker_inputs(rows: int, seed: int = 0) -> Tuple[InMemorySpreadsheet, List[dict]]:
+    orders = generators.baselinker_orders(rows, seed)
+    spreadsheet = InMemorySpreadsheet(
+        f"baselinker-{rows}",
+        {"BaselinkerProductMap": generators.baselinker_product_map(orders, seed=seed), "BaselinkerData": []},
+    )
+    return spreadsheet, orders
+
+
+def run_mbank(
+    case: BenchmarkCase,
+    directory: Path,
+    trace_memory: bool,
+    spreadsheet: InMemorySpreadsheet,
+    rule_workers: Optional[int] = None,
+    partitioned: bool = False,
+) -> Steps:
+    from src.parsers import MBankParser
+
+    parser = MBankParser(
+        spreadsheet.title,
+        spreadsheet=InMemoryConnection(spreadsheet),
+        nbp_api=LocalNBPApi(case.seed),
+        rule_workers=rule_workers,
+        partitioned=partitioned,
+    )
+    return parser.parse(trace_memory=trace_memory, record_history=False)
+
+
+def run_baselinker(
+    case: BenchmarkCase, directory: Path, trace_memory: bool, spreadsheet: InMemorySpreadsheet, orders: List[dict]
+) -> Steps:
+    from src.parsers import BaselinkerParser
+
+    parser = BaselinkerParser(
+        spreadsheet.title,
+        api_key="benchmark",
+        spreadsheet=InMemoryConnection(spreadsheet),
+        api=LocalBaselinkerAPI(orders),
+        nbp_api=LocalNBPApi(case.seed),
+    )
+    # ISO codes are normally scraped from Wikipedia
+    with mock.patch("src.parsers.baselinker.baselinker.get_country_to_iso_code_map", return_value=ISO_CODES):
+        return parser.parse(trace_memory=trace_memory, record_history=False)
+
+
+def run_benchmarks(
+    parsers: Iterable[str],
+    rows: Iterable[int],
+    rules: Iterable[int],
+    repeat: int = 1,
+    trace_memory: bool = False,
+    seed: int = 0,
+    rule_workers: Optional[int] = None,
+    partitioned: bool = False,
+) -> List[BenchmarkCase]:
+    """
+    :param rule_workers: processes evaluating pattern rules in MBankParser (see CompiledRuleSet.evaluate)
+    :param partitioned: run MBankParser month by month (see src.parsers.mbank.partitions)
+    """
+    cases = []
+    for parser_name in parsers:
+        scales = product(rows, rules) if parser_name == "mbank" else ((row_count, 0) for row_count in rows)
+        for row_count, rule_count in scales:
+            if parser_name == "mbank":
+                spreadsheet = mbank_spreadsheet(row_count, rule_count, seed)
+                run = partial(
+                    run_mbank, spreadsheet=spreadsheet, rule_workers=rule_workers, partitioned=partitioned
+                )
+            else:
+                spreadsheet, orders = baselinker_inputs(row_count, seed)
+                run = partial(run_baselinker, spreadsheet=spreadsheet, orders=orders)
+
+            # Repetitions share the directory, so the following ones run with warm caches
+            with isolated_directory() as directory:
+                for repetition in range(repeat):
+                    case = BenchmarkCase(parser_name, row_count, rule_count, repetition, seed)
+                    steps = run(case, directory, trace_memory)
+                    case.step_metrics = [metrics.as_dict() for metrics in steps.get_metrics()]
+                    cases.append(case)
+                    print(format_case(case), flush=True)
+    return cases
+
+
+def cases_frame(cases: List[BenchmarkCase]) -> pd.DataFrame:
+    return pd.DataFrame([
+        dict(parser=case.parser, rows=case.rows, rules=case.rules, repetition=case.repetition, **metrics)
+        for case in cases
+        for metrics in case.step_metrics
+    ])
+
+
+def format_case(case: BenchmarkCase) -> str:
+    frame = pd.DataFrame(case.step_metrics)
+    # Traced peak is None, when allocations were not traced
+    frame["traced_peak_bytes"] = frame["traced_peak_bytes"].astype(float)
+    frame = pd.DataFrame({
+        "step": frame["step"],
+        "time [s]": frame["elapsed_time"].round(3),
+        "rss delta [MB]": (frame["rss_delta_bytes"] / 2 ** 20).round(1),
+        "traced peak [MB]": (frame["traced_peak_bytes"] / 2 ** 20).round(1),
+        "rows out": frame["rows_out"],
+        "network calls": frame["network_calls"],
+    })
+    title = f"\n{case.parser} - rows: {case.rows}, rules: {case.rules}, repetition: {case.repetition}"
+    return f"{title}, total: {round(case.total_time, 3)} s\n{frame.to_string(index=False)}"
+
+
+def save_results(cases: List[BenchmarkCase], directory: Optional[Path] = None) -> Path:
+    directory = Path(directory or BENCHMARKS_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"benchmark-{datetime.now():%Y%m%d-%H%M%S}.json"
+    path.write_text(json.dumps([case.__dict__ for case in cases], indent=2, default=str))
+    cases_frame(cases).to_csv(path.with_suffix(".csv"), index=False)
+    return path
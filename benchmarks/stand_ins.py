@@ -0,0 +1,148 @@
+"""
+In-memory replacements of Google Sheets and HTTP APIs. They implement only the part of gspread, NBPApi and
+BaselinkerAPI interfaces used by the parsers, so parsers run unchanged and no network call is made.
+"""
+
+import re
+from itertools import count
+from typing import Dict, List, Optional, Sequence
+
+import gspread
+import pandas as pd
+import structlog
+
+from benchmarks.generators import nbp_rates
+from src.gdrive_connection.base import GSheetConnection
+
+
+class InMemoryWorksheet:
+    def __init__(self, title: str, values: List[list], sheet_id: int, rows: int = 1000, cols: int = 26):
+        self.title = title
+        self.id = sheet_id
+        self._properties = {"sheetId": sheet_id, "title": title}
+        self.values = [list(row) for row in values]
+        self._grid = (rows, cols)
+
+    @property
+    def row_count(self) -> int:
+        return max(self._grid[0], len(self.values))
+
+    @property
+    def col_count(self) -> int:
+        return max([self._grid[1], *map(len, self.values[:1])])
+
+    def get_all_values(self) -> List[list]:
+        return [[str(value) for value in row] for row in self.values]
+
+    def get_all_records(self, value_render_option=None) -> List[dict]:
+        # Values are kept as written, i.e. unformatted, whatever the render option
+        if not self.values:
+            return []
+        header = self.values[0]
+        return [dict(zip(header, row)) for row in self.values[1:]]
+
+    def clear(self):
+        self.values = []
+
+    def update(self, values=None, range_name=None, **kwargs):
+        # gspread 5 takes the range first, gspread 6 the values - update_data passes values positionally
+        if isinstance(range_name, list) and not isinstance(values, list):
+            values, range_name = range_name, values
+        first_row = 0 if range_name is None else _a1_row(range_name)
+        missing_rows = first_row + len(values) - len(self.values)
+        if missing_rows > 0:
+            self.values.extend([] for _ in range(missing_rows))
+        self.values[first_row:first_row + len(values)] = [list(row) for row in values]
+
+    def batch_clear(self, ranges: Sequence[str]):
+        for cell_range in ranges:
+            first_cell, last_cell = cell_range.split(":")
+            del self.values[_a1_row(first_cell):_a1_row(last_cell) + 1]
+
+
+class InMemorySpreadsheet:
+    _ids = count(1)
+
+    def __init__(self, title: str, worksheets: Dict[str, List[list]]):
+        self.id = f"in-memory-{next(self._ids)}"
+        self.title = title
+        self._worksheets: Dict[str, InMemoryWorksheet] = {}
+        for worksheet_title, values in worksheets.items():
+            self.add_worksheet(worksheet_title, rows=max(1000, len(values)), cols=26).values = values
+
+    def worksheets(self) -> List[InMemoryWorksheet]:
+        return list(self._worksheets.values())
+
+    def worksheet(self, title: str) -> InMemoryWorksheet:
+        try:
+            return self._worksheets[title]
+        except KeyError:
+            raise gspread.exceptions.WorksheetNotFound(title) from None
+
+    def add_worksheet(self, title: str, rows: int, cols: int) -> InMemoryWorksheet:
+        self._worksheets[title] = InMemoryWorksheet(title, [], len(self._worksheets), rows, cols)
+        return self._worksheets[title]
+
+    def values_batch_get(self, ranges: Sequence[str]) -> dict:
+        value_ranges = []
+        for cell_range in ranges:
+            # Whole worksheets ('Title') or ranges of whole columns ('Title'!A:E)
+            title, _, columns = cell_range.partition("!")
+            values = self.worksheet(title.strip("'")).get_all_values()
+            if columns:
+                first, _, last = columns.partition(":")
+                values = [row[ord(first) - ord("A"):ord(last or first) - ord("A") + 1] for row in values]
+            value_ranges.append({"range": cell_range, "values": values})
+        return {"valueRanges": value_ranges}
+
+    def fetch_sheet_metadata(self) -> dict:
+        return {
+            "sheets": [
+                {
+                    "properties": {
+                        "title": worksheet.title,
+                        "sheetId": worksheet.id,
+                        "gridProperties": {"rowCount": worksheet.row_count, "columnCount": worksheet.col_count},
+                    }
+                }
+                for worksheet in self._worksheets.values()
+            ]
+        }
+
+    def batch_update(self, body: dict) -> dict:
+        return {"replies": [{} for _ in body.get("requests", [])]}
+
+
+class InMemoryConnection(GSheetConnection):
+    """
+    GSheetConnection serving worksheets from memory - worksheet lookup and creation go through the real
+    GSheetConnection code.
+    """
+
+    def __init__(self, spreadsheet: InMemorySpreadsheet):
+        self.logger = structlog.getLogger(__name__)
+        self.gc = None
+        self.spreadsheet = spreadsheet
+        self.written_worksheets = set()
+
+
+class LocalNBPApi:
+    def __init__(self, seed: int = 0):
+        self.seed = seed
+
+    def get_rates(self, date_range, currency: str = "EUR") -> pd.DataFrame:
+        return nbp_rates(date_range[0], date_range[-1], currency, self.seed)
+
+
+class LocalBaselinkerAPI:
+    def __init__(self, orders: List[dict]):
+        self.orders = orders
+
+    def get_orders(self, api_key: str, timestamp: Optional[int] = None) -> List[dict]:
+        if timestamp is None:
+            return list(self.orders)
+        return [order for order in self.orders if order["date_confirmed"] >= timestamp]
+
+
+def _a1_row(cell: str) -> int:
+    return int(re.sub(r"\D", "", cell)) - 1
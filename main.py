@@ -1,23 +1,356 @@
+"""
+Command line entry point. Every subcommand imports its heavy dependencies (pandas, gspread, structlog, ...) inside its
+handler, so `--help` and cache management commands start without loading the whole parsing stack.
+"""
+
 import argparse
+import os
 import sys
 from typing import Optional, Sequence
-from src.parsers import MBankParser, BaselinkerParser
 
-from src.utils.configure_logging import setup_logging
+PARSER_NAMES = ["mbank", "baselinker"]
+# Columns of PatternRules worksheet
+RULE_FIELDS = ["description", "category", "mbank_category", "year", "month", "type", "EUR", "PLN", "currency"]
+HEAVY_MODULES = ["pandas", "numpy", "gspread", "structlog", "pydantic", "xmltodict", "bs4", "requests"]
 
-parser = argparse.ArgumentParser(description='Parser')
-parser.add_argument('-v', '--verbose', help='Verbose of logging module', default=3)
-parser.add_argument('spreadsheet_name', help='Spreadsheet name that needs to be parsed')
 
+def setup_logging(args: argparse.Namespace):
+    from src.utils.configure_logging import setup_logging as configure
 
-def main(argv: Optional[Sequence[str]] = None) -> int:
-    setup_logging(args.verbose)
-    MBankParser(args.spreadsheet_name).parse()
-    BaselinkerParser(args.spreadsheet_name, "APIKEY").parse()
+    configure(args.verbose)
+
+
+def add_run_options(subparser: argparse.ArgumentParser):
+    from src.utils.paths import METRICS_DIR
+
+    subparser.add_argument('spreadsheet_names', help='Spreadsheet names that need to be parsed', nargs='+')
+    subparser.add_argument('--workers', help='Number of jobs running concurrently', type=int, default=4)
+    subparser.add_argument('--api-key', help='Baselinker API key', default='APIKEY')
+    subparser.add_argument('--metrics-dir', help='Directory for JSON and Prometheus step metrics', default=METRICS_DIR)
+    subparser.add_argument('--trace-memory', help='Trace python allocations per step', action='store_true')
+    subparser.add_argument('--profile', help='Profile every step with cProfile', action='store_true')
+    subparser.add_argument('--billings-dir', help='Read mBank CSV exports from this folder instead of worksheets',
+                           default=None)
+    subparser.add_argument('--rules-file', help='YAML file with pattern rules used instead of PatternRules worksheet',
+                           default=None)
+    subparser.add_argument('--rule-workers', help='Processes evaluating pattern rules on large histories (0 - all '
+                                                  'cores)', type=int, default=None)
+    subparser.add_argument('--partitioned', help='Parse mBank history month by month, reusing unchanged closed months',
+                           action='store_true')
+
+
+def mbank_options(args: argparse.Namespace) -> dict:
+    return dict(
+        billings_dir=args.billings_dir,
+        rules_path=args.rules_file,
+        rule_workers=args.rule_workers,
+        partitioned=args.partitioned,
+    )
+
+
+def run_parsers(args: argparse.Namespace) -> int:
+    setup_logging(args)
+    from src.batch import BatchRunner, format_summary
+
+    parser_names = getattr(args, 'parsers', None) or [args.parser_name]
+    run_options = dict(metrics_dir=args.metrics_dir, trace_memory=args.trace_memory, profile=args.profile)
+    results = BatchRunner(
+        args.spreadsheet_names,
+        parser_names,
+        baselinker_api_key=args.api_key,
+        max_workers=args.workers,
+        mbank_options=mbank_options(args),
+    ).run(**run_options)
+    print(format_summary(results))
+    return int(not all(result.succeeded for result in results))
+
+
+def watch(args: argparse.Namespace) -> int:
+    setup_logging(args)
+    from src.watch import Watcher
+
+    watcher = Watcher(
+        args.spreadsheet_names,
+        args.parsers,
+        baselinker_api_key=args.api_key,
+        mbank_options=mbank_options(args),
+        interval=args.interval,
+        metrics_dir=args.metrics_dir,
+        trace_memory=args.trace_memory,
+        profile=args.profile,
+    )
+    try:
+        watcher.run_forever()
+    except KeyboardInterrupt:
+        return 0
+
+
+def check_regressions(args: argparse.Namespace) -> int:
+    from src.utils.run_history import REGRESSION, RunHistory, format_comparisons
+
+    parser_class_names = {"mbank": "MBankParser", "baselinker": "BaselinkerParser"}
+    history = RunHistory()
+    regressions_found = False
+    for spreadsheet_name in args.spreadsheet_names:
+        for parser_name in args.parsers:
+            comparisons = history.find_regressions(
+                spreadsheet_name, parser_class_names[parser_name], threshold=args.threshold
+            )
+            print(f"\n{parser_class_names[parser_name]} - {spreadsheet_name}")
+            print(format_comparisons(comparisons))
+            regressions_found |= any(comparison.verdict == REGRESSION for comparison in comparisons)
+    return int(regressions_found)
+
+
+def reconcile(args: argparse.Namespace) -> int:
+    setup_logging(args)
+    import gspread
+    from src.gdrive_connection.base import GSheetConnection
+    from src.parsers import ReconciliationParser
+
+    client = gspread.service_account()
+    orders = GSheetConnection(args.orders_spreadsheet, client=client) if args.orders_spreadsheet else None
+    payments = GSheetConnection(args.payments_spreadsheet, client=client) if args.payments_spreadsheet else None
+    for spreadsheet_name in args.spreadsheet_names:
+        parser = ReconciliationParser(
+            spreadsheet_name,
+            spreadsheet=GSheetConnection(spreadsheet_name, client=client),
+            orders_spreadsheet=orders,
+            payments_spreadsheet=payments,
+            tolerance=args.tolerance,
+            days_before=args.days_before,
+            days_after=args.days_after,
+        )
+        parser.parse(metrics_dir=args.metrics_dir)
+    return 0
+
+
+def preview_rule(args: argparse.Namespace) -> int:
+    setup_logging(args)
+    from src.gdrive_connection.base import GSheetConnection
+    from src.parsers.mbank.rule_preview import RulePreviewIndex, candidate_record, format_preview
+    from src.parsers.mbank.rule_set import rule_records_from_yaml
+
+    if args.candidates:
+        records = rule_records_from_yaml(args.candidates)
+    elif args.result_value:
+        fields = {column: getattr(args, column) for column in RULE_FIELDS}
+        records = [candidate_record(args.result_value, {key: value for key, value in fields.items() if value})]
+    else:
+        print("Either --result-value with rule fields or --candidates file is required")
+        return 2
+
+    index = RulePreviewIndex(GSheetConnection(args.spreadsheet_name)["ParsedData"].get_data())
+    for record in records:
+        print(f"\n{format_preview(index.preview(record), top=args.top)}")
+    return 0
+
+
+def show_rates(args: argparse.Namespace) -> int:
+    setup_logging(args)
+    import pandas as pd
+    from src.data_sources import NBPApi
+
+    date_range = pd.date_range(args.start, args.end or pd.Timestamp.today().normalize())
+    rates = NBPApi().get_rates(date_range, currency=args.currency)
+    rates = rates[(rates["date"] >= date_range[0]) & (rates["date"] <= date_range[-1])]
+    print(rates.to_csv(index=False) if args.csv else rates.to_string(index=False))
+    return 0
+
+
+def cache_info(args: argparse.Namespace) -> int:
+    from datetime import datetime
+    from src.utils.cache import CacheManager
+
+    manager = CacheManager()
+    rows = manager.report()
+    print(f"Cache root: {manager.root} (limit {manager.max_size_mb:g} MB, entries unused for "
+          f"{manager.max_age_days:g} days are evicted)")
+    print(f"{'namespace':24} {'entries':>8} {'size [kB]':>10} {'last used':>17} {'hits':>7} {'misses':>7} "
+          f"{'hit rate':>9} {'evicted':>8}")
+    for row in rows:
+        last_used = datetime.fromtimestamp(row["last_used"]).strftime("%Y-%m-%d %H:%M") if row["last_used"] else "-"
+        hit_rate = f"{row['hit_rate']:.0%}" if row["hit_rate"] is not None else "-"
+        print(f"{row['namespace']:24} {row['entries']:>8} {round(row['size_bytes'] / 1024, 1):>10} {last_used:>17} "
+              f"{row['hits']:>7} {row['misses']:>7} {hit_rate:>9} {row['evictions']:>8}")
+    print(f"{'total':24} {sum(row['entries'] for row in rows):>8} "
+          f"{round(sum(row['size_bytes'] for row in rows) / 1024, 1):>10}")
+    return 0
+
+
+def cache_prune(args: argparse.Namespace) -> int:
+    from src.utils.cache import CacheManager
+
+    evicted = CacheManager().prune(
+        max_size_mb=args.max_mb, max_age_days=args.max_age_days, namespaces=args.namespaces, dry_run=args.dry_run
+    )
+    for entry in evicted:
+        print(f"{'Would remove' if args.dry_run else 'Removed'} {entry.path} ({round(entry.size / 1024, 1)} kB)")
+    print(f"{len(evicted)} entries, {round(sum(entry.size for entry in evicted) / 2 ** 20, 2)} MB "
+          f"{'would be freed' if args.dry_run else 'freed'}")
     return 0
 
 
+def benchmark(args: argparse.Namespace) -> int:
+    setup_logging(args)
+    from benchmarks.runner import run_benchmarks, save_results
+
+    cases = run_benchmarks(
+        args.parsers,
+        args.rows,
+        args.rules,
+        repeat=args.repeat,
+        trace_memory=args.trace_memory,
+        seed=args.seed,
+        rule_workers=args.rule_workers,
+        partitioned=args.partitioned,
+    )
+    print(f"\nResults saved to {save_results(cases, args.output_dir)}")
+    return 0
+
+
+def startup_check(args: argparse.Namespace) -> int:
+    """
+    Runs `main.py --help` in a fresh interpreter with -X importtime and checks that it fits into the time budget and
+    that none of the heavy dependencies got imported.
+    """
+    import subprocess
+    from pathlib import Path
+    from time import perf_counter
+
+    start_time = perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", str(Path(__file__).resolve()), "--help"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    elapsed_ms = round((perf_counter() - start_time) * 1000)
+
+    # Lines of -X importtime: "import time: self [us] | cumulative | imported package"
+    imports = []
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:"):].split("|")
+        imports.append((int(cumulative), module.rstrip()))
+
+    imported_heavy = sorted({
+        module.strip() for _, module in imports if module.strip().split(".")[0] in HEAVY_MODULES
+    })
+    print(f"`main.py --help` took {elapsed_ms} ms (budget {args.budget_ms} ms)")
+    print("Slowest top level imports:")
+    for cumulative, module in sorted(
+        [(cumulative, module) for cumulative, module in imports if not module.startswith("  ")], reverse=True
+    )[:args.top]:
+        print(f"  {round(cumulative / 1000, 1):>8} ms  {module.strip()}")
+
+    if imported_heavy:
+        print(f"Heavy modules imported at startup: {', '.join(imported_heavy)}")
+    return int(elapsed_ms > args.budget_ms or bool(imported_heavy))
+
+
+def build_parser() -> argparse.ArgumentParser:
+    from src.utils.paths import METRICS_DIR
+
+    parser = argparse.ArgumentParser(description='Parser')
+    parser.add_argument('-v', '--verbose', help='Verbose of logging module', type=int, default=3)
+    parser.add_argument('--cache-dir', help='Root directory of local caches (backups/cache by default)')
+    subparsers = parser.add_subparsers(dest='command', metavar='command', required=True)
+
+    mbank = subparsers.add_parser('mbank', aliases=['mbank-parse'], help='Parse mBank billings')
+    add_run_options(mbank)
+    mbank.set_defaults(handler=run_parsers, parser_name='mbank')
+
+    baselinker = subparsers.add_parser('baselinker', help='Parse Baselinker orders')
+    add_run_options(baselinker)
+    baselinker.set_defaults(handler=run_parsers, parser_name='baselinker')
+
+    batch = subparsers.add_parser('batch', help='Run several parsers on several spreadsheets')
+    add_run_options(batch)
+    batch.add_argument('--parsers', help='Parsers run on every spreadsheet', nargs='+', choices=PARSER_NAMES,
+                       default=PARSER_NAMES)
+    batch.set_defaults(handler=run_parsers)
+
+    watch_parser = subparsers.add_parser('watch', help='Keep running and rerun parsers when their inputs change')
+    add_run_options(watch_parser)
+    watch_parser.add_argument('--parsers', nargs='+', choices=PARSER_NAMES, default=PARSER_NAMES)
+    watch_parser.add_argument('--interval', help='Seconds between polls', type=float, default=30)
+    watch_parser.set_defaults(handler=watch)
+
+    history = subparsers.add_parser('history', help='Compare the latest run with the run history')
+    history.add_argument('spreadsheet_names', nargs='+')
+    history.add_argument('--parsers', nargs='+', choices=PARSER_NAMES, default=PARSER_NAMES)
+    history.add_argument('--threshold', help='Relative slowdown reported as a regression', type=float, default=0.25)
+    history.set_defaults(handler=check_regressions)
+
+    reconciliation = subparsers.add_parser('reconcile', help='Match Baselinker orders with incoming mBank transfers')
+    reconciliation.add_argument('spreadsheet_names', help='Spreadsheets the results are pushed to', nargs='+')
+    reconciliation.add_argument('--orders-spreadsheet', help='Spreadsheet with BaselinkerData, if it is another one')
+    reconciliation.add_argument('--payments-spreadsheet', help='Spreadsheet with ParsedData, if it is another one')
+    reconciliation.add_argument('--tolerance', help='Allowed difference of amounts', type=float, default=1.0)
+    reconciliation.add_argument('--days-before', help='Days the transfer can precede the order', type=float,
+                                default=7)
+    reconciliation.add_argument('--days-after', help='Days the transfer can follow the order', type=float, default=14)
+    reconciliation.add_argument('--metrics-dir', help='Directory for JSON and Prometheus step metrics',
+                                default=METRICS_DIR)
+    reconciliation.set_defaults(handler=reconcile)
+
+    preview = subparsers.add_parser('preview-rule', help='Show which parsed transactions a candidate rule matches')
+    preview.add_argument('spreadsheet_name', help='Spreadsheet with ParsedData worksheet')
+    preview.add_argument('--result-value', help='Category assigned by the rule')
+    for column in RULE_FIELDS:
+        preview.add_argument(f'--{column.lower().replace("_", "-")}', dest=column,
+                             help=f'Value of {column} column, as in PatternRules')
+    preview.add_argument('--candidates', help='YAML file with several candidate rules (format of --rules-file)')
+    preview.add_argument('--top', help='Number of transactions and conflicts shown', type=int, default=10)
+    preview.set_defaults(handler=preview_rule)
+
+    rates = subparsers.add_parser('rates', help='Show NBP exchange rates')
+    rates.add_argument('start', help='First day of the range, e.g. 2022-01-01')
+    rates.add_argument('end', help='Last day of the range (today by default)', nargs='?')
+    rates.add_argument('--currency', default='EUR')
+    rates.add_argument('--csv', help='Print rates as CSV', action='store_true')
+    rates.set_defaults(handler=show_rates)
+
+    cache = subparsers.add_parser('cache-info', help='Show local caches, their size and hit rates')
+    cache.set_defaults(handler=cache_info)
+
+    prune = subparsers.add_parser('cache-prune', help='Evict old and least recently used cache entries')
+    prune.add_argument('--max-mb', help='Size the caches are reduced to (configured limit by default)', type=float)
+    prune.add_argument('--max-age-days', help='Entries unused for longer are removed', type=float)
+    prune.add_argument('--namespaces', help='Only these caches are pruned', nargs='+')
+    prune.add_argument('--dry-run', help='Only list entries that would be removed', action='store_true')
+    prune.set_defaults(handler=cache_prune)
+
+    bench = subparsers.add_parser('benchmark', help='Run parsers on synthetic data and measure every step')
+    bench.add_argument('--parsers', nargs='+', choices=PARSER_NAMES, default=PARSER_NAMES)
+    bench.add_argument('--rows', help='Numbers of transactions / order lines', type=int, nargs='+', default=[10000])
+    bench.add_argument('--rules', help='Numbers of pattern rules (mBank only)', type=int, nargs='+', default=[100])
+    bench.add_argument('--repeat', help='Runs of every case, the following ones use warm caches', type=int, default=1)
+    bench.add_argument('--trace-memory', help='Trace python allocations per step', action='store_true')
+    bench.add_argument('--seed', type=int, default=0)
+    bench.add_argument('--rule-workers', help='Processes evaluating pattern rules (0 - all cores)', type=int)
+    bench.add_argument('--partitioned', help='Run MBankParser month by month', action='store_true')
+    bench.add_argument('--output-dir', help='Directory for JSON and CSV results (results/benchmarks by default)')
+    bench.set_defaults(handler=benchmark)
+
+    startup = subparsers.add_parser('startup-check', help='Check import time of the command line interface')
+    startup.add_argument('--budget-ms', help='Allowed startup time in milliseconds', type=int, default=300)
+    startup.add_argument('--top', help='Number of the slowest imports shown', type=int, default=10)
+    startup.set_defaults(handler=startup_check)
+
+    return parser
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.cache_dir:
+        from src.utils.cache import CACHE_ROOT_ENV
+
+        os.environ[CACHE_ROOT_ENV] = args.cache_dir
+    return args.handler(args)
+
+
 if __name__ == "__main__":
-    args = argparse.Namespace(spreadsheet_name='Analityka finansowa', verbose=2)
-    # args = argparse.Namespace(spreadsheet_name='TiA finanse', verbose=2)
-    exit(main(args))
+    sys.exit(main())
@@ -1,7 +1,7 @@
 cd ..\..
 CALL .\venv\Scripts\activate
 
-python .\main.py "Analityka finansowa"
+python .\main.py batch "Analityka finansowa"
 cd runners\windows
 
 cmd /k
\ No newline at end of file
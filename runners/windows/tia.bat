@@ -1,7 +1,7 @@
 cd ..\..
 CALL .\venv\Scripts\activate
 
-python .\main.py "TiA finanse"
+python .\main.py batch "TiA finanse"
 cd runners\windows
 
 cmd /k
\ No newline at end of file
@@ -0,0 +1,159 @@
+"""
+Batch runner executing several parsers on several spreadsheets in one process. Authorization with gspread is done
+once, and all jobs share the client, NBP exchange rates and other reference data. Jobs are independent (every parser
+writes only to its own worksheets), so they run concurrently in a thread pool - the work is dominated by network
+round trips, and threads, unlike processes, can share the authorized session and warm caches.
+
+Memory metrics of steps (RSS growth, traced allocations) are process-wide, so with several workers they include
+allocations of the other jobs running at the same time.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from time import perf_counter
+from typing import Dict, List, Optional, Sequence
+
+import gspread
+import structlog
+
+from src.data_sources import NBPApi, BaselinkerAPI
+from src.gdrive_connection.base import GSheetConnection
+from src.parsers import MBankParser, BaselinkerParser
+
+PARSERS = {
+    "mbank": MBankParser,
+    "baselinker": BaselinkerParser,
+}
+
+
+@dataclass
+class JobResult:
+    spreadsheet_name: str
+    parser_name: str
+    elapsed_time: float = None
+    step_times: Dict[str, float] = field(default_factory=dict)
+    warnings: List[str] = field(default_factory=list)
+    warning_count: int = 0
+    error: Optional[BaseException] = None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+
+class BatchRunner:
+    def __init__(
+        self,
+        spreadsheet_names: Sequence[str],
+        parser_names: Sequence[str] = tuple(PARSERS),
+        baselinker_api_key: str = "APIKEY",
+        max_workers: int = 4,
+        mbank_options: Optional[dict] = None,
+    ):
+        """
+        :param mbank_options: additional keyword arguments of MBankParser (billings_dir, rules_path, rule_workers,
+        partitioned)
+        """
+        unknown = set(parser_names) - set(PARSERS)
+        if unknown:
+            raise ValueError(f"Unknown parsers: {sorted(unknown)}. Possible values: {list(PARSERS)}")
+
+        self.logger = structlog.getLogger(__name__)
+
+        self.spreadsheet_names = list(dict.fromkeys(spreadsheet_names))
+        self.parser_names = list(dict.fromkeys(parser_names))
+        self.baselinker_api_key = baselinker_api_key
+        self.max_workers = max_workers
+        self.mbank_options = mbank_options or {}
+
+        self.client = gspread.service_account()
+        self.nbp_api = NBPApi()
+        self.baselinker_api = BaselinkerAPI()
+        self._connections: Dict[str, GSheetConnection] = {}
+
+    def connection(self, spreadsheet_name: str) -> GSheetConnection:
+        # Opened before the jobs are submitted, so workers only read this dictionary
+        if spreadsheet_name not in self._connections:
+            self._connections[spreadsheet_name] = GSheetConnection(spreadsheet_name, client=self.client)
+        return self._connections[spreadsheet_name]
+
+    def create_parser(self, spreadsheet_name: str, parser_name: str):
+        spreadsheet = self.connection(spreadsheet_name)
+        if parser_name == "mbank":
+            return MBankParser(
+                spreadsheet_name,
+                spreadsheet=spreadsheet,
+                nbp_api=self.nbp_api,
+                **self.mbank_options,
+            )
+        return BaselinkerParser(
+            spreadsheet_name,
+            self.baselinker_api_key,
+            spreadsheet=spreadsheet,
+            api=self.baselinker_api,
+            nbp_api=self.nbp_api,
+        )
+
+    def _run_job(self, spreadsheet_name: str, parser_name: str, run_options: dict) -> JobResult:
+        result = JobResult(spreadsheet_name, parser_name)
+        start_time = perf_counter()
+        parser = None
+        try:
+            parser = self.create_parser(spreadsheet_name, parser_name)
+            steps = parser.parse(**run_options)
+            result.step_times = steps.get_run_times()[0]
+        except Exception as exc:  # pylint: disable=broad-except
+            self.logger.exception("Job failed", spreadsheet=spreadsheet_name, parser=parser_name)
+            result.error = exc
+        finally:
+            result.elapsed_time = round(perf_counter() - start_time, 3)
+            if parser is not None:
+                # Aggregated warnings - one line per template, repeated ones with their count
+                result.warnings = parser.warnings.lines()
+                result.warning_count = len(parser.warnings)
+        return result
+
+    def run(self, **run_options) -> List[JobResult]:
+        """
+        Running every parser on every spreadsheet. Keyword arguments are passed to parse method of each parser.
+        """
+        for spreadsheet_name in self.spreadsheet_names:
+            self.connection(spreadsheet_name)
+
+        jobs = [
+            (spreadsheet_name, parser_name)
+            for spreadsheet_name in self.spreadsheet_names
+            for parser_name in self.parser_names
+        ]
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="batch") as executor:
+            futures = [executor.submit(self._run_job, *job, run_options) for job in jobs]
+            results = [future.result() for future in as_completed(futures)]
+
+        order = {job: position for position, job in enumerate(jobs)}
+        return sorted(results, key=lambda result: order[(result.spreadsheet_name, result.parser_name)])
+
+
+def format_summary(results: List[JobResult], warnings_per_job: int = 5) -> str:
+    header = f"{'spreadsheet':30} {'parser':12} {'status':8} {'time [s]':>9} {'warnings':>9}"
+    lines = [header, "-" * len(header)]
+    for result in results:
+        lines.append(
+            f"{result.spreadsheet_name:30} {result.parser_name:12} {'ok' if result.succeeded else 'FAILED':8} "
+            f"{result.elapsed_time:>9} {result.warning_count:>9}"
+        )
+
+    for result in results:
+        if not result.warnings and result.succeeded:
+            continue
+        lines.append(f"\n{result.spreadsheet_name} / {result.parser_name}")
+        if not result.succeeded:
+            lines.append(f"  error: {result.error!r}")
+        for warning in result.warnings[:warnings_per_job]:
+            lines.append(f"  - {warning}")
+        if len(result.warnings) > warnings_per_job:
+            lines.append(f"  ... and {len(result.warnings) - warnings_per_job} more")
+
+    total_time = sum(result.elapsed_time for result in results)
+    lines.append(f"\nJobs: {len(results)}, failed: {sum(not result.succeeded for result in results)}, "
+                 f"summed job time: {round(total_time, 2)} s")
+    return "\n".join(lines)
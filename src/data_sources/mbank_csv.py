@@ -0,0 +1,73 @@
+"""
+Reading of mBank CSV exports ("Lista operacji") straight from local files. Exports are encoded in cp1250, use a
+semicolon as separator and start with a preamble (account holder, period, balances) that ends with the header line
+starting with "#Data operacji". The resulting frame has the same columns as billings downloaded from MbankBilling
+worksheets.
+"""
+
+from pathlib import Path
+from typing import List, Union
+
+import pandas as pd
+import structlog
+
+MBANK_CSV_ENCODING = "cp1250"
+HEADER_MARKER = "#Data operacji"
+BILLING_COLUMNS = ["#Data operacji", "#Opis operacji", "#Rachunek", "#Kategoria", "#Kwota"]
+
+logger = structlog.getLogger(__name__)
+
+
+def find_header_line(path: Path, encoding: str = MBANK_CSV_ENCODING) -> int:
+    """
+    Number of the line with column names - everything above it is a preamble of the export.
+    """
+    with open(path, encoding=encoding, newline="") as stream:
+        for line_no, line in enumerate(stream):
+            if line.lstrip("\ufeff").startswith(HEADER_MARKER):
+                return line_no
+    raise ValueError(f'File {path} does not contain "{HEADER_MARKER}" header line')
+
+
+def read_mbank_csv(path: Union[str, Path], encoding: str = MBANK_CSV_ENCODING) -> pd.DataFrame:
+    """
+    Transactions of a single mBank export.
+    """
+    path = Path(path)
+    billing = pd.read_csv(
+        path,
+        sep=";",
+        encoding=encoding,
+        skiprows=find_header_line(path, encoding),
+        usecols=lambda column: column in BILLING_COLUMNS,
+        dtype=str,
+        keep_default_na=False,
+        skip_blank_lines=True,
+        on_bad_lines="skip",
+    )
+    # Summary lines placed below transactions do not start with a date
+    billing = billing[billing[HEADER_MARKER].str.match(r"\d{4}-\d{2}-\d{2}")]
+    return billing[BILLING_COLUMNS].apply(lambda column: column.str.strip()).reset_index(drop=True)
+
+
+def list_mbank_csv_files(folder: Union[str, Path], pattern: str = "*.csv") -> List[Path]:
+    return sorted(path for path in Path(folder).glob(pattern) if path.is_file())
+
+
+def read_mbank_csv_folder(
+    folder: Union[str, Path], pattern: str = "*.csv", encoding: str = MBANK_CSV_ENCODING
+) -> pd.DataFrame:
+    """
+    All exports found in the folder, concatenated into one frame of raw billings. Name of the file every row comes
+    from is kept in the `source` column.
+    """
+    files = list_mbank_csv_files(folder, pattern)
+    if not files:
+        raise FileNotFoundError(f"There are no mBank exports matching {pattern} in {folder}")
+
+    billings = []
+    for path in files:
+        billing = read_mbank_csv(path, encoding)
+        logger.info("mBank export parsed", file=path.name, rows=billing.shape[0])
+        billings.append(billing.assign(source=path.name))
+    return pd.concat(billings, ignore_index=True)
@@ -2,31 +2,42 @@ import requests
 from dateutil.parser import parse
 import pandas as pd
 from datetime import timedelta
-from pathlib import Path
+from threading import Lock
+from typing import Dict, Optional
 import structlog
 
 from more_itertools import chunked
 
+from src.utils.cache import LocalCache
+
 
 class NBPApi:
-    def __init__(self):
+    def __init__(self, cache: LocalCache = None):
         self.logger = structlog.getLogger(__name__)
-        self.cached_rates = (
-            pd.read_pickle("rates_cached.pkl")
-            if Path("rates_cached.pkl").exists()
-            else None
-        )
+        self._lock = Lock()
+        self.cache = cache or LocalCache("nbp_rates")
+        # EUR rates cached in the working directory by the previous versions
+        self.cache.migrate_legacy_file("EUR", "rates_cached.pkl")
+        self.cached_rates: Dict[str, Optional[pd.DataFrame]] = {}
+
+    def _cached(self, currency: str) -> Optional[pd.DataFrame]:
+        if currency not in self.cached_rates:
+            self.cached_rates[currency] = self.cache.get(currency)
+        return self.cached_rates[currency]
 
-    # TODO zrobić solidny cache z uwzglednieniem walut
     def get_rates(self, date_range, currency="EUR") -> pd.DataFrame:
+        # One NBPApi instance can be shared by parsers running in several threads
+        with self._lock:
+            return self._get_rates(date_range, currency)
+
+    def _get_rates(self, date_range, currency="EUR") -> pd.DataFrame:
 
         start_date, end_date = date_range[0], date_range[-1]
-        if self.cached_rates is not None:
-            if (self.cached_rates["date"].min() <= start_date) and (
-                self.cached_rates["date"].max() >= end_date
-            ):
-                self.logger.info("All rates already cached. Proceeding")
-                return self.cached_rates
+        cached = self._cached(currency)
+        if cached is not None:
+            if (cached["date"].min() <= start_date) and (cached["date"].max() >= end_date):
+                self.logger.info("All rates already cached. Proceeding", currency=currency)
+                return cached
 
         results = []
         for batch in chunked(date_range, 350):
@@ -43,7 +54,8 @@ class NBPApi:
             .drop("table", axis=1)
         )
 
-        data.to_pickle("rates_cached.pkl")
+        self.cache.set(currency, data)
+        self.cached_rates[currency] = data
 
         return data
 
@@ -1,18 +1,25 @@
 # https://www.youtube.com/watch?v=bu5wXjz2KvU
 
+from typing import Callable
+
 import gspread
 import pandas as pd
 import structlog
 
+from src.utils.dtypes import to_plain_dtypes
+
 
 class GSheetConnection:
-    def __init__(self, file_name: str, create_if_missing: bool = False):
+    def __init__(self, file_name: str, create_if_missing: bool = False, client: gspread.Client = None):
 
         # Authorization requires service_account.json with credentials located in ~/.config/gspread directory
+        # Already authorized client can be passed to share one session between several connections
         self.logger = structlog.getLogger(__name__)
 
-        self.gc = gspread.service_account()
+        self.gc = client or gspread.service_account()
         self.spreadsheet = self._get_spreadsheet(file_name, create_if_missing)
+        # Titles of worksheets written through GWorksheet - watch mode tells writes of parsers from edits of users
+        self.written_worksheets = set()
 
     def __getitem__(self, sheet_name):
         if type(sheet_name) == str:
@@ -20,7 +27,7 @@ class GSheetConnection:
         else:
             raise NotImplementedError(f"{type(sheet_name)} is not implemented at the moment")
         self.logger.debug("Worksheet found and hooked on.", worksheet=sheet)
-        return GWorksheet(sheet)
+        return GWorksheet(sheet, on_write=self.written_worksheets.add)
 
     def new_worksheet(self, sheet_name):
         return self._get_spreadsheet(sheet_name, True)
@@ -75,12 +82,99 @@ class GSheetConnection:
 
 
 class GWorksheet:
-    def __init__(self, worksheet):
+    def __init__(self, worksheet, on_write: Callable[[str], None] = None):
+        """
+        :param on_write: called with the title of the worksheet whenever data is written into it
+        """
         self.logger = structlog.getLogger(__name__)
         self.worksheet = worksheet
+        self.on_write = on_write
 
-    def get_data(self) -> pd.DataFrame:
-        return pd.DataFrame(self.worksheet.get_all_records())
+    def mark_written(self):
+        if self.on_write is not None:
+            self.on_write(self.worksheet.title)
+
+    def get_data(self, value_render_option: gspread.utils.ValueRenderOption = None) -> pd.DataFrame:
+        """
+        :param value_render_option: formatted values if not given - UNFORMATTED_VALUE reads dates and amounts as
+        numbers, whatever the format of their cells
+        """
+        return pd.DataFrame(self.worksheet.get_all_records(value_render_option=value_render_option))
 
     def update_data(self, data):
+        self.mark_written()
+        data = to_plain_dtypes(data)
         self.worksheet.update([data.columns.values.tolist()] + data.fillna("").values.tolist())
+
+    def update_from_row(self, data: pd.DataFrame, first_row: int, previous_rows: int = 0):
+        """
+        Rewriting only rows of the data starting from `first_row` (0 based, header excluded). Rows left over from the
+        previous, longer version of the data (`previous_rows`) are cleared.
+        """
+        if first_row == 0:
+            self.worksheet.clear()
+            self.update_data(data)
+            return
+
+        self.mark_written()
+        data = to_plain_dtypes(data)
+        values = data.iloc[first_row:].fillna("").values.tolist()
+        if values:
+            self.worksheet.update(range_name=f"A{first_row + 2}", values=values)
+        if previous_rows > data.shape[0]:
+            last_cell = gspread.utils.rowcol_to_a1(previous_rows + 1, data.shape[1])
+            self.worksheet.batch_clear([f"A{data.shape[0] + 2}:{last_cell}"])
+
+
+class GWorksheetWriter:
+    """
+    Writing a frame into a worksheet part by part, e.g. month after month. Rows are buffered and sent in batches, so
+    neither the whole frame nor all its values have to be held in memory. The worksheet is cleared before the first
+    batch is written.
+    """
+
+    BATCH_ROWS = 10000
+
+    def __init__(self, worksheet: GWorksheet, batch_rows: int = BATCH_ROWS):
+        self.worksheet = worksheet
+        self.batch_rows = batch_rows
+        self.columns = None
+        self._next_row = 1
+        self._buffer = []
+
+    @property
+    def rows_written(self) -> int:
+        # Header excluded
+        return max(self._next_row - 2, 0)
+
+    def write(self, data: pd.DataFrame):
+        if self.columns is None:
+            self.columns = data.columns.values.tolist()
+            self.worksheet.worksheet.clear()
+            self._buffer.append(self.columns)
+        elif data.columns.values.tolist() != self.columns:
+            raise ValueError(f"Columns of the written part {data.columns.values.tolist()} differ from {self.columns}")
+
+        self._buffer.extend(to_plain_dtypes(data).fillna("").values.tolist())
+        if len(self._buffer) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        self.worksheet.mark_written()
+        self.worksheet.worksheet.update(range_name=f"A{self._next_row}", values=self._buffer)
+        self._next_row += len(self._buffer)
+        self._buffer = []
+
+    def close(self):
+        if self.columns is None:
+            self.worksheet.mark_written()
+            self.worksheet.worksheet.clear()
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
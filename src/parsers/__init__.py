@@ -1,2 +1,3 @@
 from src.parsers.mbank.mbank_parser import MBankParser
 from src.parsers.baselinker.baselinker import BaselinkerParser
+from src.parsers.reconciliation.reconciliation_parser import ReconciliationParser
@@ -0,0 +1,100 @@
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, Optional
+
+import structlog
+
+from src.gdrive_connection.base import GSheetConnection
+from src.utils.metrics import MetricsExport
+from src.utils.paths import PROFILES_DIR
+from src.utils.run_history import RunHistory
+from src.utils.steps import apply_steps, Steps
+from src.utils.warnings_sink import WarningsSink
+
+
+class BaseParser(ABC):
+    """
+    Common interface of parsers - building and running Steps pipeline, collecting warnings and resuming the pipeline
+    from a checkpoint when only some of the input worksheets have changed.
+    """
+
+    # Worksheets read by the pipeline (or prefixes of their titles), mapped to the last step that does not depend on
+    # them. None means that a change of the worksheet requires running the whole pipeline.
+    INPUT_WORKSHEETS: Dict[str, Optional[str]] = {}
+
+    def __init__(self, spreadsheet_name: str, spreadsheet: GSheetConnection = None):
+        self.logger = structlog.getLogger(type(self).__module__)
+
+        self.spreadsheet_name = spreadsheet_name
+        self.spreadsheet = spreadsheet or GSheetConnection(spreadsheet_name)
+
+        self.warnings = WarningsSink(self.logger)
+        self.steps: Optional[Steps] = None
+        self._checkpoint_warnings = {}
+
+    def _warn_with_caching(self, message, **params):
+        """
+        :param message: message template - warnings with the same template are aggregated, params are filled in
+        """
+        self.warnings.warn(message, **params)
+
+    @abstractmethod
+    def build_steps(self) -> Steps:
+        raise NotImplementedError
+
+    @property
+    def checkpoints(self):
+        return [step for step in self.INPUT_WORKSHEETS.values() if step is not None]
+
+    def resume_point(self, changed_worksheets: Iterable[str]) -> Optional[str]:
+        """
+        The latest checkpoint from which the pipeline can be rerun after given worksheets have changed. None means that
+        the whole pipeline has to be run.
+        """
+        step_names = [step.function.__name__ for step in (self.steps or self.build_steps())]
+        resume_points = []
+        for worksheet in changed_worksheets:
+            for input_worksheet, step in self.INPUT_WORKSHEETS.items():
+                if worksheet.startswith(input_worksheet):
+                    if step is None:
+                        return None
+                    resume_points.append(step)
+        if not resume_points:
+            return None
+        return min(resume_points, key=step_names.index)
+
+    def parse(
+        self,
+        metrics_dir=None,
+        trace_memory=False,
+        profile=False,
+        record_history=True,
+        keep_checkpoints=False,
+        resume_after=None,
+    ) -> Steps:
+        """
+        Running the whole pipeline, or only its part after `resume_after` step, if its checkpoint was kept in the
+        previous run.
+        """
+        if resume_after is not None and self.steps is not None and self.steps.has_checkpoint(resume_after):
+            self.warnings.rollback(self._checkpoint_warnings[resume_after])
+        else:
+            resume_after = None
+            self.steps = self.build_steps()
+            self.warnings.clear()
+
+        labels = dict(parser=type(self).__name__, spreadsheet=self.spreadsheet_name)
+        apply_steps(
+            self.steps,
+            steps_name=labels["parser"],
+            logger=self.logger,
+            metrics_export=MetricsExport(metrics_dir, labels) if metrics_dir else None,
+            trace_memory=trace_memory,
+            profile_dir=PROFILES_DIR.joinpath(*labels.values()) if profile else None,
+            checkpoints=self.checkpoints if keep_checkpoints else (),
+            resume_after=resume_after,
+            on_checkpoint=lambda step: self._checkpoint_warnings.__setitem__(step, self.warnings.mark()),
+        )
+        self.warnings.log_summary()
+        if record_history and resume_after is None:
+            RunHistory().record_run(self.spreadsheet_name, labels["parser"], self.steps.get_metrics())
+        return self.steps
@@ -3,54 +3,59 @@ from src.data_sources.baselinker.utils import (
     filter_orders_without_products,
     flatten_products,
 )
-from src.utils.steps import apply_steps
+from src.utils.steps import Steps
 from src.data_sources.baselinker.utils import get_orders_from_baselinker_dict
-from src.data_sources import BaselinkerAPI
-from src.parsers.baselinker.utils import convert_pandas_datetime_to_timestamps
+from src.data_sources import BaselinkerAPI, NBPApi
+from src.parsers.base import BaseParser
+from src.parsers.baselinker.currencies import RATES_LOOKBACK_DAYS, convert_currencies, excel_dates_to_datetime
+from src.parsers.baselinker.product_index import SUGGESTION_COLUMNS, ProductNameIndex
+from src.parsers.baselinker.utils import convert_pandas_datetime_to_timestamps, drop_duplicated_order_lines
+from src.utils.cache import LocalCache
 from src.utils.gsheet_types import datetime_to_excel_date
 from src.utils.utils import get_country_to_iso_code_map
-import structlog
 import xmltodict as xml
+import hashlib
 from pathlib import Path
 import pandas as pd
 
 
-class BaselinkerParser:
+class BaselinkerParser(BaseParser):
+    INPUT_WORKSHEETS = {
+        "BaselinkerProductMap": "cache_the_data",
+    }
 
-    def __init__(self, spreadsheet_name: str, api_key: str):
-        self.logger = structlog.getLogger(__name__)
+    def __init__(
+        self,
+        spreadsheet_name: str,
+        api_key: str,
+        spreadsheet: GSheetConnection = None,
+        api: BaselinkerAPI = None,
+        nbp_api: NBPApi = None,
+    ):
+        super().__init__(spreadsheet_name, spreadsheet)
 
         self.api_key = api_key
-        self.api = BaselinkerAPI()
+        self.api = api or BaselinkerAPI()
+        self.nbp_api = nbp_api or NBPApi()
 
-        self.cached_orders = (
-            pd.read_pickle("order_cached.pkl")
-            if Path("order_cached.pkl").exists()
-            else pd.DataFrame([])
-        )
-
-        self.spreadsheet = GSheetConnection(spreadsheet_name)
-        self.warnings = []
-
-    # TODO Parser jako interfejs
-    def _warn_with_caching(self, message):
-        self.warnings.append(message)
-        self.logger.warning(message)
-
-    def parse(self):
+        self.archive_cache = LocalCache("baselinker_archive")
+        self.orders_cache = LocalCache("baselinker_orders")
+        # Orders of different Baselinker accounts are cached separately
+        self.orders_cache_key = hashlib.sha1(api_key.encode()).hexdigest()[:16]
+        self.orders_cache.migrate_legacy_file(self.orders_cache_key, "order_cached.pkl")
 
-        steps = [
+    def build_steps(self) -> Steps:
+        return Steps([
             (self.add_archive_xml_orders, {}),
             (self.add_newest_orders, {}),
             (self.process_the_data, {}),
             (self.add_cached_orders, {}),
             (self.cache_the_data, {}),
+            (self.calculate_currencies, {}),
             (self.merge_mappings, {}),
             (self.refresh_mappings_with_new_products, {}),
             (self.send_data, {})
-        ]
-
-        apply_steps(steps, logger=self.logger)
+        ])
 
     def add_archive_xml_orders(self, dummy=None):
         # TODO ogarnąć dynamiczne ścieżki
@@ -59,6 +64,13 @@ class BaselinkerParser:
             self._warn_with_caching('Archive was not available. Some of the orders might be missing')
             return pd.DataFrame([])
         else:
+            stat = xml_path.stat()
+            fingerprint = (stat.st_size, stat.st_mtime_ns)
+            cached = self.archive_cache.get("xml_orders")
+            if cached is not None and cached["fingerprint"] == fingerprint:
+                self.logger.info("Xml archive loaded from cache", orders=len(cached["orders"]))
+                return cached["orders"]
+
             self.logger.info('Processing xml archive...')
             with open(xml_path, 'rb') as stream:
                 baselinker_orders = xml.parse(stream)['orders']['order']
@@ -67,6 +79,7 @@ class BaselinkerParser:
 
             baselinker_orders = get_orders_from_baselinker_dict(baselinker_orders)
             baselinker_orders = self._xml_orders_data_preparation(baselinker_orders)
+            self.archive_cache.set("xml_orders", dict(fingerprint=fingerprint, orders=baselinker_orders))
 
             self.logger.info(f"Successfully parsed {len(baselinker_orders)} orders from xml archive.")
             return baselinker_orders
@@ -86,7 +99,17 @@ class BaselinkerParser:
         return archived
 
     def add_cached_orders(self, orders: pd.DataFrame) -> pd.DataFrame:
-        return pd.concat([orders, self.cached_orders]).drop_duplicates()
+        # Fresh orders go last, so they win over the cached versions of the same order lines
+        cached_orders = self.orders_cache.get(self.orders_cache_key, pd.DataFrame([]))
+        orders, collisions = drop_duplicated_order_lines(pd.concat([cached_orders, orders], ignore_index=True))
+        if not collisions.empty:
+            self._warn_with_caching(
+                "{count} duplicated order lines differed in quantity or price, the newest version was kept. "
+                "Order ids: {order_ids}.",
+                count=collisions.shape[0],
+                order_ids=" ".join(collisions["order_id"].astype(str).unique()[:20]),
+            )
+        return orders
 
     def add_newest_orders(self, orders: pd.DataFrame) -> pd.DataFrame:
         recent_orders = get_orders_from_baselinker_dict(
@@ -95,13 +118,10 @@ class BaselinkerParser:
         return pd.concat([orders, recent_orders])
 
     def cache_the_data(self, orders: pd.DataFrame) -> pd.DataFrame:
-        # TODO prosta bazka lub cachowanie w jakieś konkretne miejsce
-        orders.to_pickle("order_cached.pkl")
+        self.orders_cache.set(self.orders_cache_key, orders)
         return orders
 
     def process_the_data(self, orders: pd.DataFrame) -> pd.DataFrame:
-        orders = orders.drop_duplicates()
-
         orders['date_confirmed'] = pd.to_datetime(orders['date_confirmed'], unit='s')
         orders["year"] = orders["date_confirmed"].dt.year
         orders["month"] = orders["date_confirmed"].dt.month
@@ -112,9 +132,33 @@ class BaselinkerParser:
 
         return orders
 
+    def calculate_currencies(self, orders: pd.DataFrame) -> pd.DataFrame:
+        """
+        Prices and payments converted into PLN and EUR, so they do not have to be converted by formulas in the sheet.
+        """
+        if orders.empty:
+            return orders
+
+        dates = excel_dates_to_datetime(orders["date_confirmed"])
+        date_range = pd.date_range(
+            dates.min() - pd.Timedelta(days=RATES_LOOKBACK_DAYS), min(dates.max(), pd.Timestamp.today())
+        )
+        currencies = set(orders["currency"].astype(str).str.upper()) - {"PLN"}
+        rates = {}
+        for currency in sorted(currencies | {"EUR"}):
+            try:
+                rates[currency] = self.nbp_api.get_rates(date_range, currency)
+            except (ValueError, KeyError):
+                self._warn_with_caching(
+                    "NBP has no rates of {currency}, amounts of orders in this currency are not converted.",
+                    currency=currency,
+                )
+        return convert_currencies(orders, rates)
+
     def merge_mappings(self, orders: pd.DataFrame) -> pd.DataFrame:
         product_map = self.spreadsheet["BaselinkerProductMap"].get_data()
-        return orders.merge(product_map.drop(columns='attributes'), how='left', on='name')
+        product_map = product_map.drop(columns=['attributes', *SUGGESTION_COLUMNS], errors='ignore')
+        return orders.merge(product_map, how='left', on='name')
 
     def refresh_mappings_with_new_products(self, orders: pd.DataFrame) -> pd.DataFrame:
         new_map = (
@@ -124,6 +168,17 @@ class BaselinkerParser:
             .sort_values('master_product')
         )
 
+        unmapped = new_map['master_product'].fillna('').astype(str).str.strip() == ''
+        index = ProductNameIndex(new_map)
+        suggestions = index.suggestions_frame(new_map.loc[unmapped, 'name'])
+        new_map = new_map.join(suggestions)
+        self.logger.info(
+            "Product suggestions prepared",
+            indexed=len(index),
+            unmapped=int(unmapped.sum()),
+            suggested=int((suggestions['suggestion_score'] != '').sum()),
+        )
+
         new_map_with_nulls_on_top = new_map.loc[reversed(new_map.index)]
         ws = self.spreadsheet["BaselinkerProductMap"]
         ws.worksheet.clear()
@@ -0,0 +1,57 @@
+"""
+Conversion of order amounts into PLN and EUR with NBP mid rates. Every order line takes the rate published on its
+confirmation day, or the last one before it (weekends and holidays) - found for all lines in a currency with a single
+binary search over the sorted rates of that currency.
+"""
+
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+CONVERTED_COLUMNS = ["price_brutto", "payment_done"]
+# Rates are fetched from a few days before the first order, so the first lines have a previous rate as well
+RATES_LOOKBACK_DAYS = 7
+
+
+def excel_dates_to_datetime(serial_dates: pd.Series) -> pd.Series:
+    # Inverse of datetime_to_excel_date, which BaselinkerParser applies to date_confirmed
+    return pd.to_datetime(pd.to_numeric(serial_dates, errors="coerce"), unit="D", origin="1899-12-30")
+
+
+def rates_as_of(dates: np.ndarray, rates: pd.DataFrame) -> np.ndarray:
+    """
+    Rate of the given day or the last published before it, NaN for days before the first rate.
+    """
+    rates = rates.sort_values("date")
+    positions = np.searchsorted(rates["date"].to_numpy(dtype="datetime64[ns]"), dates, side="right") - 1
+    values = rates["rate"].to_numpy(dtype=float)
+    return np.where(positions >= 0, values[np.clip(positions, 0, None)], np.nan)
+
+
+def convert_currencies(
+    orders: pd.DataFrame, rates: Dict[str, pd.DataFrame], columns: List[str] = CONVERTED_COLUMNS
+) -> pd.DataFrame:
+    """
+    Adding <column>_PLN and <column>_EUR for every converted column.
+    :param rates: NBP rates (date, rate) of every currency other than PLN - lines in currencies without rates, and
+    EUR amounts if EUR rates are missing, stay empty
+    """
+    dates = excel_dates_to_datetime(orders["date_confirmed"]).to_numpy(dtype="datetime64[ns]")
+    currencies = orders["currency"].astype(str).str.upper().to_numpy()
+
+    to_pln = np.where(currencies == "PLN", 1.0, np.nan)
+    for currency, currency_rates in rates.items():
+        in_currency = currencies == currency
+        if in_currency.any():
+            to_pln[in_currency] = rates_as_of(dates[in_currency], currency_rates)
+    eur_rate = rates_as_of(dates, rates["EUR"]) if "EUR" in rates else np.full(len(dates), np.nan)
+
+    converted = {}
+    for column in columns:
+        amount = pd.to_numeric(orders[column], errors="coerce").to_numpy(dtype=float)
+        pln = amount * to_pln
+        converted[f"{column}_PLN"] = np.round(pln, 2)
+        # Amounts already in EUR are kept as they are, not converted there and back
+        converted[f"{column}_EUR"] = np.round(np.where(currencies == "EUR", amount, pln / eur_rate), 2)
+    return orders.assign(**converted)
@@ -0,0 +1,114 @@
+"""
+Suggestions for products from BaselinkerProductMap which were not mapped by hand yet. Names of already mapped
+products are split into character trigrams and words, kept in an inverted index (trigram -> products containing it),
+so every new name is compared only with products sharing its rarer trigrams instead of the whole map.
+"""
+
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, List, Optional
+
+import pandas as pd
+
+MAPPED_COLUMNS = ["master_product", "battery_type", "battery_size"]
+SUGGESTION_COLUMNS = [f"suggested_{column}" for column in MAPPED_COLUMNS] + ["suggestion_score"]
+
+# Trigrams present in more than this share of products ("bat", "akumulator" parts...) do not narrow the search
+MAX_POSTING_SHARE = 0.2
+CANDIDATES_TO_SCORE = 20
+
+
+def normalize_name(name: str) -> str:
+    name = unicodedata.normalize("NFKD", str(name).replace("ł", "l").replace("Ł", "L"))
+    name = "".join(char for char in name if not unicodedata.combining(char))
+    return " ".join(re.findall(r"[a-z0-9]+", name.lower()))
+
+
+def name_trigrams(name: str) -> FrozenSet[str]:
+    padded = f"  {normalize_name(name)} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def name_tokens(name: str) -> FrozenSet[str]:
+    return frozenset(normalize_name(name).split())
+
+
+@dataclass
+class Suggestion:
+    name: str
+    score: float
+    values: Dict[str, str]
+
+
+class ProductNameIndex:
+    def __init__(self, product_map: pd.DataFrame, mapped_columns: List[str] = MAPPED_COLUMNS):
+        """
+        :param product_map: BaselinkerProductMap rows, only the ones with filled master_product are indexed
+        """
+        mapped = product_map[product_map["master_product"].fillna("").astype(str).str.strip() != ""]
+        mapped = mapped.drop_duplicates("name")
+
+        self.names = mapped["name"].astype(str).tolist()
+        self.values = mapped[mapped_columns].fillna("").to_dict("records")
+        self.trigrams = [name_trigrams(name) for name in self.names]
+        self.tokens = [name_tokens(name) for name in self.names]
+
+        self.postings = defaultdict(list)
+        for product_id, trigrams in enumerate(self.trigrams):
+            for trigram in trigrams:
+                self.postings[trigram].append(product_id)
+        self.max_postings = max(1, int(len(self.names) * MAX_POSTING_SHARE))
+
+    def __len__(self):
+        return len(self.names)
+
+    def _candidates(self, trigrams: FrozenSet[str]) -> List[int]:
+        counts = Counter()
+        for trigram in trigrams:
+            posting = self.postings.get(trigram, ())
+            if len(posting) <= self.max_postings:
+                counts.update(posting)
+        if not counts:
+            # Name built only from very common trigrams - falling back to them
+            for trigram in trigrams:
+                counts.update(self.postings.get(trigram, ()))
+        return [product_id for product_id, _ in counts.most_common(CANDIDATES_TO_SCORE)]
+
+    def _score(self, product_id: int, trigrams: FrozenSet[str], tokens: FrozenSet[str]) -> float:
+        """
+        Dice coefficient of trigrams (typos, glued words) weighted with Jaccard index of words (word order, extras).
+        """
+        indexed_trigrams, indexed_tokens = self.trigrams[product_id], self.tokens[product_id]
+        dice = 2 * len(trigrams & indexed_trigrams) / (len(trigrams) + len(indexed_trigrams))
+        union = tokens | indexed_tokens
+        jaccard = len(tokens & indexed_tokens) / len(union) if union else 0.0
+        return 0.7 * dice + 0.3 * jaccard
+
+    def suggest(self, name: str, min_score: float = 0.5) -> Optional[Suggestion]:
+        trigrams, tokens = name_trigrams(name), name_tokens(name)
+        if not trigrams or not self.names:
+            return None
+
+        scored = ((self._score(product_id, trigrams, tokens), product_id) for product_id in self._candidates(trigrams))
+        score, product_id = max(scored, default=(0.0, None))
+        if product_id is None or score < min_score:
+            return None
+        return Suggestion(self.names[product_id], round(score, 3), self.values[product_id])
+
+    def suggestions_frame(self, names: pd.Series, min_score: float = 0.5) -> pd.DataFrame:
+        """
+        Suggested mapping for every name - columns from SUGGESTION_COLUMNS, empty where nothing similar was found.
+        """
+        rows = []
+        for name in names:
+            suggestion = self.suggest(name, min_score)
+            if suggestion is None:
+                rows.append({column: "" for column in SUGGESTION_COLUMNS})
+            else:
+                rows.append({
+                    **{f"suggested_{column}": value for column, value in suggestion.values.items()},
+                    "suggestion_score": suggestion.score,
+                })
+        return pd.DataFrame(rows, index=names.index, columns=SUGGESTION_COLUMNS)
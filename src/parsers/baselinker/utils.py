@@ -1,6 +1,50 @@
+from typing import List, Tuple
+
 import pandas as pd
 
+# Natural key of a single order line (one product of one order) and the columns which should agree between duplicates
+ORDER_LINE_KEY = ["order_id", "name", "attributes"]
+ORDER_LINE_PAYLOAD = ["quantity", "price_brutto"]
+
 
 def convert_pandas_datetime_to_timestamps(series: pd.Series) -> pd.Series:
     series = pd.to_datetime(series, dayfirst=True).apply(lambda ts: ts.timestamp())
     return series.map(int)
+
+
+def order_line_keys(orders: pd.DataFrame, key_columns: List[str] = ORDER_LINE_KEY) -> pd.Series:
+    """
+    64-bit hash of normalized natural keys of order lines. Ids are compared as integers (archive, API and cache store
+    them as ints, floats or strings), product names and attributes case and whitespace insensitive.
+    """
+    key = pd.DataFrame(index=orders.index)
+    for column in key_columns:
+        values = orders[column] if column in orders.columns else pd.Series("", index=orders.index)
+        numeric = pd.to_numeric(values, errors="coerce")
+        if values.notna().any() and numeric.notna().sum() == values.notna().sum():
+            key[column] = numeric.round().astype("Int64").astype(str)
+        else:
+            key[column] = values.fillna("").astype(str).str.lower().str.split().str.join(" ")
+    return pd.util.hash_pandas_object(key, index=False)
+
+
+def drop_duplicated_order_lines(
+    orders: pd.DataFrame, key_columns: List[str] = ORDER_LINE_KEY, keep: str = "last"
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Single deduplication stage of order lines, hashing only the natural key. Lines sharing a key, but differing in
+    quantity or price are collisions - the `keep` one wins, the others are reported.
+    :return: frame without duplicates and collided rows which were dropped
+    """
+    keys = order_line_keys(orders, key_columns)
+    duplicated = keys.duplicated(keep=keep).to_numpy()
+    if not duplicated.any():
+        return orders, orders.iloc[:0]
+
+    payload = [column for column in ORDER_LINE_PAYLOAD if column in orders.columns]
+    payload_keys = pd.util.hash_pandas_object(
+        orders[payload].apply(lambda column: pd.to_numeric(column, errors="coerce").round(2)), index=False
+    )
+    distinct_payloads = payload_keys.groupby(keys.to_numpy()).transform("nunique").to_numpy()
+    collided = duplicated & (distinct_payloads > 1)
+    return orders.loc[~duplicated], orders.loc[collided]
@@ -1,31 +1,114 @@
+import hashlib
+import json
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
 import numpy as np
 import pandas as pd
-import structlog
-
 from src.data_sources import NBPApi, BaselinkerAPI
-from src.gdrive_connection.base import GSheetConnection
+from src.data_sources.mbank_csv import read_mbank_csv_folder
+from src.gdrive_connection.base import GSheetConnection, GWorksheet, GWorksheetWriter
 from src.parsers.mbank.mapping_rules import MappingRule, MappingRules
+from src.parsers.mbank.partitions import (
+    ParsedPartition,
+    PartitionsSummary,
+    fingerprint,
+    is_closed,
+    split_by_month,
+    transaction_months,
+)
+from src.parsers.mbank.rollups import compute_rollups, first_changed_row
+from src.parsers.mbank.rule_set import CompiledRuleSet, rule_records_from_frame, rule_records_from_yaml
+from src.parsers.base import BaseParser
+from src.parsers.mbank.utils import drop_duplicated_transactions, parse_amounts
+from src.utils.cache import LocalCache
 from src.utils.gsheet_types import datetime_to_excel_date
-from src.utils.steps import apply_steps
-
-
-class MBankParser:
-    def __init__(self, spreadsheet_name: str):
-        self.logger = structlog.getLogger(__name__)
-
-        self.nbp_api = NBPApi()
+from src.utils.dtypes import compact_dtypes, fill_missing, memory_report
+from src.utils.steps import Steps
+
+# Low cardinality text columns kept as categoricals through the whole pipeline
+CATEGORICAL_COLUMNS = ["mbank_category", "type", "currency", "account"]
+BILLING_LOADING_WORKERS = 4
+# Columns of mBank exports read by the parser (date, description, account, category, amount) - their hash detects new,
+# replaced and corrected statements
+BILLING_PROBE_RANGE = "A:E"
+# Transactions equal in these columns (those present in the export) are the same transaction
+DUPLICATE_KEY_COLUMNS = ["date", "description", "account", "amount", "currency"]
+
+
+def hash_billing_contents(spreadsheet, titles: Sequence[str]) -> List[str]:
+    """
+    Hashes of the columns read from billing worksheets, fetched for all worksheets in a single request. Used by the
+    billings cache and by watch mode.
+    :param spreadsheet: gspread Spreadsheet
+    """
+    if not titles:
+        return []
+    value_ranges = spreadsheet.values_batch_get([f"'{title}'!{BILLING_PROBE_RANGE}" for title in titles])
+    return [
+        hashlib.sha1(json.dumps(value_range.get("values", []), ensure_ascii=False).encode()).hexdigest()
+        for value_range in value_ranges["valueRanges"]
+    ]
+
+
+class MBankParser(BaseParser):
+    INPUT_WORKSHEETS = {
+        "MbankBilling": None,
+        "ManualEntries": None,
+        "PatternRules": "calculate_currencies",
+        "IndexRules": "assign_initial_categories",
+        "CategoryMapping": "assign_manual_categories",
+    }
+
+    def __init__(
+        self,
+        spreadsheet_name: str,
+        spreadsheet: GSheetConnection = None,
+        nbp_api: NBPApi = None,
+        billings_dir: Path = None,
+        rules_path: Path = None,
+        rule_workers: Optional[int] = None,
+        partitioned: bool = False,
+    ):
+        """
+        :param billings_dir: folder with mBank CSV exports - if given, billings are read from it instead of
+        MbankBilling worksheets
+        :param rules_path: YAML file with pattern rules (e.g. mbank/mbank_mapping_rules.yml) used instead of
+        PatternRules worksheet
+        :param rule_workers: number of processes evaluating pattern rules on large histories (0 - all cores), rules
+        are evaluated in the parser's process if not given
+        :param partitioned: run the pipeline month by month after data preparation, reusing cached outputs of closed
+        months whose inputs have not changed (see src.parsers.mbank.partitions)
+        """
+        super().__init__(spreadsheet_name, spreadsheet)
+
+        self.nbp_api = nbp_api or NBPApi()
         self.baselinker_api = BaselinkerAPI()
-        self.spreadsheet = GSheetConnection(spreadsheet_name)
-
-        self.warnings = []
-
-    def _warn_with_caching(self, message):
-        self.warnings.append(message)
-        self.logger.warning(message)
-
-    def parse(self):
-
-        steps = [
+        self.billings_cache = LocalCache("mbank_billings")
+        self.billings_dir = billings_dir
+        self.rules_path = rules_path
+        self.rule_workers = rule_workers
+        self.rule_snapshots = LocalCache("rule_snapshots")
+        self.rule_set: Optional[CompiledRuleSet] = None
+        self.rollups_cache = LocalCache("rollups")
+        self.partitioned = partitioned
+        self.partitions_cache = LocalCache("mbank_partitions")
+        # Ids of transactions removed by data_preparation as duplicated across statements, with ids of kept copies
+        self.duplicated_ids = pd.Series(dtype=np.int32)
+        self.transaction_ids_end = 0
+
+    @property
+    def checkpoints(self):
+        # Partitioned runs keep no checkpoints - unchanged months are reused from the partitions cache instead
+        return [] if self.partitioned else super().checkpoints
+
+    def build_steps(self) -> Steps:
+        if self.partitioned:
+            return self.build_partitioned_steps()
+        return Steps([
             (self.load_bank_billings, {}),
             (self.data_preparation, {}),
             (self.add_manual_entries, {}),
@@ -36,14 +119,43 @@ class MBankParser:
             (self.format_before_pushing, {}),
             (self.check_double_entries, {}),
             (self.save_not_mapped_records, {}),
+            (self.push_rollups, {}),
             (self.push_processed_data, {}),
             (self.format_after_pushing, {}),
             (self.push_warnings, {})
-        ]
+        ])
 
-        apply_steps(steps, logger=self.logger)
+    def build_partitioned_steps(self) -> Steps:
+        return Steps([
+            (self.load_bank_billings, {}),
+            (self.data_preparation, {}),
+            (self.add_manual_entries, {}),
+            (self.parse_partitions, {}),
+            (self.push_partition_rollups, {}),
+            (self.save_partition_not_mapped_records, {}),
+            (self.format_after_pushing, {}),
+            (self.push_warnings, {})
+        ])
+
+    def build_partition_steps(
+        self, rates: pd.DataFrame, index_rules: pd.DataFrame, category_mapping: pd.DataFrame, hit_counts: Counter
+    ) -> Steps:
+        """
+        Steps run on every partition - the same as in the whole history pipeline, with reference data loaded once.
+        Checks needing the whole history are done by parse_partitions.
+        """
+        return Steps([
+            (self.calculate_currencies, dict(rates=rates)),
+            (self.assign_initial_categories, dict(rule_set=self.rule_set, hit_counts=hit_counts)),
+            (self.assign_manual_categories, dict(rules=index_rules)),
+            (self.add_upper_categories, dict(mapping=category_mapping)),
+            (self.format_before_pushing, {}),
+        ])
 
     def load_bank_billings(self, dummy=None) -> pd.DataFrame:
+        if self.billings_dir is not None:
+            return read_mbank_csv_folder(self.billings_dir)
+
         billing_sheets = [
             sheet for sheet in self.spreadsheet.spreadsheet.worksheets() if "MbankBilling" in sheet.title
         ]
@@ -53,22 +165,48 @@ class MBankParser:
             self.logger.error(error_msg)
             raise ValueError(error_msg)
 
-        return pd.concat([self._load_bank_billing(sheet.title) for sheet in billing_sheets], axis=0)
+        fingerprints = self._fingerprint_bank_billings(billing_sheets)
+        with ThreadPoolExecutor(max_workers=BILLING_LOADING_WORKERS) as executor:
+            # Every task gets its own copy of the context, so network calls are counted for this step
+            futures = [
+                executor.submit(copy_context().run, self._load_bank_billing, sheet, fingerprint)
+                for sheet, fingerprint in zip(billing_sheets, fingerprints)
+            ]
+            billings = [future.result() for future in futures]
+
+        return pd.concat(
+            [billing.assign(source=sheet.title) for billing, sheet in zip(billings, billing_sheets)], axis=0
+        )
+
+    def _fingerprint_bank_billings(self, billing_sheets) -> list:
+        """
+        Fingerprints of billing worksheets - size of the grid and hash of all columns read by the parser.
+        """
+        hashes = hash_billing_contents(self.spreadsheet.spreadsheet, [sheet.title for sheet in billing_sheets])
+        return [
+            (sheet.title, sheet.row_count, sheet.col_count, content_hash)
+            for sheet, content_hash in zip(billing_sheets, hashes)
+        ]
 
-    def _load_bank_billing(self, worksheet_name) -> pd.DataFrame:
+    def _load_bank_billing(self, worksheet, fingerprint) -> pd.DataFrame:
+        cache_key = f"{self.spreadsheet.spreadsheet.id}-{worksheet.id}"
+        cached = self.billings_cache.get(cache_key)
+        if cached is not None and cached["fingerprint"] == fingerprint:
+            self.logger.debug("Billing loaded from cache", worksheet=worksheet.title)
+            return cached["billing"]
 
-        billing = self.spreadsheet[worksheet_name].worksheet.get_all_values()
+        billing = worksheet.get_all_values()
         for to_skip, line in enumerate(billing):
             if line[0] == "#Data operacji":
                 break
 
         billing = billing[to_skip:]
-        return pd.DataFrame(data=billing[1:], columns=billing[0])
+        billing = pd.DataFrame(data=billing[1:], columns=billing[0])
+        self.billings_cache.set(cache_key, dict(fingerprint=fingerprint, billing=billing))
+        self.logger.info("Billing downloaded", worksheet=worksheet.title, rows=billing.shape[0])
+        return billing
 
     def data_preparation(self, df: pd.DataFrame) -> pd.DataFrame:
-        def parse_amount(value):
-            return float(value.strip(" PLNEUR").replace(" ", "").replace(",", "."))
-
         mapping = {
             "#Data operacji": "date",
             "#Opis operacji": "description",
@@ -76,20 +214,38 @@ class MBankParser:
             "#Kategoria": "mbank_category",
             "#Kwota": "amount",
             "level_0": "id",
+            "source": "source",
         }
 
         df.columns = [mapping.get(col) for col in df.columns]
-        df = df.dropna(axis=1)
+        df = df.loc[:, [col is not None for col in df.columns]].dropna(axis=1)
         df = df.assign(
-            currency=df["amount"].str[-3:],
+            currency=df["amount"].str.strip().str[-3:],
             date=pd.to_datetime(df["date"]),
-            amount=df["amount"].apply(parse_amount),
+            amount=parse_amounts(df["amount"]),
             type=lambda df: np.where(df["amount"] > 0, "Wpływ", "Wydatek"),
             category="Not mapped",
             rules_triggered="",
-        ).sort_values(["date", "description", "amount"], ascending=True)
+        )
+
+        # Ids are given before duplicates are removed, so they stay the ones IndexRules were written for
+        df = df.sort_values(["date", "description", "amount"], ascending=True)
+        df = df.assign(id=np.arange(df.shape[0], dtype=np.int32))
+        self.transaction_ids_end = df.shape[0]
+
+        key_columns = [column for column in DUPLICATE_KEY_COLUMNS if column in df.columns]
+        if "account" not in key_columns:
+            self.logger.info("Statements have no account column, duplicates are detected without it")
+        df, duplicates = drop_duplicated_transactions(df, key_columns, id_column="id")
+        self.duplicated_ids = pd.Series(duplicates["duplicate_of"].to_numpy(), index=duplicates["id"].to_numpy())
+        if not duplicates.empty:
+            self._warn_with_caching(
+                "Removed {count} transactions duplicated across statements. Statements: {statements}",
+                count=duplicates.shape[0],
+                statements=", ".join(sorted(duplicates["source"].unique())),
+            )
 
-        return df.assign(id=range(df.shape[0]))
+        return compact_dtypes(df.drop(columns="source"), categorical=CATEGORICAL_COLUMNS)
 
     def add_manual_entries(self, df: pd.DataFrame) -> pd.DataFrame:
 
@@ -102,15 +258,19 @@ class MBankParser:
             mbank_category="Manual entry",
             type=np.where(manual_entries["amount"] > 0, "Wpływ", "Wydatek"),
             rules_triggered="",
-            id=range(df.shape[0], df.shape[0] + manual_entries.shape[0]),
+            id=np.arange(
+                self.transaction_ids_end, self.transaction_ids_end + manual_entries.shape[0], dtype=np.int32
+            ),
         )
 
-        return pd.concat([df, manual_entries])
+        # Concatenation with plain text columns turns categoricals back into objects
+        return compact_dtypes(pd.concat([df, manual_entries]), categorical=CATEGORICAL_COLUMNS)
 
-    def calculate_currencies(self, df) -> pd.DataFrame:
-        date_range = pd.date_range(
-            df.date.min(), min(df.date.max(), pd.Timestamp.today())
-        )
+    def _daily_rates(self, start: pd.Timestamp, end: pd.Timestamp) -> pd.DataFrame:
+        """
+        EUR rate for every day between start and end - days without a published rate take the last one before them.
+        """
+        date_range = pd.date_range(start, min(end, pd.Timestamp.today()))
         all_dates = pd.DataFrame(date_range).rename(columns={0: "all_dates"})
 
         rates = pd.merge_asof(
@@ -119,12 +279,16 @@ class MBankParser:
             left_on="all_dates",
             right_on="date",
         ).fillna(method="backfill")
+        return rates.drop("date", axis=1).rename(columns={"all_dates": "date"})
 
-        df = df.merge(
-            rates.drop("date", axis=1).rename(columns={"all_dates": "date"}),
-            on="date",
-            how="left",
-        )
+    def calculate_currencies(self, df, rates: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+        """
+        :param rates: daily rates (see _daily_rates) - fetched for the dates of the frame if not given
+        """
+        if rates is None:
+            rates = self._daily_rates(df.date.min(), df.date.max())
+
+        df = df.merge(rates, on="date", how="left")
 
         df.loc[df["currency"] == "PLN", "EUR"] = round(df["amount"] / df["rate"], 2)
         df["EUR"].fillna(df["amount"], inplace=True)
@@ -136,55 +300,59 @@ class MBankParser:
 
         return df
 
-    def assign_initial_categories(self, df: pd.DataFrame) -> pd.DataFrame:
-
+    def assign_initial_categories(
+        self, df: pd.DataFrame, rule_set: Optional[CompiledRuleSet] = None, hit_counts: Optional[Counter] = None
+    ) -> pd.DataFrame:
+        """
+        :param rule_set: already loaded rules - loaded from YAML file or PatternRules worksheet if not given
+        :param hit_counts: if given, hits of the rules are added to it instead of reporting rules without hits - used
+        when the history is evaluated part by part
+        """
         mappable = df["mbank_category"] != "Manual entry"
 
-        def fill_categories(
-            df: pd.DataFrame, mapping_rule: MappingRule
-        ) -> pd.DataFrame:
-
-            mask = mapping_rule.create_mask(df) & mappable
-
-            if mask.sum() == 0:
+        self.rule_set = rule_set or self._load_rule_set()
+        result = self.rule_set.evaluate(df, mappable, workers=self.rule_workers)
 
-                self._warn_with_caching(
-                    f"Rule did not match any record. Rule: {str(mapping_rule)}."
-                )
-                return df
-            df.loc[mask, "category"] = mapping_rule.result_value
-            df.loc[mask, "rules_triggered"] += f" {mapping_rule.id}"
-            return df
-
-        def transform_row_into_mapping_rule(dct: dict) -> dict:
-            for key in list(dct.keys())[::-1]:
-                if key not in ["id", "result_value"]:
-                    if dct[key]:
-                        dct[key] = {"name": key, "value": dct[key]}
-                    else:
-                        del dct[key]
-            return dct
-
-        rules = self.spreadsheet["PatternRules"].get_data()
-
-        # Updating ids
-        rules["id"] = pd.Series(rules.index).map(int)
-        self.spreadsheet["PatternRules"].update_data(rules)
-
-        mapping_rules = [
-            transform_row_into_mapping_rule(dct)
-            for dct in pd.DataFrame(rules).to_dict("records")
-        ]
-        mapping_rules = MappingRules(mapping_rules=mapping_rules)
-        self.logger.info(f"Fetched {len(mapping_rules.mapping_rules)} mapping rules")
-
-        for mapping_rule in mapping_rules.mapping_rules:
-            df = fill_categories(df, mapping_rule)
-        df["rules_triggered"] = df["rules_triggered"].str.strip()
+        if hit_counts is not None:
+            hit_counts.update(result.hit_counts)
+        else:
+            self._warn_about_unused_rules(result.hit_counts)
 
+        df["category"] = result.category
+        df["rules_triggered"] = result.rules_triggered
         return df
 
-    def assign_manual_categories(self, df: pd.DataFrame) -> pd.DataFrame:
+    def _warn_about_unused_rules(self, hit_counts: dict):
+        for rule in self.rule_set.rules:
+            if hit_counts.get(rule.id, 0) == 0:
+                self._warn_with_caching("Rule did not match any record. Rule: {rule}.", rule=rule)
+
+    def _load_rule_set(self) -> CompiledRuleSet:
+        """
+        Rules from YAML file (if parser got one) or PatternRules worksheet, loaded from the compiled snapshot when
+        their content has not changed. Ids in the worksheet are rewritten only if they do not match row numbers.
+        """
+        if self.rules_path is not None:
+            records = rule_records_from_yaml(self.rules_path)
+        else:
+            rules = self.spreadsheet["PatternRules"].get_data()
+            expected_ids = pd.Series(range(rules.shape[0]), index=rules.index)
+            if "id" not in rules or not pd.to_numeric(rules["id"], errors="coerce").eq(expected_ids).all():
+                rules["id"] = expected_ids
+                self.spreadsheet["PatternRules"].update_data(rules)
+                self.logger.info("Ids of PatternRules updated")
+            records = rule_records_from_frame(rules)
+
+        rule_set, from_snapshot = CompiledRuleSet.load(records, self.rule_snapshots)
+        self.logger.info(
+            f"Fetched {len(rule_set)} mapping rules", from_snapshot=from_snapshot, rules_hash=rule_set.source_hash[:12]
+        )
+        return rule_set
+
+    def assign_manual_categories(self, df: pd.DataFrame, rules: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+        """
+        :param rules: index rules (see _load_index_rules) - loaded from IndexRules worksheet if not given
+        """
         # TODO DRY
         # TODO Warn about mapping the last day
         def fill_categories(
@@ -194,41 +362,66 @@ class MBankParser:
             mask = df["id"].map(int) == mapping_rule.id
             if mask.sum() == 0:
                 self._warn_with_caching(
-                    f"Index rule did not match any record. Rule ID: {mapping_rule.id}"
+                    "Index rule did not match any record. Rule ID: {rule_id}", rule_id=mapping_rule.id
                 )
                 return df
             df.loc[mask, "category"] = mapping_rule.result_value
             df.loc[mask, "rules_triggered"] = f"Index rule {mapping_rule.id} "
             return df
 
+        if rules is None:
+            rules = self._load_index_rules()
+
+        mapping_rules = MappingRules(mapping_rules=rules.to_dict("records"))
+        for mapping_rule in mapping_rules.mapping_rules:
+            df = fill_categories(df, mapping_rule)
+        df["rules_triggered"] = df["rules_triggered"].str.strip()
+
+        return df
+
+    def _load_index_rules(self) -> pd.DataFrame:
+        """
+        Index rules (id, result_value) from IndexRules worksheet. Duplicated ids are kept - the last one of each wins.
+        """
         rules = self.spreadsheet["IndexRules"].get_data()
         rules = rules[['id', 'result_value']].query("id != ''").dropna()
         if rules.id.duplicated().sum() > 0:
             duplicated_ids = rules.loc[rules.id.duplicated(), "id"].values.tolist()
             self._warn_with_caching(
-                f"Your `IndexRules` worksheet contains duplicated ids - parser used only the last one of each. \
-Duplicated IDs: {', '.join(map(str, duplicated_ids))}"
+                "Your `IndexRules` worksheet contains duplicated ids - parser used only the last one of each. "
+                "Duplicated IDs: {ids}",
+                ids=", ".join(map(str, duplicated_ids)),
             )
-
-        mapping_rules = (
-            pd.DataFrame(rules)
-            .assign(id=lambda df: df["id"].map(int))[["id", "result_value"]]
-            .to_dict("records")
+        rules = pd.DataFrame(rules).assign(id=lambda df: df["id"].map(int))[["id", "result_value"]]
+        return self._migrate_duplicated_ids(rules)
+
+    def _migrate_duplicated_ids(self, rules: pd.DataFrame) -> pd.DataFrame:
+        """
+        Index rules of transactions removed as duplicated across statements are moved to the kept copies, unless the
+        copies have their own rule.
+        """
+        removed = rules["id"].isin(self.duplicated_ids.index)
+        if not removed.any():
+            return rules
+
+        kept_ids = rules.loc[removed, "id"].map(self.duplicated_ids)
+        self._warn_with_caching(
+            "Index rules refer to transactions removed as duplicated across statements - move them to the kept "
+            "copies. Rule IDs: {ids}. IDs of the kept copies: {kept_ids}",
+            ids=", ".join(map(str, rules.loc[removed, "id"])),
+            kept_ids=", ".join(map(str, kept_ids)),
         )
-        mapping_rules = MappingRules(mapping_rules=mapping_rules)
-        for mapping_rule in mapping_rules.mapping_rules:
-            df = fill_categories(df, mapping_rule)
-        df["rules_triggered"] = df["rules_triggered"].str.strip()
-
-        return df
+        migrated = rules.loc[removed].assign(id=kept_ids.to_numpy())
+        migrated = migrated[~migrated["id"].isin(rules.loc[~removed, "id"])]
+        return pd.concat([rules.loc[~removed], migrated], ignore_index=True)
 
     def format_before_pushing(self, df: pd.DataFrame) -> pd.DataFrame:
-        df["year"] = df["date"].dt.year
-        df["month"] = df["date"].dt.month
-        df['year-month'] = df['date'].dt.strftime("%Y-%m")
+        df["year"] = df["date"].dt.year.astype(np.int16)
+        df["month"] = df["date"].dt.month.astype(np.int8)
+        df['year-month'] = df['date'].dt.strftime("%Y-%m").astype("category")
         df["date"] = df["date"].apply(datetime_to_excel_date)
-        df["category"] = df["category"].fillna("Not mapped")
-        df[["EUR", "PLN"]] = df[["EUR", "PLN"]].applymap(float)
+        df["category"] = fill_missing(df["category"], "Not mapped")
+        df[["EUR", "PLN"]] = df[["EUR", "PLN"]].astype(float)
         df["PLN abs"] = abs(df["PLN"])
 
         detailed_categories = [col for col in df.columns if 'level' in col]
@@ -255,18 +448,18 @@ Duplicated IDs: {', '.join(map(str, duplicated_ids))}"
 
     def check_double_entries(self, df: pd.DataFrame) -> pd.DataFrame:
 
-        pattern_rules = self.spreadsheet["PatternRules"].get_data()
-
         mask = df["rules_triggered"].str.split(" ").map(len) >= 2
         duplicated_rules = df.loc[mask, "rules_triggered"].drop_duplicates()
-        for id, rules in duplicated_rules.iteritems():
+        for id, rules in duplicated_rules.items():
             if "Index" in rules:
                 continue
             # TODO do przepisania po implementacji wszystkich filtrow
-            pattern_mask = pattern_rules.id.isin(map(int, rules.split(" ")))
-            if pattern_rules.loc[pattern_mask, "result_value"].nunique() > 1:
+            result_values = {self.rule_set[int(rule_id)].result_value for rule_id in rules.split(" ")}
+            if len(result_values) > 1:
                 self._warn_with_caching(
-                    f"More then one rule mapped to the transaction. Transaction id {id}. Rule ids {rules}."
+                    "More then one rule mapped to the transaction. Transaction id {id}. Rule ids {rules}.",
+                    id=id,
+                    rules=rules,
                 )
 
         return df
@@ -286,16 +479,119 @@ Duplicated IDs: {', '.join(map(str, duplicated_ids))}"
 
         return df
 
-    def add_upper_categories(self, df: pd.DataFrame) -> pd.DataFrame:
-
-        mapping = self.spreadsheet["CategoryMapping"].get_data()
+    def add_upper_categories(self, df: pd.DataFrame, mapping: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+        """
+        :param mapping: content of CategoryMapping worksheet - read from the worksheet if not given
+        """
+        if mapping is None:
+            mapping = self.spreadsheet["CategoryMapping"].get_data()
         for column in mapping.columns:
             if 'level' in column:
                 current_mapping = mapping[['Detailed', column]].set_index('Detailed').to_dict()[column]
                 df[column] = df['category'].map(current_mapping).fillna('Without mapping')
+
+        # Categories are final from now on, so they can be stored compactly as well
+        detailed_categories = [col for col in df.columns if 'level' in col]
+        return compact_dtypes(df, categorical=["category", "rules_triggered", *detailed_categories])
+
+    def push_rollups(self, df: pd.DataFrame) -> pd.DataFrame:
+        detailed_categories = [col for col in df.columns if 'level' in col]
+        self._push_rollups(compute_rollups(df, ["category", *detailed_categories]))
         return df
 
+    def _push_rollups(self, rollups: pd.DataFrame):
+        worksheet = GWorksheet(self.spreadsheet.get_worksheet("Rollups", create_if_missing=True))
+        cache_key = f"{self.spreadsheet.spreadsheet.id}-{worksheet.worksheet.id}"
+        previous = self.rollups_cache.get(cache_key)
+
+        first_row = first_changed_row(previous, rollups)
+        if first_row is None:
+            self.logger.info("Rollups did not change")
+            return
+
+        worksheet.update_from_row(rollups, first_row, previous_rows=0 if previous is None else previous.shape[0])
+        self.rollups_cache.set(cache_key, rollups)
+        self.logger.info(
+            "Rollups pushed", rows=rollups.shape[0] - first_row, first_month=rollups["year-month"].get(first_row)
+        )
+
+    def parse_partitions(self, df: pd.DataFrame) -> PartitionsSummary:
+        """
+        Running the rest of the pipeline month by month and streaming processed months into ParsedData worksheet.
+        Rules and mappings are loaded once, and warnings depending on the whole history are reported after all months.
+        """
+        self.rule_set = self._load_rule_set()
+        index_rules = self._load_index_rules()
+        category_mapping = self.spreadsheet["CategoryMapping"].get_data()
+        # Rates of the whole history, so days at the start of a month take the rate published in the previous one
+        rates = self._daily_rates(df["date"].min(), df["date"].max())
+        rate_months = transaction_months(rates["date"])
+
+        for rule_id in sorted(set(index_rules["id"]) - set(df["id"].map(int))):
+            self._warn_with_caching("Index rule did not match any record. Rule ID: {rule_id}", rule_id=rule_id)
+
+        summary = PartitionsSummary()
+        with GWorksheetWriter(self.spreadsheet["ParsedData"]) as writer:
+            for month, partition in split_by_month(df):
+                partition, reused = self._parse_partition(
+                    month,
+                    partition,
+                    rates[rate_months == month],
+                    index_rules[index_rules["id"].isin(partition["id"].map(int))],
+                    category_mapping,
+                )
+                writer.write(partition.data)
+                summary.add(month, partition, reused)
+
+        self._warn_about_unused_rules(summary.hit_counts)
+        self.check_double_entries(summary.multiple_rules)
+        self.logger.info(
+            "Partitions parsed",
+            rows=summary.rows,
+            recomputed=len(summary.recomputed),
+            reused=len(summary.reused),
+            first_recomputed=summary.recomputed[0] if summary.recomputed else None,
+        )
+        return summary
+
+    def _parse_partition(
+        self,
+        month: str,
+        partition: pd.DataFrame,
+        rates: pd.DataFrame,
+        index_rules: pd.DataFrame,
+        category_mapping: pd.DataFrame,
+    ) -> Tuple[ParsedPartition, bool]:
+        partition_fingerprint = fingerprint(
+            partition, rates, index_rules, category_mapping, extra=[self.rule_set.source_hash]
+        )
+        cache_key = f"{self.spreadsheet.spreadsheet.id}-{month}"
+        closed = is_closed(month)
+        if closed:
+            cached = self.partitions_cache.get(cache_key)
+            if isinstance(cached, ParsedPartition) and cached.fingerprint == partition_fingerprint:
+                return cached, True
+
+        hit_counts = Counter()
+        steps = self.build_partition_steps(rates, index_rules, category_mapping, hit_counts)
+        parsed = ParsedPartition(partition_fingerprint, steps.apply_to(partition), hit_counts)
+        self.logger.debug(
+            "Partition parsed", month=month, rows=parsed.data.shape[0], elapsed_time=steps.get_run_times()[1]
+        )
+        if closed:
+            self.partitions_cache.set(cache_key, parsed)
+        return parsed, False
+
+    def push_partition_rollups(self, summary: PartitionsSummary) -> PartitionsSummary:
+        self._push_rollups(summary.rollups)
+        return summary
+
+    def save_partition_not_mapped_records(self, summary: PartitionsSummary) -> PartitionsSummary:
+        self.save_not_mapped_records(summary.not_mapped)
+        return summary
+
     def push_processed_data(self, df: pd.DataFrame):
+        self.logger.debug("Memory usage of parsed data per column", report=memory_report(df).to_dict("index"))
         ws = self.spreadsheet["ParsedData"]
         ws.worksheet.clear()
         ws.update_data(df)
@@ -328,4 +624,4 @@ Duplicated IDs: {', '.join(map(str, duplicated_ids))}"
     def push_warnings(self, dummy=None):
         logging_worksheet = self.spreadsheet['Warnings']
         logging_worksheet.worksheet.clear()
-        logging_worksheet.update_data(pd.DataFrame(self.warnings, columns=['Warnings']))
+        logging_worksheet.update_data(self.warnings.as_frame())
@@ -0,0 +1,189 @@
+"""
+Evaluation of a CompiledRuleSet on several cores. Rules only look at the values of a single row (the category set by
+previous rules included), so rows can be split into chunks evaluated independently by a process pool.
+
+Columns are not pickled to the workers. Every column used by rules is placed in shared memory once: numbers as float
+arrays, texts in the Arrow string layout - codes of the rows, and lowercased distinct values as one UTF-8 buffer with
+offsets. A worker decodes only the distinct values occurring in its chunk and returns, per row, the position of the
+last matching rule together with hit positions, which are merged in row order, so the result is exactly the one of
+CompiledRuleSet.evaluate.
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.parsers.mbank.rule_set import (
+    DYNAMIC_COLUMNS,
+    OPERATORS,
+    CompiledRuleSet,
+    RuleSetResult,
+    _contains,
+    _join_triggered_rules,
+    evaluation_column,
+)
+
+# Below this number of rows starting the pool costs more than it saves
+PARALLEL_MIN_ROWS = 50_000
+CHUNKS_PER_WORKER = 4
+
+ArraySpec = Tuple[str, str, Tuple[int, ...]]
+
+_worker: dict = {}
+
+
+def _share(array: np.ndarray, blocks: List[SharedMemory]) -> ArraySpec:
+    block = SharedMemory(create=True, size=max(array.nbytes, 1))
+    blocks.append(block)
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+    return block.name, array.dtype.str, array.shape
+
+
+def _attach(spec: ArraySpec) -> np.ndarray:
+    name, dtype, shape = spec
+    # Workers share the resource tracker of the parent, which unlinks the block after the evaluation
+    block = SharedMemory(name=name)
+    _worker.setdefault("blocks", []).append(block)
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+
+
+def _share_text(values: pd.Series, blocks: List[SharedMemory]) -> Dict[str, ArraySpec]:
+    codes, uniques = pd.factorize(values.astype(str))
+    encoded = [value.lower().encode() for value in uniques]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return dict(
+        codes=_share(codes.astype(np.int32), blocks),
+        offsets=_share(offsets, blocks),
+        data=_share(np.frombuffer(b"".join(encoded), dtype=np.uint8), blocks),
+    )
+
+
+def _init_worker(rule_set: CompiledRuleSet, layout: dict):
+    _worker["rule_set"] = rule_set
+    _worker["texts"] = {
+        column: {key: _attach(spec) for key, spec in specs.items()} for column, specs in layout["texts"].items()
+    }
+    _worker["numbers"] = {column: _attach(spec) for column, spec in layout["numbers"].items()}
+    _worker["mappable"] = _attach(layout["mappable"])
+    _worker["category_codes"] = _attach(layout["category_codes"])
+    _worker["category_values"] = layout["category_values"]
+
+
+def _chunk_contains(column: str, start: int, stop: int, pattern: str, cache: dict) -> np.ndarray:
+    if column not in cache:
+        text = _worker["texts"][column]
+        distinct, inverse = np.unique(text["codes"][start:stop], return_inverse=True)
+        offsets, data = text["offsets"], text["data"]
+        values = np.array(
+            [bytes(data[offsets[code]:offsets[code + 1]]).decode() for code in distinct], dtype=object
+        )
+        cache[column] = (values, inverse)
+    values, inverse = cache[column]
+    return _contains(values, pattern)[inverse]
+
+
+def _evaluate_chunk(start: int, stop: int):
+    rule_set: CompiledRuleSet = _worker["rule_set"]
+    mappable = _worker["mappable"][start:stop].astype(bool)
+    category_codes = _worker["category_codes"][start:stop].copy()
+    category_values = _worker["category_values"]
+
+    last_rule = np.full(stop - start, -1, dtype=np.int32)
+    hit_rows, hit_positions = [], []
+    hit_counts = np.zeros(len(rule_set.rules), dtype=np.int64)
+    text_cache = {}
+    for position, rule in enumerate(rule_set.rules):
+        mask = mappable.copy()
+        for pattern in rule.patterns:
+            if not mask.any():
+                break
+            if pattern.column in DYNAMIC_COLUMNS:
+                mask &= _contains(category_values, pattern.value)[category_codes]
+            else:
+                mask &= _chunk_contains(pattern.column, start, stop, pattern.value, text_cache)
+        for comparison in rule.comparisons:
+            if not mask.any():
+                break
+            mask &= OPERATORS[comparison.sign](_worker["numbers"][comparison.column][start:stop], comparison.value)
+
+        rows = np.flatnonzero(mask)
+        hit_counts[position] = rows.size
+        if rows.size:
+            # Categories set by rules follow the distinct initial categories in category_values
+            category_codes[rows] = len(category_values) - len(rule_set.rules) + position
+            last_rule[rows] = position
+            hit_rows.append(rows.astype(np.int32) + start)
+            hit_positions.append(np.full(rows.size, position, dtype=np.int32))
+
+    return last_rule, hit_rows, hit_positions, hit_counts
+
+
+def _chunks(rows: int, workers: int) -> List[Tuple[int, int]]:
+    bounds = np.linspace(0, rows, min(rows, workers * CHUNKS_PER_WORKER) + 1).astype(int)
+    return [(int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+
+def evaluate_parallel(
+    rule_set: CompiledRuleSet,
+    df: pd.DataFrame,
+    mappable: Optional[np.ndarray] = None,
+    workers: Optional[int] = None,
+) -> RuleSetResult:
+    workers = workers or os.cpu_count() or 1
+    mappable = np.ones(df.shape[0], dtype=bool) if mappable is None else np.asarray(mappable, dtype=bool)
+    category = df["category"].to_numpy(dtype=object, copy=True)
+
+    text_columns = {pattern.column for rule in rule_set.rules for pattern in rule.patterns} - set(DYNAMIC_COLUMNS)
+    number_columns = {comparison.column for rule in rule_set.rules for comparison in rule.comparisons}
+
+    category_codes, initial_categories = pd.factorize(pd.Series(category).map(str))
+    category_values = np.array(
+        [value.lower() for value in initial_categories] + [rule.result_value.lower() for rule in rule_set.rules],
+        dtype=object,
+    )
+
+    blocks: List[SharedMemory] = []
+    try:
+        layout = dict(
+            texts={column: _share_text(evaluation_column(df, column), blocks) for column in text_columns},
+            numbers={
+                column: _share(evaluation_column(df, column).to_numpy(dtype=float), blocks)
+                for column in number_columns
+            },
+            mappable=_share(mappable.astype(np.uint8), blocks),
+            category_codes=_share(category_codes.astype(np.int32), blocks),
+            category_values=category_values,
+        )
+        # Parsers run in threads of the batch runner - forking a multi-threaded process is not safe
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(
+            workers, mp_context=context, initializer=_init_worker, initargs=(rule_set, layout)
+        ) as executor:
+            chunks = _chunks(df.shape[0], workers)
+            results = list(executor.map(_evaluate_chunk, *zip(*chunks)))
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    last_rule = np.concatenate([result[0] for result in results])
+    result_values = np.array([rule.result_value for rule in rule_set.rules], dtype=object)
+    matched = last_rule >= 0
+    category[matched] = result_values[last_rule[matched]]
+
+    rule_ids = np.array([rule.id for rule in rule_set.rules])
+    hit_rows = [rows for result in results for rows in result[1]]
+    hit_ids = [rule_ids[positions] for result in results for positions in result[2]]
+    hit_counts = np.sum([result[3] for result in results], axis=0)
+
+    return RuleSetResult(
+        category=pd.Series(category, index=df.index, name="category"),
+        rules_triggered=_join_triggered_rules(df, hit_rows, hit_ids),
+        hit_counts={rule.id: int(count) for rule, count in zip(rule_set.rules, hit_counts)},
+    )
@@ -0,0 +1,109 @@
+"""
+Partitioned execution of MBankParser. Prepared transactions are split into year-month partitions and the rest of
+the pipeline (FX conversion, categorization, formatting) runs on one partition at a time, so frames copied by the
+steps are never larger than a month. Processed partitions are streamed into the output worksheet.
+
+Every partition has a fingerprint of its inputs - its transactions, index rules referring to them, exchange rates of
+the month, pattern rules and category mapping. Outputs of closed months are cached, and reused as long as their
+fingerprint does not change. The current month is always recomputed.
+"""
+
+import hashlib
+import json
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Iterator, List, Tuple
+
+import pandas as pd
+
+from src.parsers.mbank.rollups import compute_rollups
+
+# Version of the partition output - bumping it invalidates all cached partitions
+PARTITION_FORMAT = 1
+
+
+def transaction_months(dates: pd.Series) -> pd.Series:
+    return dates.dt.strftime("%Y-%m")
+
+
+def split_by_month(df: pd.DataFrame) -> Iterator[Tuple[str, pd.DataFrame]]:
+    """
+    Partitions of the frame in chronological order. Rows keep their order within the month.
+    """
+    positions = df.groupby(transaction_months(df["date"]).to_numpy(), sort=True).indices
+    for month, month_positions in positions.items():
+        yield month, df.iloc[month_positions]
+
+
+def is_closed(month: str, today: pd.Timestamp = None) -> bool:
+    return month < (today or pd.Timestamp.today()).strftime("%Y-%m")
+
+
+def fingerprint(*frames: pd.DataFrame, extra=()) -> str:
+    digest = hashlib.sha1()
+    for frame in frames:
+        layout = [list(map(str, frame.columns)), list(map(str, frame.dtypes))]
+        digest.update(json.dumps(layout).encode())
+        digest.update(pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes())
+    digest.update(json.dumps([PARTITION_FORMAT, *extra], default=str).encode())
+    return digest.hexdigest()
+
+
+@dataclass
+class ParsedPartition:
+    """
+    Output of the pipeline for one month, as cached for closed months.
+    """
+
+    fingerprint: str
+    data: pd.DataFrame
+    hit_counts: Counter
+    rollups: pd.DataFrame = field(init=False)
+
+    def __post_init__(self):
+        # Rollups are grouped by month first, so rollups of partitions concatenated in order equal those of the whole
+        levels = ["category", *[column for column in self.data.columns if "level" in column]]
+        self.rollups = compute_rollups(self.data, levels)
+
+
+@dataclass
+class PartitionsSummary:
+    """
+    What is left of processed partitions once they have been written - small tables aggregated over all of them.
+    """
+
+    rows: int = 0
+    recomputed: List[str] = field(default_factory=list)
+    reused: List[str] = field(default_factory=list)
+    hit_counts: Counter = field(default_factory=Counter)
+    _rollups: List[pd.DataFrame] = field(default_factory=list)
+    _not_mapped: List[pd.DataFrame] = field(default_factory=list)
+    _multiple_rules: List[pd.DataFrame] = field(default_factory=list)
+
+    def add(self, month: str, partition: ParsedPartition, reused: bool):
+        data = partition.data
+        self.rows += data.shape[0]
+        (self.reused if reused else self.recomputed).append(month)
+        self.hit_counts.update(partition.hit_counts)
+        self._rollups.append(partition.rollups)
+        self._not_mapped.append(data[data["category"] == "Not mapped"])
+        multiple_rules = data.loc[data["rules_triggered"].astype(str).str.contains(" "), ["id", "rules_triggered"]]
+        self._multiple_rules.append(multiple_rules.drop_duplicates("rules_triggered"))
+
+    def __len__(self):
+        return self.rows
+
+    @property
+    def rollups(self) -> pd.DataFrame:
+        return pd.concat(self._rollups, ignore_index=True)
+
+    @property
+    def not_mapped(self) -> pd.DataFrame:
+        return pd.concat(self._not_mapped)
+
+    @property
+    def multiple_rules(self) -> pd.DataFrame:
+        """
+        First transaction (by id) of every distinct combination of several triggered rules.
+        """
+        return pd.concat(self._multiple_rules).drop_duplicates("rules_triggered").set_index("id")
@@ -0,0 +1,67 @@
+"""
+Monthly totals of parsed transactions per category hierarchy level, precomputed for the dashboards instead of being
+aggregated by Sheets formulas over the whole ParsedData worksheet.
+
+All levels are computed from one grouped pass over the transactions (at the finest granularity - detailed category
+with all its upper levels), the per-level totals are then rolled up from this small table.
+"""
+
+from typing import List, Optional
+
+import pandas as pd
+
+VALUE_COLUMNS = ["PLN", "EUR", "PLN abs"]
+ROLLUP_COLUMNS = ["year-month", "level", "type", "name", *VALUE_COLUMNS, "transactions"]
+DETAILED_LEVEL = "category"
+
+
+def compute_rollups(df: pd.DataFrame, levels: List[str]) -> pd.DataFrame:
+    keys = ["year-month", "type", DETAILED_LEVEL, *[level for level in levels if level != DETAILED_LEVEL]]
+    base = (
+        df.groupby(keys, observed=True, sort=False)
+        .agg(**{column: (column, "sum") for column in VALUE_COLUMNS}, transactions=("PLN", "size"))
+        .reset_index()
+    )
+
+    rollups = []
+    for level in keys[2:]:
+        rollups.append(
+            base.groupby(["year-month", "type", level], observed=True, sort=False)[[*VALUE_COLUMNS, "transactions"]]
+            .sum()
+            .reset_index()
+            .rename(columns={level: "name"})
+            .assign(level=level)
+        )
+
+    rollups = pd.concat(rollups, ignore_index=True)
+    rollups = rollups.astype({"year-month": str, "type": str, "name": str})
+    rollups[VALUE_COLUMNS] = rollups[VALUE_COLUMNS].round(2)
+    return rollups[ROLLUP_COLUMNS].sort_values(["year-month", "level", "type", "name"], ignore_index=True)
+
+
+def first_changed_row(previous: Optional[pd.DataFrame], current: pd.DataFrame) -> Optional[int]:
+    """
+    Index of the first row of the earliest month which differs between previous and current rollups. Rows before it
+    are identical, so only the rest of the worksheet has to be rewritten. None means there is nothing to update.
+    """
+    if previous is None or list(previous.columns) != list(current.columns):
+        return 0
+
+    previous_months = previous.groupby("year-month", sort=True)
+    current_months = current.groupby("year-month", sort=True)
+    months = sorted(set(previous["year-month"]) | set(current["year-month"]))
+
+    for month in months:
+        if month not in previous_months.groups or month not in current_months.groups:
+            changed_month = month
+            break
+        previous_month = previous_months.get_group(month).reset_index(drop=True)
+        current_month = current_months.get_group(month).reset_index(drop=True)
+        if not previous_month.equals(current_month):
+            changed_month = month
+            break
+    else:
+        return None
+
+    changed = current.index[current["year-month"] >= changed_month]
+    return int(changed[0]) if len(changed) else current.shape[0]
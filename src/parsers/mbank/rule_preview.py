@@ -0,0 +1,190 @@
+"""
+What-if evaluation of candidate pattern rules against already parsed transactions (ParsedData worksheet), without
+rerunning the pipeline.
+
+Every text column used by rules is factorized into distinct lowercased values, and distinct values are indexed by
+their character trigrams (trigram -> values containing it). A pattern is looked up by intersecting postings of its
+trigrams, only the remaining values are checked with the substring test of PatternMappingField, and the matching
+values are mapped back to rows through the factorized codes. Comparisons of NumericalMappingField are vectorized
+over numerical columns. Candidates are validated and compiled exactly as rules from PatternRules worksheet.
+
+A pattern on `category` is checked against categories of the parsed transactions, i.e. after all existing rules.
+"""
+
+from dataclasses import dataclass
+from functools import reduce
+from time import perf_counter
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from src.parsers.mbank.mapping_rules import MappingRules
+from src.parsers.mbank.rule_set import OPERATORS, CompiledRule, compile_rule, evaluation_column, rule_records_from_frame
+
+CANDIDATE_RULE_ID = -1
+NGRAM = 3
+MATCHED_COLUMNS = ["id", "date", "description", "mbank_category", "category", "rules_triggered", "PLN"]
+
+
+def ngrams(value: str) -> set:
+    return {value[i:i + NGRAM] for i in range(len(value) - NGRAM + 1)}
+
+
+class TextColumnIndex:
+    def __init__(self, values: pd.Series):
+        codes, uniques = pd.factorize(values.astype(str))
+        self.codes = codes
+        self.values = [value.lower() for value in uniques]
+
+        postings: Dict[str, List[int]] = {}
+        for value_id, value in enumerate(self.values):
+            for gram in ngrams(value):
+                postings.setdefault(gram, []).append(value_id)
+        self.postings = {gram: np.array(ids, dtype=np.int64) for gram, ids in postings.items()}
+
+    def matching_values(self, pattern: str) -> np.ndarray:
+        """
+        Ids of distinct values containing the (lowercased) pattern.
+        """
+        grams = ngrams(pattern)
+        if grams:
+            # Intersecting from the shortest posting keeps intermediate results small
+            postings = sorted((self.postings.get(gram, np.array([], dtype=np.int64)) for gram in grams), key=len)
+            candidates = reduce(lambda left, right: np.intersect1d(left, right, assume_unique=True), postings)
+        else:
+            candidates = range(len(self.values))
+        return np.array([value_id for value_id in candidates if pattern in self.values[value_id]], dtype=np.int64)
+
+    def contains(self, pattern: str) -> np.ndarray:
+        matching = np.zeros(len(self.values), dtype=bool)
+        matching[self.matching_values(pattern)] = True
+        return matching[self.codes]
+
+
+@dataclass
+class RulePreview:
+    rule: CompiledRule
+    matched: pd.DataFrame
+    conflicts: pd.DataFrame
+    elapsed_ms: float
+
+    @property
+    def total_pln(self) -> float:
+        return round(float(self.matched["PLN"].sum()), 2)
+
+    @property
+    def newly_mapped(self) -> int:
+        return int((self.matched["category"] == "Not mapped").sum())
+
+    def summary(self) -> dict:
+        return dict(
+            transactions=self.matched.shape[0],
+            total_pln=self.total_pln,
+            newly_mapped=self.newly_mapped,
+            conflicting=int(self.conflicts["transactions"].sum()),
+            elapsed_ms=round(self.elapsed_ms, 2),
+        )
+
+
+def candidate_record(result_value: str, fields: dict, rule_id: int = CANDIDATE_RULE_ID) -> dict:
+    """
+    MappingRule dictionary from values of PatternRules columns - empty values are skipped, as in the worksheet.
+    """
+    return rule_records_from_frame(pd.DataFrame([{"id": rule_id, "result_value": result_value, **fields}]))[0]
+
+
+class RulePreviewIndex:
+    """
+    Index of parsed transactions answering, which of them a candidate rule would match. It is built once, previews
+    take milliseconds even for long histories.
+    """
+
+    def __init__(self, history: pd.DataFrame):
+        """
+        :param history: content of ParsedData worksheet
+        """
+        self.history = history.reset_index(drop=True)
+        # Manual entries are never mapped by pattern rules
+        self.mappable = (self.history["mbank_category"].astype(str) != "Manual entry").to_numpy()
+        self._text: Dict[str, TextColumnIndex] = {}
+        self._numeric: Dict[str, np.ndarray] = {}
+
+    def __len__(self):
+        return self.history.shape[0]
+
+    def text(self, column: str) -> TextColumnIndex:
+        if column not in self._text:
+            self._text[column] = TextColumnIndex(evaluation_column(self.history, column))
+        return self._text[column]
+
+    def numeric(self, column: str) -> np.ndarray:
+        if column not in self._numeric:
+            values = pd.to_numeric(evaluation_column(self.history, column), errors="coerce")
+            self._numeric[column] = values.to_numpy(dtype=float)
+        return self._numeric[column]
+
+    def mask(self, rule: CompiledRule) -> np.ndarray:
+        mask = self.mappable.copy()
+        for pattern in rule.patterns:
+            if not mask.any():
+                break
+            mask &= self.text(pattern.column).contains(pattern.value)
+        for comparison in rule.comparisons:
+            if not mask.any():
+                break
+            mask &= OPERATORS[comparison.sign](self.numeric(comparison.column), comparison.value)
+        return mask
+
+    def preview(self, record: dict) -> RulePreview:
+        """
+        :param record: candidate rule as a MappingRule dictionary (see candidate_record)
+        """
+        start_time = perf_counter()
+        rule = compile_rule(MappingRules(mapping_rules=[record]).mapping_rules[0])
+        matched = self.history.loc[self.mask(rule), [col for col in MATCHED_COLUMNS if col in self.history.columns]]
+        matched = matched.assign(PLN=pd.to_numeric(matched["PLN"], errors="coerce"))
+        return RulePreview(
+            rule=rule,
+            matched=matched,
+            conflicts=self._conflicts(matched, rule.result_value),
+            elapsed_ms=(perf_counter() - start_time) * 1000,
+        )
+
+    @staticmethod
+    def _conflicts(matched: pd.DataFrame, result_value: str) -> pd.DataFrame:
+        """
+        Matched transactions already mapped to another category, grouped by the existing rule which decided it - the
+        last of triggered pattern rules, or the index rule.
+        """
+        mapped = matched[~matched["category"].isin(["Not mapped", result_value])]
+        triggered = mapped["rules_triggered"].astype(str).str.strip()
+        deciding_rule = np.where(
+            triggered.str.startswith("Index rule"), triggered, triggered.str.rsplit(" ", n=1).str[-1]
+        )
+        return (
+            mapped.assign(rule=deciding_rule)
+            .groupby(["rule", "category"], sort=False)
+            .agg(transactions=("PLN", "size"), PLN=("PLN", "sum"))
+            .reset_index()
+            .sort_values("transactions", ascending=False, ignore_index=True)
+            .round({"PLN": 2})
+        )
+
+
+def format_preview(preview: RulePreview, top: Optional[int] = 10) -> str:
+    summary = preview.summary()
+    lines = [
+        f"{preview.rule}",
+        f"Matched {summary['transactions']} transactions, PLN total {summary['total_pln']}, "
+        f"{summary['newly_mapped']} not mapped yet ({summary['elapsed_ms']} ms)",
+    ]
+    if not preview.matched.empty:
+        largest = preview.matched.reindex(preview.matched["PLN"].abs().sort_values(ascending=False).index)
+        lines += ["Largest matched transactions:", largest.head(top).to_string(index=False)]
+    if not preview.conflicts.empty:
+        lines += [
+            f"Conflicts with existing rules ({summary['conflicting']} transactions):",
+            preview.conflicts.head(top).to_string(index=False),
+        ]
+    return "\n".join(lines)
@@ -0,0 +1,287 @@
+"""
+Compiled form of PatternRules. Rules are validated with pydantic MappingRules models once, then compiled into plain
+objects - lowercased patterns and parsed comparison operators - and saved as a snapshot keyed by a content hash of
+their source (PatternRules worksheet or YAML file). Following runs with unchanged rules load the snapshot instead of
+building the models again.
+
+CompiledRuleSet.evaluate applies rules in their order with the same semantics as MappingRule.create_mask, but text
+columns are lowercased once, and every pattern is checked only against distinct values of a column.
+"""
+
+import hashlib
+import json
+import operator
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from src.exceptions import MaskCreationException
+from src.parsers.mbank.mapping_rules import (
+    MappingRule,
+    MappingRules,
+    NumericalMappingField,
+    PatternMappingField,
+)
+from src.utils.cache import LocalCache
+
+RULE_SNAPSHOT_VERSION = 1
+
+OPERATORS = {
+    ">": operator.gt,
+    "<": operator.lt,
+    ">=": operator.ge,
+    "<=": operator.le,
+    "!=": operator.ne,
+    "==": operator.eq,
+}
+
+# Column depending on results of previously applied rules - it can not be precomputed
+DYNAMIC_COLUMNS = ("category",)
+
+
+@dataclass(frozen=True)
+class CompiledPattern:
+    column: str
+    value: str
+
+
+@dataclass(frozen=True)
+class CompiledComparison:
+    column: str
+    sign: str
+    value: float
+
+
+@dataclass
+class CompiledRule:
+    id: int
+    result_value: str
+    patterns: Tuple[CompiledPattern, ...]
+    comparisons: Tuple[CompiledComparison, ...]
+    description: str
+
+    def __str__(self):
+        return self.description
+
+
+@dataclass
+class RuleSetResult:
+    category: pd.Series
+    rules_triggered: pd.Series
+    hit_counts: Dict[int, int]
+
+
+def compile_rule(mapping_rule: MappingRule) -> CompiledRule:
+    patterns, comparisons = [], []
+    for attr, mapping_field in mapping_rule.__dict__.items():
+        if attr in ["id", "result_value"] or not mapping_field:
+            continue
+        if isinstance(mapping_field, PatternMappingField):
+            patterns.append(CompiledPattern(mapping_field.name, str(mapping_field.value).lower()))
+        elif isinstance(mapping_field, NumericalMappingField):
+            comparisons.append(_compile_comparison(mapping_field))
+    return CompiledRule(
+        id=mapping_rule.id,
+        result_value=mapping_rule.result_value,
+        patterns=tuple(patterns),
+        comparisons=tuple(comparisons),
+        description=str(mapping_rule),
+    )
+
+
+def _compile_comparison(mapping_field: NumericalMappingField) -> CompiledComparison:
+    value = mapping_field.value
+    if isinstance(value, str) and any(char in value for char in "!<>="):
+        sign, comparison_value = value.split(" ")
+        if sign not in OPERATORS or sign == "==":
+            raise MaskCreationException(
+                f"Operator sign {sign} cannot be used. Possible values: {[op for op in OPERATORS if op != '==']}"
+            )
+        return CompiledComparison(mapping_field.name, sign, float(comparison_value))
+    return CompiledComparison(mapping_field.name, "==", float(value))
+
+
+def rule_records_from_frame(rules: pd.DataFrame) -> List[dict]:
+    """
+    Rows of PatternRules worksheet transformed into MappingRule dictionaries - empty cells are skipped, other ones
+    become mapping fields.
+    """
+    def transform_row_into_mapping_rule(dct: dict) -> dict:
+        for key in list(dct.keys())[::-1]:
+            if key not in ["id", "result_value"]:
+                if dct[key]:
+                    dct[key] = {"name": key, "value": dct[key]}
+                else:
+                    del dct[key]
+        return dct
+
+    return [transform_row_into_mapping_rule(dct) for dct in rules.to_dict("records")]
+
+
+def rule_records_from_yaml(path: Path) -> List[dict]:
+    """
+    Rules saved in YAML file (e.g. mbank/mbank_mapping_rules.yml). `pattern` key is matched against description.
+    """
+    import yaml
+
+    with open(path, encoding="utf-8") as stream:
+        rules = yaml.safe_load(stream) or []
+
+    records = []
+    for rule in rules:
+        rule = dict(rule)
+        if "pattern" in rule:
+            rule["description"] = rule.pop("pattern")
+        records.append({
+            key: value if key in ["id", "result_value"] else {"name": key, "value": value}
+            for key, value in rule.items()
+            if key in ["id", "result_value"] or value
+        })
+    return records
+
+
+def content_hash(records: List[dict]) -> str:
+    serialized = json.dumps(records, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(serialized.encode()).hexdigest()
+
+
+@dataclass
+class CompiledRuleSet:
+    rules: List[CompiledRule]
+    source_hash: str
+    version: int = RULE_SNAPSHOT_VERSION
+    _by_id: Dict[int, CompiledRule] = field(default_factory=dict, repr=False)
+
+    def __post_init__(self):
+        self._by_id = {rule.id: rule for rule in self.rules}
+
+    def __len__(self):
+        return len(self.rules)
+
+    def __getitem__(self, rule_id: int) -> CompiledRule:
+        return self._by_id[rule_id]
+
+    @classmethod
+    def compile(cls, records: List[dict], source_hash: Optional[str] = None) -> "CompiledRuleSet":
+        mapping_rules = MappingRules(mapping_rules=records)
+        return cls(
+            rules=[compile_rule(mapping_rule) for mapping_rule in mapping_rules.mapping_rules],
+            source_hash=source_hash or content_hash(records),
+        )
+
+    @classmethod
+    def load(cls, records: List[dict], cache: Optional[LocalCache] = None) -> Tuple["CompiledRuleSet", bool]:
+        """
+        Compiled rule set from the snapshot matching content of the rules, or compiled from scratch.
+        :return: rule set and flag, if it was loaded from the snapshot
+        """
+        cache = cache or LocalCache("rule_snapshots")
+        source_hash = content_hash(records)
+        snapshot = cache.get(source_hash)
+        if isinstance(snapshot, cls) and snapshot.version == RULE_SNAPSHOT_VERSION:
+            return snapshot, True
+
+        rule_set = cls.compile(records, source_hash)
+        cache.set(source_hash, rule_set)
+        return rule_set, False
+
+    def evaluate(
+        self, df: pd.DataFrame, mappable: Union[pd.Series, np.ndarray, None] = None, workers: Optional[int] = None
+    ) -> RuleSetResult:
+        """
+        Applying all rules in their order. The last matching rule decides about the category, ids of all matching
+        rules are listed in rules_triggered.
+        :param workers: number of processes evaluating chunks of rows (0 - all cores), used for large frames only
+        """
+        if workers is not None and workers != 1:
+            from src.parsers.mbank.parallel_rules import PARALLEL_MIN_ROWS, evaluate_parallel
+
+            if df.shape[0] >= PARALLEL_MIN_ROWS:
+                return evaluate_parallel(self, df, mappable, workers or None)
+
+        columns = _EvaluationColumns(df)
+        mappable = np.ones(df.shape[0], dtype=bool) if mappable is None else np.asarray(mappable, dtype=bool)
+        category = df["category"].to_numpy(dtype=object, copy=True)
+
+        hit_rows, hit_ids, hit_counts = [], [], {}
+        for rule in self.rules:
+            mask = mappable.copy()
+            for pattern in rule.patterns:
+                if not mask.any():
+                    break
+                if pattern.column in DYNAMIC_COLUMNS:
+                    mask &= _contains(pd.Series(category).map(str).str.lower().to_numpy(dtype=object), pattern.value)
+                else:
+                    mask &= columns.contains(pattern.column, pattern.value)
+            for comparison in rule.comparisons:
+                if not mask.any():
+                    break
+                mask &= OPERATORS[comparison.sign](columns.numeric(comparison.column), comparison.value)
+
+            rows = np.flatnonzero(mask)
+            hit_counts[rule.id] = rows.size
+            if rows.size:
+                category[rows] = rule.result_value
+                hit_rows.append(rows)
+                hit_ids.append(np.full(rows.size, rule.id))
+
+        return RuleSetResult(
+            category=pd.Series(category, index=df.index, name="category"),
+            rules_triggered=_join_triggered_rules(df, hit_rows, hit_ids),
+            hit_counts=hit_counts,
+        )
+
+
+def evaluation_column(df: pd.DataFrame, column: str) -> pd.Series:
+    if column not in df.columns and column in ["year", "month"] and "date" in df.columns:
+        return getattr(df["date"].dt, column)
+    return df[column]
+
+
+def _contains(values: np.ndarray, pattern: str) -> np.ndarray:
+    return np.fromiter((pattern in value for value in values), dtype=bool, count=len(values))
+
+
+class _EvaluationColumns:
+    """
+    Lazily prepared columns of the evaluated frame - text columns factorized and lowercased once, so every pattern is
+    checked only against distinct values, and numerical columns as float arrays.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self._factorized = {}
+        self._numeric = {}
+        self._matches = {}
+
+    def contains(self, column: str, pattern: str) -> np.ndarray:
+        if (column, pattern) not in self._matches:
+            if column not in self._factorized:
+                codes, uniques = pd.factorize(evaluation_column(self.df, column).astype(str))
+                self._factorized[column] = (codes, np.array([value.lower() for value in uniques], dtype=object))
+            codes, uniques = self._factorized[column]
+            self._matches[(column, pattern)] = _contains(uniques, pattern)[codes]
+        return self._matches[(column, pattern)]
+
+    def numeric(self, column: str) -> np.ndarray:
+        if column not in self._numeric:
+            self._numeric[column] = evaluation_column(self.df, column).to_numpy(dtype=float)
+        return self._numeric[column]
+
+
+def _join_triggered_rules(df: pd.DataFrame, hit_rows: List[np.ndarray], hit_ids: List[np.ndarray]) -> pd.Series:
+    existing = df["rules_triggered"].astype(str).to_numpy(dtype=object)
+    if not hit_rows:
+        return pd.Series(existing, index=df.index, name="rules_triggered").str.strip()
+
+    rows, ids = np.concatenate(hit_rows), np.concatenate(hit_ids)
+    # Stable sort keeps ids of every row in the order of rules
+    order = np.argsort(rows, kind="stable")
+    joined = pd.Series(ids[order].astype(str)).groupby(rows[order]).agg(" ".join)
+
+    triggered = existing.copy()
+    triggered[joined.index.to_numpy()] = existing[joined.index.to_numpy()] + " " + joined.to_numpy(dtype=object)
+    return pd.Series(triggered, index=df.index, name="rules_triggered").str.strip()
@@ -0,0 +1,52 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+def parse_amounts(amounts: pd.Series) -> pd.Series:
+    """
+    Vectorized parsing of mBank amounts like "-1 234,56 PLN" into floats.
+    """
+    return pd.to_numeric(
+        amounts.astype(str)
+        .str.replace(r"[^\d,.\-]", "", regex=True)
+        .str.replace(",", ".", regex=False)
+    )
+
+
+def transaction_keys(df: pd.DataFrame, key_columns: List[str]) -> pd.Series:
+    """
+    64-bit hash of normalized transaction keys - descriptions are compared case and whitespace insensitive, and
+    amounts are rounded to grosz, so the same transaction exported twice gets the same key.
+    """
+    key = df[key_columns].copy()
+    for column in key_columns:
+        if key[column].dtype == object:
+            key[column] = key[column].str.lower().str.split().str.join(" ")
+        elif pd.api.types.is_float_dtype(key[column]):
+            key[column] = key[column].round(2)
+    return pd.util.hash_pandas_object(key, index=False)
+
+
+def drop_duplicated_transactions(
+    df: pd.DataFrame, key_columns: List[str], source_column: str = "source", id_column: Optional[str] = None
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Removing transactions repeated in several statements (e.g. overlapping exports) in O(n), using a hash index over
+    normalized transaction keys. Identical transactions within one statement are legitimate (two equal payments in
+    one day), so a key is kept as many times as it occurs in the statement that contains it most often.
+    :param id_column: if given, removed rows get `duplicate_of` column with the id of the kept copy
+    :return: frame without duplicates and removed rows
+    """
+    keys = transaction_keys(df, key_columns)
+    occurrence = keys.groupby([keys.values, df[source_column].values]).cumcount()
+    copies = pd.DataFrame({"key": keys.values, "occurrence": occurrence.values})
+    duplicated = copies.duplicated().values
+    removed = df.loc[duplicated]
+    if id_column is not None:
+        # Position of the first (kept) row of every key and occurrence
+        positions = pd.Series(np.arange(len(copies)))
+        kept_position = positions.groupby([copies["key"], copies["occurrence"]]).transform("first")
+        removed = removed.assign(duplicate_of=df[id_column].to_numpy()[kept_position.to_numpy()[duplicated]])
+    return df.loc[~duplicated], removed
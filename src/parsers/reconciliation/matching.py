@@ -0,0 +1,183 @@
+"""
+Matching of Baselinker orders with incoming mBank transfers. Payments of every currency are sorted by amount, so
+candidates of all orders are found with two vectorized binary searches (amount - tolerance, amount + tolerance) and
+only those candidate pairs are filtered by the date window - no cross join of orders and payments is ever built.
+
+A pair is matched when the order and the payment are each other's only candidates. Transfers mentioning the order id
+in their description take precedence over other candidates of the order (and of the transfer). Everything else with some candidates is
+ambiguous and left for review, the rest is unmatched.
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+# payment_done is truncated to integer by OrderSchema, so amounts can differ by less than 1
+AMOUNT_TOLERANCE = 1.0
+DAYS_BEFORE = 7
+DAYS_AFTER = 14
+
+ORDER_COLUMNS = ["order_id", "order_date", "currency", "payment_done"]
+PAYMENT_COLUMNS = ["payment_id", "payment_date", "currency", "amount", "description"]
+
+
+EXCEL_EPOCH = pd.Timestamp("1899-12-30")
+
+
+@dataclass
+class ReconciliationResult:
+    matched: pd.DataFrame
+    ambiguous: pd.DataFrame
+    unmatched_orders: pd.DataFrame
+    unmatched_payments: pd.DataFrame
+
+    def summary(self) -> dict:
+        return dict(
+            matched=self.matched.shape[0],
+            ambiguous_orders=self.ambiguous["order_id"].nunique() if not self.ambiguous.empty else 0,
+            unmatched_orders=self.unmatched_orders.shape[0],
+            unmatched_payments=self.unmatched_payments.shape[0],
+        )
+
+
+def excel_days(dates: pd.Series) -> pd.Series:
+    """
+    Dates as serial numbers of days, as both parsers push them (datetime_to_excel_date). Dates read as formatted text
+    (e.g. yyyy-mm-dd of ParsedData) are parsed.
+    """
+    days = pd.to_numeric(dates, errors="coerce").astype(float)
+    text = days.isna() & (dates.astype(str).str.strip() != "")
+    if text.any():
+        parsed = pd.to_datetime(dates[text].astype(str), errors="coerce")
+        days[text] = (parsed - EXCEL_EPOCH) / pd.Timedelta(days=1)
+    return days
+
+
+def orders_from_lines(order_lines: pd.DataFrame) -> pd.DataFrame:
+    """
+    One row per order from BaselinkerData, which has one row per ordered product.
+    """
+    return (
+        order_lines.groupby("order_id", sort=False)
+        .agg(
+            order_date=("date_confirmed", "first"),
+            currency=("currency", "first"),
+            payment_done=("payment_done", "first"),
+        )
+        .reset_index()
+        .astype({"payment_done": float})
+        .pipe(lambda orders: orders.assign(order_date=excel_days(orders["order_date"])))
+    )
+
+
+def payments_from_transactions(transactions: pd.DataFrame) -> pd.DataFrame:
+    """
+    Incoming transfers from ParsedData, with the amount in the currency of the transfer.
+    """
+    incoming = transactions[transactions["type"] == "Wpływ"]
+    amount = np.where(
+        incoming["currency"] == "EUR",
+        pd.to_numeric(incoming["EUR"], errors="coerce"),
+        pd.to_numeric(incoming["PLN"], errors="coerce"),
+    )
+    return pd.DataFrame({
+        "payment_id": incoming["id"].to_numpy(),
+        "payment_date": excel_days(incoming["date"]).to_numpy(),
+        "currency": incoming["currency"].to_numpy(),
+        "amount": amount,
+        "description": incoming["description"].astype(str).to_numpy(),
+    })
+
+
+def candidate_pairs(
+    orders: pd.DataFrame,
+    payments: pd.DataFrame,
+    tolerance: float = AMOUNT_TOLERANCE,
+    days_before: float = DAYS_BEFORE,
+    days_after: float = DAYS_AFTER,
+) -> pd.DataFrame:
+    """
+    Positions of all (order, payment) pairs in the same currency, with amounts within the tolerance and the payment
+    made at most `days_before` days before and `days_after` days after the order confirmation.
+    """
+    pairs = []
+    for currency, currency_orders in orders.groupby("currency", sort=False):
+        currency_payments = payments.index[payments["currency"].to_numpy() == currency].to_numpy()
+        if not currency_payments.size:
+            continue
+        order_positions = orders.index.get_indexer(currency_orders.index)
+
+        by_amount = currency_payments[np.argsort(payments["amount"].to_numpy()[currency_payments], kind="stable")]
+        sorted_amounts = payments["amount"].to_numpy()[by_amount]
+        order_amounts = currency_orders["payment_done"].to_numpy()
+        lower = np.searchsorted(sorted_amounts, order_amounts - tolerance, side="left")
+        upper = np.searchsorted(sorted_amounts, order_amounts + tolerance, side="right")
+
+        counts = upper - lower
+        if not counts.sum():
+            continue
+        # Expanding [lower, upper) ranges of all orders into flat arrays of candidate pairs
+        order_index = np.repeat(order_positions, counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        payment_index = by_amount[np.repeat(lower, counts) + offsets]
+
+        days = payments["payment_date"].to_numpy()[payment_index] - orders["order_date"].to_numpy()[order_index]
+        in_window = (days >= -days_before) & (days <= days_after)
+        pairs.append(pd.DataFrame({"order": order_index[in_window], "payment": payment_index[in_window]}))
+
+    if not pairs:
+        return pd.DataFrame({"order": np.array([], dtype=int), "payment": np.array([], dtype=int)})
+    return pd.concat(pairs, ignore_index=True)
+
+
+def _prefer_references(pairs: pd.DataFrame, orders: pd.DataFrame, payments: pd.DataFrame) -> pd.DataFrame:
+    order_ids = orders["order_id"].astype(str).to_numpy()[pairs["order"].to_numpy()]
+    descriptions = payments["description"].to_numpy()[pairs["payment"].to_numpy()]
+    references = [order_id in description for order_id, description in zip(order_ids, descriptions)]
+    pairs = pairs.assign(reference=np.array(references, dtype=bool))
+    # A transfer referring to the order is kept as the only candidate of both of them
+    order_has_reference = pairs.groupby("order")["reference"].transform("any")
+    payment_has_reference = pairs.groupby("payment")["reference"].transform("any")
+    return pairs[pairs["reference"] | ~(order_has_reference | payment_has_reference)]
+
+
+def reconcile(
+    orders: pd.DataFrame,
+    payments: pd.DataFrame,
+    tolerance: float = AMOUNT_TOLERANCE,
+    days_before: float = DAYS_BEFORE,
+    days_after: float = DAYS_AFTER,
+) -> ReconciliationResult:
+    orders = orders[ORDER_COLUMNS].reset_index(drop=True)
+    payments = payments[PAYMENT_COLUMNS].reset_index(drop=True)
+
+    pairs = candidate_pairs(orders, payments, tolerance, days_before, days_after)
+    pairs = _prefer_references(pairs, orders, payments)
+    order_candidates = pairs.groupby("order")["payment"].transform("size")
+    payment_candidates = pairs.groupby("payment")["order"].transform("size")
+    unique = (order_candidates == 1) & (payment_candidates == 1)
+
+    def pair_details(selected: pd.DataFrame) -> pd.DataFrame:
+        details = pd.concat(
+            [
+                orders.iloc[selected["order"].to_numpy()].reset_index(drop=True),
+                payments.iloc[selected["payment"].to_numpy()].drop(columns="currency").reset_index(drop=True),
+            ],
+            axis=1,
+        )
+        return details.assign(
+            amount_difference=(details["amount"] - details["payment_done"]).round(2),
+            days_difference=details["payment_date"] - details["order_date"],
+            reference_match=selected["reference"].to_numpy(),
+        )
+
+    ambiguous = pair_details(pairs[~unique])
+    ambiguous.insert(1, "candidates", order_candidates[~unique].to_numpy())
+
+    return ReconciliationResult(
+        matched=pair_details(pairs[unique]),
+        ambiguous=ambiguous.sort_values(["order_id", "days_difference"], ignore_index=True),
+        unmatched_orders=orders.drop(index=pairs["order"].unique()),
+        unmatched_payments=payments.drop(index=pairs["payment"].unique()),
+    )
@@ -0,0 +1,130 @@
+from typing import Optional
+
+import pandas as pd
+from gspread.utils import ValueRenderOption
+
+from src.gdrive_connection.base import GSheetConnection, GWorksheet
+from src.parsers.base import BaseParser
+from src.parsers.reconciliation.matching import (
+    AMOUNT_TOLERANCE,
+    DAYS_AFTER,
+    DAYS_BEFORE,
+    ReconciliationResult,
+    orders_from_lines,
+    payments_from_transactions,
+    reconcile,
+)
+from src.utils.steps import Steps
+
+DATE_COLUMNS = ["order_date", "payment_date"]
+ID_COLUMNS = ["order_id", "payment_id"]
+
+
+class ReconciliationParser(BaseParser):
+    """
+    Matching orders pushed by BaselinkerParser (BaselinkerData) with incoming transfers pushed by MBankParser
+    (ParsedData). Both worksheets are read from the reconciled spreadsheet, unless other spreadsheets are given.
+    """
+
+    INPUT_WORKSHEETS = {
+        "BaselinkerData": None,
+        "ParsedData": None,
+    }
+
+    def __init__(
+        self,
+        spreadsheet_name: str,
+        spreadsheet: GSheetConnection = None,
+        orders_spreadsheet: Optional[GSheetConnection] = None,
+        payments_spreadsheet: Optional[GSheetConnection] = None,
+        tolerance: float = AMOUNT_TOLERANCE,
+        days_before: float = DAYS_BEFORE,
+        days_after: float = DAYS_AFTER,
+    ):
+        """
+        :param tolerance: allowed difference between the transfer and payment_done of the order
+        :param days_before: how many days before the order confirmation the transfer can be made
+        :param days_after: how many days after the order confirmation the transfer can be made
+        """
+        super().__init__(spreadsheet_name, spreadsheet)
+
+        self.orders_spreadsheet = orders_spreadsheet or self.spreadsheet
+        self.payments_spreadsheet = payments_spreadsheet or self.spreadsheet
+        self.tolerance = tolerance
+        self.days_before = days_before
+        self.days_after = days_after
+
+    def build_steps(self) -> Steps:
+        return Steps([
+            (self.load_orders, {}),
+            (self.match_payments, {}),
+            (self.push_matched, {}),
+            (self.push_ambiguous, {}),
+            (self.push_unmatched, {}),
+            (self.push_warnings, {}),
+        ])
+
+    def load_orders(self, dummy=None) -> pd.DataFrame:
+        order_lines = self.orders_spreadsheet["BaselinkerData"].get_data(ValueRenderOption.unformatted)
+        orders = orders_from_lines(order_lines)
+        self.logger.info("Orders loaded", orders=orders.shape[0])
+        return orders
+
+    def match_payments(self, orders: pd.DataFrame) -> ReconciliationResult:
+        # ParsedData formats dates as yyyy-mm-dd, unformatted values are serial numbers of days
+        transactions = self.payments_spreadsheet["ParsedData"].get_data(ValueRenderOption.unformatted)
+        payments = payments_from_transactions(transactions)
+        self.logger.info("Incoming transfers loaded", payments=payments.shape[0])
+
+        other_currencies = sorted(set(orders["currency"]) - set(payments["currency"]))
+        if other_currencies:
+            self._warn_with_caching(
+                "There are no incoming transfers in {currencies}, orders paid in these currencies can not be matched.",
+                currencies=", ".join(other_currencies),
+            )
+
+        result = reconcile(orders, payments, self.tolerance, self.days_before, self.days_after)
+        self.logger.info("Payments reconciled", **result.summary())
+        return result
+
+    @staticmethod
+    def _readable(data: pd.DataFrame) -> pd.DataFrame:
+        data = data.copy()
+        for column in DATE_COLUMNS:
+            if column in data.columns:
+                # Both parsers push dates as serial numbers of days (datetime_to_excel_date)
+                data[column] = pd.to_datetime(data[column], unit="D", origin="1899-12-30").dt.strftime("%Y-%m-%d")
+        # Ids stay integers even in columns with empty cells
+        return data.astype({column: object for column in ID_COLUMNS if column in data.columns})
+
+    def _push(self, worksheet_name: str, data: pd.DataFrame):
+        worksheet = self._output_worksheet(worksheet_name)
+        worksheet.worksheet.clear()
+        worksheet.update_data(data)
+
+    def _output_worksheet(self, worksheet_name: str) -> GWorksheet:
+        return GWorksheet(self.spreadsheet.get_worksheet(worksheet_name, create_if_missing=True))
+
+    def push_matched(self, result: ReconciliationResult) -> ReconciliationResult:
+        self._push("ReconciliationMatched", self._readable(result.matched))
+        return result
+
+    def push_ambiguous(self, result: ReconciliationResult) -> ReconciliationResult:
+        self._push("ReconciliationAmbiguous", self._readable(result.ambiguous))
+        return result
+
+    def push_unmatched(self, result: ReconciliationResult) -> ReconciliationResult:
+        unmatched = pd.concat(
+            [
+                self._readable(result.unmatched_orders).assign(kind="order"),
+                self._readable(result.unmatched_payments).assign(kind="payment"),
+            ],
+            ignore_index=True,
+        )
+        self._push("ReconciliationUnmatched", unmatched[["kind", *unmatched.columns.drop("kind")]])
+        return result
+
+    def push_warnings(self, dummy=None):
+        logging_worksheet = self._output_worksheet("ReconciliationWarnings")
+        logging_worksheet.worksheet.clear()
+        logging_worksheet.update_data(self.warnings.as_frame())
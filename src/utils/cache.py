@@ -0,0 +1,298 @@
+"""
+Local on-disk caches of python objects. Every cache has its own namespace (directory) under one root - by default
+backups/cache, or the directory set in CITYLION_CACHE_DIR environment variable.
+
+Entries are pickled together with a format version and the version of their namespace, so entries written by older
+code are treated as missing instead of being loaded, and they are written atomically - a crashed run can never leave
+a half written entry behind. Reading an entry refreshes its modification time, so CacheManager can evict the least
+recently used entries when the root grows over its size limit, as well as entries unused for too long. Hits and
+misses of every namespace are counted and saved in the root when the process exits.
+
+This module is imported by light commands of the command line interface (cache-info, cache-prune), so it must not
+import pandas or other heavy dependencies.
+"""
+
+import atexit
+import json
+import os
+import pickle
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from threading import Lock
+from typing import Any, Dict, Iterable, List, Optional
+
+from src.utils.paths import BACKUPS_DIR, PROJECT_ROOT
+
+CACHE_ROOT_ENV = "CITYLION_CACHE_DIR"
+MAX_SIZE_ENV = "CITYLION_CACHE_MAX_MB"
+MAX_AGE_ENV = "CITYLION_CACHE_MAX_AGE_DAYS"
+
+DEFAULT_CACHE_ROOT = BACKUPS_DIR / "cache"
+DEFAULT_MAX_SIZE_MB = 2048
+DEFAULT_MAX_AGE_DAYS = 180
+# Version of the entry envelope - bumping it invalidates entries of all namespaces
+CACHE_FORMAT = 1
+STATS_FILE = "stats.json"
+ENTRY_SUFFIX = ".pkl"
+# Part of the size limit which can be written by a process before the limits are enforced again
+PRUNE_AFTER_WRITTEN_SHARE = 0.1
+TEMPORARY_FILE_MAX_AGE_S = 3600
+EVENTS = ("hits", "misses", "writes", "evictions")
+
+
+def cache_root() -> Path:
+    return Path(os.environ.get(CACHE_ROOT_ENV) or DEFAULT_CACHE_ROOT)
+
+
+def _env_number(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+class _Stats:
+    """
+    Hit and miss counters of all caches used by the process, merged into the stats file of their root at exit.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._counts: Dict[Path, Dict[str, Dict[str, int]]] = {}
+        # Bytes written into roots since their limits were enforced - roots not enforced in this process are missing
+        self._written: Dict[Path, int] = {}
+
+    def count(self, root: Path, namespace: str, event: str, size: int = 0):
+        with self._lock:
+            counts = self._counts.setdefault(root, {}).setdefault(namespace, dict.fromkeys(EVENTS, 0))
+            counts[event] += 1
+            if event == "writes" and root in self._written:
+                self._written[root] += size
+
+    def should_enforce_limits(self, root: Path, max_bytes: float) -> bool:
+        with self._lock:
+            if root in self._written and self._written[root] < max_bytes * PRUNE_AFTER_WRITTEN_SHARE:
+                return False
+            self._written[root] = 0
+            return True
+
+    def pending(self, root: Path) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {namespace: dict(counts) for namespace, counts in self._counts.get(root, {}).items()}
+
+    def flush(self):
+        with self._lock:
+            counts, self._counts = self._counts, {}
+        for root, namespaces in counts.items():
+            if not root.exists():
+                continue
+            saved = read_stats(root)
+            for namespace, namespace_counts in namespaces.items():
+                totals = saved.setdefault(namespace, dict.fromkeys(EVENTS, 0))
+                for event, count in namespace_counts.items():
+                    totals[event] = totals.get(event, 0) + count
+            _atomic_write(root / STATS_FILE, json.dumps(saved, indent=2, sort_keys=True).encode())
+
+
+_stats = _Stats()
+atexit.register(_stats.flush)
+
+
+def read_stats(root: Path) -> Dict[str, Dict[str, int]]:
+    try:
+        return json.loads((root / STATS_FILE).read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def _atomic_write(path: Path, content: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    descriptor, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as stream:
+            stream.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+
+class LocalCache:
+    def __init__(self, namespace: str, root: Optional[Path] = None, version: int = 1):
+        """
+        :param root: directory of all caches - cache_root() if not given
+        :param version: version of entries in this namespace - bumping it invalidates entries written before
+        """
+        self.namespace = namespace
+        self.root = Path(root) if root is not None else cache_root()
+        self.directory = self.root / namespace
+        self.version = version
+
+    def _path(self, key: str) -> Path:
+        safe_key = "".join(char if char.isalnum() or char in "-_." else "_" for char in str(key))
+        return self.directory / f"{safe_key}{ENTRY_SUFFIX}"
+
+    def get(self, key: str, default: Any = None) -> Any:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as stream:
+                envelope = pickle.load(stream)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            envelope = None
+
+        # Entries of older formats or versions (and plain pickles written before entries were versioned) are missing
+        current = isinstance(envelope, dict) and envelope.get("format") == CACHE_FORMAT
+        if not current or envelope.get("version") != self.version:
+            _stats.count(self.root, self.namespace, "misses")
+            return default
+
+        _stats.count(self.root, self.namespace, "hits")
+        try:
+            # Modification time is the last use of the entry for the eviction
+            os.utime(path)
+        except OSError:
+            pass
+        return envelope["value"]
+
+    def set(self, key: str, value: Any):
+        envelope = dict(format=CACHE_FORMAT, version=self.version, value=value)
+        content = pickle.dumps(envelope, protocol=pickle.HIGHEST_PROTOCOL)
+        _atomic_write(self._path(key), content)
+        _stats.count(self.root, self.namespace, "writes", len(content))
+        CacheManager(self.root).enforce_limits()
+
+    def delete(self, key: str):
+        self._path(key).unlink(missing_ok=True)
+
+    def migrate_legacy_file(self, key: str, file_name: str):
+        """
+        Moving a pickle written into the working directory (or the project root) by older versions into this cache,
+        unless the cache already has the entry.
+        """
+        for legacy_path in dict.fromkeys([Path(file_name).resolve(), PROJECT_ROOT / file_name]):
+            if not legacy_path.exists():
+                continue
+            if not self._path(key).exists():
+                with open(legacy_path, "rb") as stream:
+                    self.set(key, pickle.load(stream))
+            legacy_path.unlink()
+
+
+@dataclass
+class CacheEntry:
+    namespace: str
+    path: Path
+    size: int
+    last_used: float
+
+
+class CacheManager:
+    """
+    Disk usage, statistics and eviction of all namespaces under one root.
+    """
+
+    def __init__(self, root: Optional[Path] = None, max_size_mb: float = None, max_age_days: float = None):
+        """
+        :param max_size_mb: size limit of the root (CITYLION_CACHE_MAX_MB or DEFAULT_MAX_SIZE_MB if not given)
+        :param max_age_days: entries unused for longer are evicted (CITYLION_CACHE_MAX_AGE_DAYS or
+        DEFAULT_MAX_AGE_DAYS if not given)
+        """
+        self.root = Path(root) if root is not None else cache_root()
+        self.max_size_mb = max_size_mb if max_size_mb is not None else _env_number(MAX_SIZE_ENV, DEFAULT_MAX_SIZE_MB)
+        self.max_age_days = (
+            max_age_days if max_age_days is not None else _env_number(MAX_AGE_ENV, DEFAULT_MAX_AGE_DAYS)
+        )
+
+    def namespaces(self) -> List[str]:
+        if not self.root.exists():
+            return []
+        return sorted(path.name for path in self.root.iterdir() if path.is_dir())
+
+    def entries(self, namespaces: Optional[Iterable[str]] = None) -> List[CacheEntry]:
+        entries = []
+        for namespace in namespaces or self.namespaces():
+            for path in (self.root / namespace).glob(f"*{ENTRY_SUFFIX}"):
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                entries.append(CacheEntry(namespace, path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def report(self) -> List[dict]:
+        """
+        One row per namespace - number of entries, disk usage, last use and hit rate since the stats were reset.
+        """
+        stats = read_stats(self.root)
+        for namespace, counts in _stats.pending(self.root).items():
+            totals = stats.setdefault(namespace, {})
+            for event, count in counts.items():
+                totals[event] = totals.get(event, 0) + count
+
+        entries = self.entries()
+        rows = []
+        for namespace in sorted(set(self.namespaces()) | set(stats)):
+            namespace_entries = [entry for entry in entries if entry.namespace == namespace]
+            counts = stats.get(namespace, {})
+            lookups = counts.get("hits", 0) + counts.get("misses", 0)
+            rows.append(dict(
+                namespace=namespace,
+                entries=len(namespace_entries),
+                size_bytes=sum(entry.size for entry in namespace_entries),
+                last_used=max((entry.last_used for entry in namespace_entries), default=None),
+                hits=counts.get("hits", 0),
+                misses=counts.get("misses", 0),
+                evictions=counts.get("evictions", 0),
+                hit_rate=counts.get("hits", 0) / lookups if lookups else None,
+            ))
+        return rows
+
+    def prune(
+        self,
+        max_size_mb: Optional[float] = None,
+        max_age_days: Optional[float] = None,
+        namespaces: Optional[Iterable[str]] = None,
+        dry_run: bool = False,
+    ) -> List[CacheEntry]:
+        """
+        Evicting entries unused for more than max_age_days, then the least recently used ones until the root fits
+        into max_size_mb. Limits of the manager are used if not given.
+        :return: evicted entries
+        """
+        max_size_mb = self.max_size_mb if max_size_mb is None else max_size_mb
+        max_age_days = self.max_age_days if max_age_days is None else max_age_days
+
+        entries = sorted(self.entries(namespaces), key=lambda entry: entry.last_used)
+        oldest_allowed = time.time() - max_age_days * 86400
+        evicted = [entry for entry in entries if entry.last_used < oldest_allowed]
+        kept = [entry for entry in entries if entry.last_used >= oldest_allowed]
+
+        size = sum(entry.size for entry in self.entries()) - sum(entry.size for entry in evicted)
+        while kept and size > max_size_mb * 2 ** 20:
+            entry = kept.pop(0)
+            evicted.append(entry)
+            size -= entry.size
+
+        if not dry_run:
+            for entry in evicted:
+                entry.path.unlink(missing_ok=True)
+                _stats.count(self.root, entry.namespace, "evictions")
+            self._remove_abandoned_temporary_files()
+        return evicted
+
+    def _remove_abandoned_temporary_files(self):
+        oldest_allowed = time.time() - TEMPORARY_FILE_MAX_AGE_S
+        for path in self.root.glob("**/.*.tmp"):
+            try:
+                if path.stat().st_mtime < oldest_allowed:
+                    path.unlink()
+            except OSError:
+                continue
+
+    def enforce_limits(self):
+        """
+        Pruning with the default limits - once per process when the root is written to for the first time, then
+        whenever a tenth of the size limit has been written since.
+        """
+        if _stats.should_enforce_limits(self.root, self.max_size_mb * 2 ** 20):
+            self.prune()
@@ -1,5 +1,8 @@
+import atexit
 import logging
 import logging.config
+import logging.handlers
+import queue
 import sys
 
 import structlog
@@ -37,10 +40,43 @@ LOGGING_CONFIG = dict(
 )
 
 
+_listener = None
+
+
+def _move_handlers_to_queue():
+    """
+    Records are put into a queue by the logging thread, and written to stdout by a background listener - parsers
+    (often several at once in batch mode) never wait for console output.
+    """
+    global _listener
+
+    root = logging.getLogger()
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, *root.handlers, respect_handler_level=True)
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    _listener.start()
+
+
+def stop_logging():
+    """
+    Flushing records waiting in the queue - called at exit, or before logging is configured again.
+    """
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
+
+
 def setup_logging(verbosity):
+    stop_logging()
     level = max(logging.ERROR - verbosity * 10, logging.DEBUG)
     LOGGING_CONFIG["loggers"][""]["level"] = level
     logging.config.dictConfig(LOGGING_CONFIG)
+    _move_handlers_to_queue()
     structlog.configure(
         processors=[
             structlog.stdlib.add_logger_name,
@@ -0,0 +1,60 @@
+"""
+Helpers keeping frames in a compact memory layout - low cardinality text columns as categoricals and small integers
+in the narrowest integer type. Google Sheets can not take categoricals, so frames are converted back to plain python
+values at the Sheets boundary (GWorksheet.update_data).
+"""
+
+from typing import Iterable
+
+import pandas as pd
+from pandas.api.types import CategoricalDtype, is_integer_dtype
+
+
+def is_categorical(series: pd.Series) -> bool:
+    return isinstance(series.dtype, CategoricalDtype)
+
+
+def compact_dtypes(df: pd.DataFrame, categorical: Iterable[str] = (), integer: Iterable[str] = ()) -> pd.DataFrame:
+    """
+    Converting given columns (if present in the frame) into categoricals and downcasting given integer columns.
+    """
+    conversions = {}
+    for column in categorical:
+        if column in df.columns and not is_categorical(df[column]):
+            conversions[column] = "category"
+    df = df.astype(conversions) if conversions else df
+
+    for column in integer:
+        if column in df.columns and is_integer_dtype(df[column]):
+            df[column] = pd.to_numeric(df[column], downcast="integer")
+    return df
+
+
+def fill_missing(series: pd.Series, value) -> pd.Series:
+    """
+    fillna working also for categoricals, which do not contain the filling value yet.
+    """
+    if is_categorical(series) and value not in series.cat.categories:
+        series = series.cat.add_categories([value])
+    return series.fillna(value)
+
+
+def to_plain_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    categorical = [column for column in df.columns if is_categorical(df[column])]
+    if not categorical:
+        return df
+    return df.astype({column: object for column in categorical})
+
+
+def memory_report(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Memory used by every column of the frame - handy for checking what the compact layout saves.
+    """
+    return (
+        pd.DataFrame({
+            "dtype": df.dtypes.astype(str),
+            "memory_mb": df.memory_usage(deep=True, index=False) / 2 ** 20,
+        })
+        .sort_values("memory_mb", ascending=False)
+        .round(3)
+    )
@@ -0,0 +1,331 @@
+"""
+Resource instrumentation used by Step objects and exporters of the collected measurements. Every Step records its
+runtime, RSS growth, row counts and network calls. Tracing python allocations (tracemalloc) together with deep memory
+usage of processed frames, as well as cProfile profiling, is opt-in because of its overhead.
+
+Collected metrics can be exported as JSON and as a Prometheus textfile-collector file (*.prom), which can be picked up
+by node_exporter running next to the cron jobs.
+"""
+
+import cProfile
+import json
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import tracemalloc
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from io import StringIO
+from pathlib import Path
+from time import perf_counter, time
+from typing import Dict, Iterable, List, Optional
+
+_network_counter: ContextVar[Optional[list]] = ContextVar("network_counter", default=None)
+_network_hook_lock = threading.Lock()
+_network_hook_installed = False
+# Steps tracing allocations at the same time (concurrent jobs of the batch runner, nested pipelines) - tracing is
+# started by the first of them and stopped by the last one
+_tracing_lock = threading.Lock()
+_tracing_steps = 0
+_tracing_started_here = False
+
+
+@dataclass
+class StepMetrics:
+    """
+    RSS and traced allocations are process-wide - when steps run concurrently (batch runner with several workers),
+    rss_delta_bytes and traced_peak_bytes include allocations of the other running steps.
+    """
+
+    step: str
+    elapsed_time: float = None
+    rss_delta_bytes: int = None
+    # Peak RSS of the process so far (it never goes down), not of the step - exported once per run
+    process_peak_rss_bytes: int = None
+    # Peak of traced allocations during the step above those traced at its start
+    traced_peak_bytes: int = None
+    rows_in: int = None
+    rows_out: int = None
+    frame_memory_in_bytes: int = None
+    frame_memory_out_bytes: int = None
+    network_calls: int = 0
+    profile_path: str = None
+    finished_at: str = None
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def install_network_hook():
+    """
+    Wraps requests.Session.send, so every HTTP request made by requests, gspread or google-auth is counted by the
+    counter of the currently running step. Counters live in a ContextVar, so concurrently running pipelines do not
+    mix up their numbers.
+    """
+    global _network_hook_installed
+
+    with _network_hook_lock:
+        if _network_hook_installed:
+            return
+        try:
+            import requests
+        except ImportError:
+            return
+
+        original_send = requests.Session.send
+
+        def counted_send(session, request, **kwargs):
+            counter = _network_counter.get()
+            if counter is not None:
+                counter[0] += 1
+            return original_send(session, request, **kwargs)
+
+        requests.Session.send = counted_send
+        _network_hook_installed = True
+
+
+def current_rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+def peak_rss_bytes() -> Optional[int]:
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _start_tracing() -> int:
+    """
+    :return: size of traced allocations at the start of the step
+    """
+    global _tracing_steps, _tracing_started_here
+
+    with _tracing_lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracing_started_here = True
+        _tracing_steps += 1
+        if _tracing_steps == 1:
+            # Resetting the peak would wipe the peak of other steps, so it is done only when no other step is traced
+            tracemalloc.reset_peak()
+        return tracemalloc.get_traced_memory()[0]
+
+
+def _stop_tracing(baseline: int) -> int:
+    """
+    :return: peak of traced allocations above the baseline
+    """
+    global _tracing_steps, _tracing_started_here
+
+    with _tracing_lock:
+        peak = tracemalloc.get_traced_memory()[1]
+        _tracing_steps -= 1
+        if _tracing_steps == 0 and _tracing_started_here:
+            tracemalloc.stop()
+            _tracing_started_here = False
+    return max(peak - baseline, 0)
+
+
+def frame_stats(obj, deep: bool = False):
+    """
+    Number of rows and memory usage of a pandas object. Other objects are described by their length only.
+    """
+    rows = len(obj) if hasattr(obj, "__len__") and not isinstance(obj, (str, bytes)) else None
+    memory = None
+    if hasattr(obj, "memory_usage"):
+        memory = obj.memory_usage(deep=deep)
+        memory = int(memory.sum()) if hasattr(memory, "sum") else int(memory)
+    return rows, memory
+
+
+class StepMonitor:
+    """
+    Context manager measuring a single Step run. Results are stored in the given StepMetrics object.
+    """
+
+    def __init__(self, metrics: StepMetrics, trace_memory=False, profile_dir: Optional[Path] = None):
+        self.metrics = metrics
+        self.trace_memory = trace_memory
+        self.profile_dir = profile_dir
+
+        self._profiler = None
+        self._counter = None
+        self._counter_token = None
+        self._traced_baseline = None
+        self._start_rss = None
+        self._start_time = None
+
+    def measure_input(self, obj):
+        self.metrics.rows_in, self.metrics.frame_memory_in_bytes = frame_stats(obj, deep=self.trace_memory)
+
+    def measure_output(self, obj):
+        self.metrics.rows_out, self.metrics.frame_memory_out_bytes = frame_stats(obj, deep=self.trace_memory)
+
+    def __enter__(self):
+        install_network_hook()
+        self._counter = [0]
+        self._counter_token = _network_counter.set(self._counter)
+
+        if self.trace_memory:
+            self._traced_baseline = _start_tracing()
+
+        if self.profile_dir is not None:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+        self._start_rss = current_rss_bytes()
+        self._start_time = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.metrics.elapsed_time = round(perf_counter() - self._start_time, 3)
+
+        if self._profiler is not None:
+            self._profiler.disable()
+            self.profile_dir.mkdir(parents=True, exist_ok=True)
+            profile_path = self.profile_dir / f"{self.metrics.step}.prof"
+            self._profiler.dump_stats(profile_path)
+            self.metrics.profile_path = str(profile_path)
+
+        end_rss = current_rss_bytes()
+        if end_rss is not None and self._start_rss is not None:
+            self.metrics.rss_delta_bytes = end_rss - self._start_rss
+        self.metrics.process_peak_rss_bytes = peak_rss_bytes()
+
+        if self.trace_memory:
+            self.metrics.traced_peak_bytes = _stop_tracing(self._traced_baseline)
+
+        self.metrics.network_calls = self._counter[0]
+        _network_counter.reset(self._counter_token)
+        self.metrics.finished_at = datetime.now().isoformat(timespec="seconds")
+        return False
+
+
+def profile_summary(profile_path, limit=15) -> str:
+    """
+    Human readable summary of the most expensive calls saved by the step profiler.
+    """
+    stream = StringIO()
+    pstats.Stats(str(profile_path), stream=stream).sort_stats("cumulative").print_stats(limit)
+    return stream.getvalue()
+
+
+def _atomic_write_text(path: Path, content: str):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    descriptor, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "w", encoding="utf-8") as stream:
+            stream.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+
+def export_metrics_json(metrics: Iterable[StepMetrics], path: Path, labels: Optional[Dict[str, str]] = None) -> Path:
+    """
+    Saves metrics of all steps together with run labels (spreadsheet, parser, ...) into a JSON file.
+    """
+    path = Path(path)
+    payload = {
+        "labels": labels or {},
+        "exported_at": datetime.now().isoformat(timespec="seconds"),
+        "steps": [step_metrics.as_dict() for step_metrics in metrics],
+    }
+    _atomic_write_text(path, json.dumps(payload, indent=2, ensure_ascii=False))
+    return path
+
+
+PROMETHEUS_METRICS = {
+    "elapsed_time": ("citylion_step_duration_seconds", "Wall time of a pipeline step."),
+    "rss_delta_bytes": ("citylion_step_rss_delta_bytes", "Resident memory growth during a pipeline step."),
+    "traced_peak_bytes": ("citylion_step_traced_peak_bytes", "Peak of python allocations traced during a step."),
+    "rows_in": ("citylion_step_rows_in", "Number of rows passed to a pipeline step."),
+    "rows_out": ("citylion_step_rows_out", "Number of rows returned by a pipeline step."),
+    "frame_memory_in_bytes": ("citylion_step_frame_memory_in_bytes", "Memory usage of a frame passed to a step."),
+    "frame_memory_out_bytes": ("citylion_step_frame_memory_out_bytes", "Memory usage of a frame returned by a step."),
+    "network_calls": ("citylion_step_network_calls", "HTTP requests made during a pipeline step."),
+}
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+    return ",".join(f'{key}="{escape(value)}"' for key, value in labels.items())
+
+
+def export_prometheus_textfile(
+    metrics: List[StepMetrics], path: Path, labels: Optional[Dict[str, str]] = None
+) -> Path:
+    """
+    Writes metrics in the Prometheus text exposition format. File is replaced atomically, as required by the
+    node_exporter textfile collector.
+    """
+    path = Path(path)
+    labels = labels or {}
+    lines = []
+    for attribute, (metric_name, description) in PROMETHEUS_METRICS.items():
+        samples = [
+            (step_metrics.step, getattr(step_metrics, attribute))
+            for step_metrics in metrics
+            if getattr(step_metrics, attribute) is not None
+        ]
+        if not samples:
+            continue
+        lines.append(f"# HELP {metric_name} {description}")
+        lines.append(f"# TYPE {metric_name} gauge")
+        for step, value in samples:
+            lines.append(f"{metric_name}{{{_format_labels({**labels, 'step': step})}}} {value}")
+
+    process_peaks = [step_metrics.process_peak_rss_bytes for step_metrics in metrics]
+    process_peaks = [peak for peak in process_peaks if peak is not None]
+    if process_peaks:
+        lines.append("# HELP citylion_pipeline_process_peak_rss_bytes Peak resident memory of the process.")
+        lines.append("# TYPE citylion_pipeline_process_peak_rss_bytes gauge")
+        lines.append(f"citylion_pipeline_process_peak_rss_bytes{{{_format_labels(labels)}}} {max(process_peaks)}")
+
+    lines.append("# HELP citylion_pipeline_last_run_timestamp_seconds Unix time of the last finished pipeline run.")
+    lines.append("# TYPE citylion_pipeline_last_run_timestamp_seconds gauge")
+    lines.append(f"citylion_pipeline_last_run_timestamp_seconds{{{_format_labels(labels)}}} {round(time(), 3)}")
+
+    _atomic_write_text(path, "\n".join(lines) + "\n")
+    return path
+
+
+@dataclass
+class MetricsExport:
+    """
+    Options of the metrics export passed down to apply_steps.
+    """
+
+    directory: Path
+    labels: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def file_stem(self) -> str:
+        stem = "_".join(str(value) for value in self.labels.values()) or "pipeline"
+        return "".join(char if char.isalnum() or char in "-_" else "_" for char in stem)
+
+    def export(self, metrics: List[StepMetrics]) -> Dict[str, Path]:
+        directory = Path(self.directory)
+        return dict(
+            json=export_metrics_json(metrics, directory / f"{self.file_stem}.json", self.labels),
+            prometheus=export_prometheus_textfile(metrics, directory / f"{self.file_stem}.prom", self.labels),
+        )
@@ -0,0 +1,9 @@
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+
+BACKUPS_DIR = PROJECT_ROOT / "backups"
+MBANK_DIR = PROJECT_ROOT / "mbank"
+RESULTS_DIR = PROJECT_ROOT / "results"
+METRICS_DIR = RESULTS_DIR / "metrics"
+PROFILES_DIR = RESULTS_DIR / "profiles"
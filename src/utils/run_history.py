@@ -0,0 +1,225 @@
+"""
+Local store of per-step metrics of every pipeline run, kept in a SQLite database. History is keyed by spreadsheet and
+parser name, so runs of different spreadsheets never influence each others baselines.
+
+Steps are stored under the name of their function, not their position in the pipeline, so adding a step does not
+shift baselines of the steps after it.
+
+RunHistory.find_regressions compares the latest run with a rolling baseline (median of previous runs). Slowdown of a
+step is reported together with its input size, and it is classified as a regression only if time per input row has
+grown as well - otherwise it is just bigger data. Steps without input size (the first step of a pipeline) can not be
+normalized, so their slowdowns get a verdict of their own.
+"""
+
+import re
+import sqlite3
+from contextlib import closing
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from statistics import median
+from typing import Iterable, List, Optional
+
+from src.utils.metrics import StepMetrics
+from src.utils.paths import BACKUPS_DIR
+
+RUN_HISTORY_PATH = BACKUPS_DIR / "run_history.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    spreadsheet TEXT NOT NULL,
+    parser TEXT NOT NULL,
+    finished_at TEXT NOT NULL,
+    total_time REAL
+);
+CREATE TABLE IF NOT EXISTS step_runs (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE,
+    step TEXT NOT NULL,
+    elapsed_time REAL,
+    rows_in INTEGER,
+    rows_out INTEGER,
+    rss_delta_bytes INTEGER,
+    traced_peak_bytes INTEGER,
+    frame_memory_out_bytes INTEGER,
+    network_calls INTEGER,
+    PRIMARY KEY (run_id, step)
+);
+CREATE INDEX IF NOT EXISTS runs_key ON runs (spreadsheet, parser, run_id);
+"""
+
+_STEP_COLUMNS = [
+    "elapsed_time",
+    "rows_in",
+    "rows_out",
+    "rss_delta_bytes",
+    "traced_peak_bytes",
+    "frame_memory_out_bytes",
+    "network_calls",
+]
+
+
+# Verdicts of slower steps
+REGRESSION = "regression"
+INPUT_GROWTH = "input growth"
+NOT_NORMALIZED = "slower, no input size"
+
+
+def step_keys(step_names: Iterable[str]) -> List[str]:
+    """
+    Function names of steps named by Steps (e.g. 03-assign_initial_categories). A function used in several steps gets
+    the number of its occurrence, e.g. send_data#2.
+    """
+    keys, occurrences = [], {}
+    for step_name in step_names:
+        function_name = re.sub(r"^\d+-", "", step_name)
+        occurrence = occurrences[function_name] = occurrences.get(function_name, 0) + 1
+        keys.append(function_name if occurrence == 1 else f"{function_name}#{occurrence}")
+    return keys
+
+
+@dataclass
+class StepComparison:
+    step: str
+    elapsed_time: float
+    baseline_time: float
+    rows_in: Optional[int]
+    baseline_rows_in: Optional[float]
+    time_ratio: float
+    rows_ratio: Optional[float]
+    verdict: str
+
+    @property
+    def is_slower(self) -> bool:
+        return self.verdict != "ok"
+
+
+class RunHistory:
+    def __init__(self, path: Path = RUN_HISTORY_PATH):
+        self.path = Path(path)
+
+    def _connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(self.path)
+        connection.execute("PRAGMA foreign_keys = ON")
+        connection.executescript(_SCHEMA)
+        return connection
+
+    def record_run(self, spreadsheet: str, parser: str, metrics: Iterable[StepMetrics]) -> int:
+        metrics = list(metrics)
+        total_time = sum(step_metrics.elapsed_time or 0 for step_metrics in metrics)
+        with closing(self._connect()) as connection, connection:
+            run_id = connection.execute(
+                "INSERT INTO runs (spreadsheet, parser, finished_at, total_time) VALUES (?, ?, ?, ?)",
+                (spreadsheet, parser, datetime.now().isoformat(timespec="seconds"), round(total_time, 3)),
+            ).lastrowid
+            connection.executemany(
+                f"INSERT INTO step_runs (run_id, step, {', '.join(_STEP_COLUMNS)}) "
+                f"VALUES (?, ?, {', '.join('?' for _ in _STEP_COLUMNS)})",
+                [
+                    (run_id, step, *[getattr(step_metrics, column) for column in _STEP_COLUMNS])
+                    for step, step_metrics in zip(step_keys(m.step for m in metrics), metrics)
+                ],
+            )
+        return run_id
+
+    def get_runs(self, spreadsheet: str, parser: str, limit: int = 11) -> List[dict]:
+        """
+        The most recent runs (newest first) with metrics of their steps, keyed by step_keys - runs recorded with
+        numbered step names are read the same way.
+        """
+        with closing(self._connect()) as connection:
+            connection.row_factory = sqlite3.Row
+            runs = connection.execute(
+                "SELECT * FROM runs WHERE spreadsheet = ? AND parser = ? ORDER BY run_id DESC LIMIT ?",
+                (spreadsheet, parser, limit),
+            ).fetchall()
+            result = []
+            for run in runs:
+                steps = connection.execute(
+                    "SELECT * FROM step_runs WHERE run_id = ? ORDER BY rowid", (run["run_id"],)
+                ).fetchall()
+                keys = step_keys(step["step"] for step in steps)
+                steps = {key: {**dict(step), "step": key} for key, step in zip(keys, steps)}
+                result.append({**dict(run), "steps": steps})
+        return result
+
+    def find_regressions(
+        self,
+        spreadsheet: str,
+        parser: str,
+        baseline_runs: int = 10,
+        threshold: float = 0.25,
+        min_seconds: float = 0.5,
+    ) -> List[StepComparison]:
+        """
+        Comparing the latest run with the median of up to `baseline_runs` previous runs.
+        :param threshold: relative slowdown (0.25 = 25%) above which the step is reported
+        :param min_seconds: absolute slowdown below which differences are treated as noise
+        :return: comparison of every step of the latest run that has a baseline
+        """
+        runs = self.get_runs(spreadsheet, parser, limit=baseline_runs + 1)
+        if len(runs) < 2:
+            return []
+        latest, previous = runs[0], runs[1:]
+
+        comparisons = []
+        for step, step_run in latest["steps"].items():
+            history = [run["steps"][step] for run in previous if step in run["steps"]]
+            baseline_times = [run["elapsed_time"] for run in history if run["elapsed_time"] is not None]
+            if not baseline_times or step_run["elapsed_time"] is None:
+                continue
+
+            baseline_time = median(baseline_times)
+            baseline_rows = [run["rows_in"] for run in history if run["rows_in"]]
+            baseline_rows_in = median(baseline_rows) if baseline_rows else None
+
+            time_ratio = step_run["elapsed_time"] / baseline_time if baseline_time else float("inf")
+            rows_ratio = (
+                step_run["rows_in"] / baseline_rows_in
+                if baseline_rows_in and step_run["rows_in"]
+                else None
+            )
+
+            verdict = "ok"
+            if time_ratio > 1 + threshold and step_run["elapsed_time"] - baseline_time > min_seconds:
+                if rows_ratio is None:
+                    verdict = NOT_NORMALIZED
+                else:
+                    verdict = REGRESSION if time_ratio / rows_ratio > 1 + threshold else INPUT_GROWTH
+
+            comparisons.append(
+                StepComparison(
+                    step=step,
+                    elapsed_time=step_run["elapsed_time"],
+                    baseline_time=round(baseline_time, 3),
+                    rows_in=step_run["rows_in"],
+                    baseline_rows_in=baseline_rows_in,
+                    time_ratio=round(time_ratio, 2),
+                    rows_ratio=None if rows_ratio is None else round(rows_ratio, 2),
+                    verdict=verdict,
+                )
+            )
+        # In the order of steps in the latest run
+        return comparisons
+
+
+def format_comparisons(comparisons: List[StepComparison]) -> str:
+    if not comparisons:
+        return "Not enough runs in history to build a baseline."
+
+    header = f"{'step':40} {'time':>9} {'baseline':>9} {'x time':>7} {'rows in':>10} {'x rows':>7}  verdict"
+    lines = [header, "-" * len(header)]
+    # Steps without input size are listed apart - their slowdown is not comparable with the normalized ones
+    normalized = [comparison for comparison in comparisons if comparison.rows_ratio is not None]
+    not_normalized = [comparison for comparison in comparisons if comparison.rows_ratio is None]
+    for section in (normalized, not_normalized):
+        if section is not_normalized and section:
+            lines += ["", "Steps without input size (time is not normalized):"]
+        for comparison in section:
+            lines.append(
+                f"{comparison.step:40} {comparison.elapsed_time:>9} {comparison.baseline_time:>9} "
+                f"{comparison.time_ratio:>7} {str(comparison.rows_in):>10} {str(comparison.rows_ratio):>7}  "
+                f"{comparison.verdict}"
+            )
+    return "\n".join(lines)
@@ -3,16 +3,33 @@
 """
 Classes implemented in this module can help to build easier to understand and more readable code by grouping several
 methods into sequential steps. Steps Class is a Sequence object that contains single Step objects. Step object holds a
-function, and argument for this function, and state parameter - elapsed_time, if step has finished running.
+function, and argument for this function, and state parameters - elapsed_time and resource metrics (see
+src.utils.metrics), if step has finished running.
 
 Steps can be easily logged to the logging handler or printed using repr or str built-in methods.
+
+Outputs of chosen steps can be kept as checkpoints. Long-running processes use them to rerun only the tail of the
+pipeline (Steps.resume_after), when only inputs of the later steps have changed.
 """
 
-from time import perf_counter
 import structlog
 
-
-def apply_steps(steps, apply_to=None, steps_name=None, logger=None, verbose=True):
+from src.utils.metrics import StepMetrics, StepMonitor, MetricsExport, profile_summary
+
+
+def apply_steps(
+    steps,
+    apply_to=None,
+    steps_name=None,
+    logger=None,
+    verbose=True,
+    metrics_export: MetricsExport = None,
+    trace_memory=False,
+    profile_dir=None,
+    checkpoints=(),
+    resume_after=None,
+    on_checkpoint=None,
+):
     """
     This method is use to steer running of specific modules. The main idea behind using it is to encapsulate smaller
     parts of code in functions that take one parameter, and returned it after changes.
@@ -21,13 +38,26 @@ def apply_steps(steps, apply_to=None, steps_name=None, logger=None, verbose=True
     :param apply_to: If you want to pass some object to the first function, you can use this parameter. Otherwise, it
     will be generated after first step
     :param steps_name: name of the process that will be passed to the logger
+    :param metrics_export: MetricsExport object - if given, metrics of all steps are saved as JSON and Prometheus file
+    :param trace_memory: tracing of python allocations and deep memory usage of frames (slows the run down)
+    :param profile_dir: if given, every step is profiled with cProfile and stats are dumped into this directory - the
+    most expensive calls of the slowest step are logged
+    :param checkpoints: names of functions whose outputs are kept for later resuming
+    :param resume_after: name of a checkpointed function - only steps after it are run, starting from its saved output
+    :param on_checkpoint: callable receiving name of a function, called after its output has been saved
     :return: Whatever is returned in the last step function
     """
 
     logger = logger or structlog.getLogger(__name__)
 
     steps = steps if isinstance(steps, Steps) else Steps(steps)
-    final_output = steps(apply_to)
+    run_options = dict(
+        trace_memory=trace_memory, profile_dir=profile_dir, checkpoints=checkpoints, on_checkpoint=on_checkpoint
+    )
+    if resume_after is not None:
+        final_output = steps.resume_after(resume_after, **run_options)
+    else:
+        final_output = steps.apply_to(apply_to, **run_options)
 
     # Logging how much time every step take
     if verbose:
@@ -35,13 +65,36 @@ def apply_steps(steps, apply_to=None, steps_name=None, logger=None, verbose=True
             f"\n{'#'*25} {steps_name if steps_name else 'Runtimes'} per step in seconds {'#'*25}"
         )
         run_times_dict, total_time = steps.get_run_times()
-        for step, runtime in run_times_dict.items():
-            logger.info(f"{step} - {runtime}")
+        for step_metrics in steps.get_metrics():
+            logger.info(
+                f"{step_metrics.step} - {run_times_dict[step_metrics.step]}",
+                rows_out=step_metrics.rows_out,
+                rss_delta_mb=_to_megabytes(step_metrics.rss_delta_bytes),
+                frame_mb=_to_megabytes(step_metrics.frame_memory_out_bytes),
+                network_calls=step_metrics.network_calls,
+            )
         logger.info(f"{'#'*25} Total time: {round(total_time, 2)} {'#'*25}\n")
 
+        # Most expensive calls of the slowest step, the rest can be read from its .prof file
+        profiled = [step_metrics for step_metrics in steps.get_metrics() if step_metrics.profile_path]
+        if profiled:
+            slowest = max(profiled, key=lambda step_metrics: step_metrics.elapsed_time or 0)
+            logger.info(
+                f"Profile of the slowest step {slowest.step}\n{profile_summary(slowest.profile_path)}",
+                profile_path=slowest.profile_path,
+            )
+
+    if metrics_export is not None:
+        exported = metrics_export.export(steps.get_metrics())
+        logger.info("Step metrics exported", **{key: str(path) for key, path in exported.items()})
+
     return final_output
 
 
+def _to_megabytes(value):
+    return None if value is None else round(value / 2 ** 20, 2)
+
+
 class Step:
     """
     Single step with function and keyword arguments that will be used if called
@@ -55,16 +108,20 @@ class Step:
         self.function = function
         self.kwargs = kwargs
         self.elapsed_time = "not_runned"
+        self.metrics = None
 
-    def __call__(self, obj=None):
+    def __call__(self, obj=None, name=None, trace_memory=False, profile_dir=None):
         """
-        Simply running held function with its parameters on given object, and timing it
+        Simply running held function with its parameters on given object, timing it and measuring used resources
         """
-        start_time = perf_counter()
-        result = (
-            self.function(obj, **self.kwargs) if self.kwargs else self.function(obj)
-        )
-        self.elapsed_time = round(perf_counter() - start_time, 3)
+        self.metrics = StepMetrics(step=name or self.function.__name__)
+        with StepMonitor(self.metrics, trace_memory=trace_memory, profile_dir=profile_dir) as monitor:
+            monitor.measure_input(obj)
+            result = (
+                self.function(obj, **self.kwargs) if self.kwargs else self.function(obj)
+            )
+        monitor.measure_output(result)
+        self.elapsed_time = self.metrics.elapsed_time
         return result
 
     def __str__(self):
@@ -103,6 +160,7 @@ class Steps:
 
     def __init__(self, steps):
         self._steps = [Step(func, args) for func, args in steps]
+        self._checkpoints = {}
 
     def __call__(self, pandas_pipe_obj):
         """
@@ -161,21 +219,51 @@ class Steps:
             raise KeyError(f"Function {function_name} not in steps.")
         self[function_name].change_kwarg(kwarg, new_value)
 
-    def apply_to(self, obj):
+    def apply_to(self, obj, trace_memory=False, profile_dir=None, checkpoints=(), on_checkpoint=None, start=0):
         """
         Running all steps on a given object. Same as simply calling the Steps.
+        :param checkpoints: names of functions whose outputs (copies) are kept for resume_after method
+        :param start: index of the first step that will be run - earlier steps are marked as not measured
         """
-        for step in self._steps:
-            obj = step(obj)
+        for step_no, step in enumerate(self._steps):
+            if step_no < start:
+                step.elapsed_time, step.metrics = 0, None
+                continue
+            obj = step(
+                obj,
+                name=self._step_name(step_no, step),
+                trace_memory=trace_memory,
+                profile_dir=profile_dir,
+            )
+            if step.function.__name__ in checkpoints:
+                self._checkpoints[step.function.__name__] = _copy(obj)
+                if on_checkpoint is not None:
+                    on_checkpoint(step.function.__name__)
         return obj
 
+    def has_checkpoint(self, function_name):
+        return function_name in self._checkpoints
+
+    def resume_after(self, function_name, **kwargs):
+        """
+        Running only steps placed after given function, on a copy of its output saved during the previous run.
+        """
+        if function_name not in self._checkpoints:
+            raise KeyError(f"There is no checkpoint saved for function {function_name}.")
+        start = [func.__name__ for func, _ in self._steps].index(function_name) + 1
+        return self.apply_to(_copy(self._checkpoints[function_name]), start=start, **kwargs)
+
+    @staticmethod
+    def _step_name(step_no, step):
+        return f"{step_no:02d}-{step.function.__name__}"
+
     def get_run_times(self):
         """
         If steps has been already called, you can check the run times of specific steps or total time elapsed.
         """
 
         run_time_dict = {
-            f"{step_no:02d}-{step.function.__name__}": step.elapsed_time
+            self._step_name(step_no, step): step.elapsed_time
             for step_no, step in enumerate(self._steps)
         }
 
@@ -184,3 +272,14 @@ class Steps:
         else:
             total_time = sum(run_time_dict.values())
         return run_time_dict, total_time
+
+    def get_metrics(self):
+        """
+        Resource metrics (StepMetrics objects) of steps that have been already called.
+        """
+        return [step.metrics for step in self._steps if step.metrics is not None]
+
+
+def _copy(obj):
+    # Steps modify frames in place, so checkpoints have to be isolated from the following steps
+    return obj.copy() if hasattr(obj, "copy") else obj
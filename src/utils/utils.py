@@ -1,19 +1,9 @@
-from pathlib import Path
+from functools import lru_cache
 import requests
 import bs4 as bs
 
 
-def get_project_structure():
-    root = Path.cwd()
-    while root.name != "CityLionParser":
-        root = root.parent
-
-    backups = root / "backups"
-    fx_rates_cache = backups / "fx_rates_cache.pickle"
-
-    return dict(fx_rates_cache=fx_rates_cache)
-
-
+@lru_cache(maxsize=1)
 def get_country_to_iso_code_map():
     r = requests.get('http://pl.wikipedia.org/wiki/ISO_3166-1')
     tags = bs.BeautifulSoup(r.content)
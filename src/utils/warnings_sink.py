@@ -0,0 +1,100 @@
+"""
+Warnings collected by parsers during a run. Warnings are aggregated by their message template, e.g. thousands of
+"Rule did not match any record. Rule: {rule}." become one entry with a count and a few sample messages. Only the
+samples are logged, so repeated warnings flood neither the log nor the Warnings worksheet, and the number of kept
+templates is capped, so memory stays bounded however many warnings a run produces.
+"""
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+import pandas as pd
+import structlog
+
+MAX_TEMPLATES = 200
+SAMPLES_PER_TEMPLATE = 3
+OVERFLOW_TEMPLATE = "Other warnings (limit of distinct warnings reached)"
+
+
+@dataclass
+class WarningSummary:
+    template: str
+    count: int = 0
+    samples: List[str] = field(default_factory=list)
+
+    def __str__(self):
+        return self.samples[0] if self.count == 1 else f"{self.template} ({self.count} times)"
+
+
+class WarningsSink:
+    def __init__(
+        self, logger=None, max_templates: int = MAX_TEMPLATES, samples_per_template: int = SAMPLES_PER_TEMPLATE
+    ):
+        self.logger = logger or structlog.getLogger(__name__)
+        self.max_templates = max_templates
+        self.samples_per_template = samples_per_template
+        self._summaries: Dict[str, WarningSummary] = {}
+
+    def warn(self, template: str, **params):
+        """
+        Recording a warning. Message is the template formatted with params - warnings with the same template are
+        aggregated together.
+        """
+        message = template.format(**params) if params else template
+        if template not in self._summaries and len(self._summaries) >= self.max_templates:
+            template = OVERFLOW_TEMPLATE
+
+        summary = self._summaries.setdefault(template, WarningSummary(template))
+        summary.count += 1
+        if len(summary.samples) < self.samples_per_template:
+            summary.samples.append(message)
+            self.logger.warning(message)
+
+    def __len__(self):
+        return sum(summary.count for summary in self._summaries.values())
+
+    def __iter__(self):
+        return iter(self.summaries())
+
+    def summaries(self) -> List[WarningSummary]:
+        return list(self._summaries.values())
+
+    def lines(self) -> List[str]:
+        return [str(summary) for summary in self._summaries.values()]
+
+    def mark(self) -> Dict[str, Tuple[int, int]]:
+        """
+        State of the sink, which can be restored with `rollback` - used when a pipeline is resumed from a checkpoint.
+        """
+        return {template: (summary.count, len(summary.samples)) for template, summary in self._summaries.items()}
+
+    def rollback(self, mark: Dict[str, Tuple[int, int]]):
+        for template in list(self._summaries):
+            if template not in mark:
+                del self._summaries[template]
+                continue
+            summary = self._summaries[template]
+            summary.count, samples = mark[template]
+            del summary.samples[samples:]
+
+    def clear(self):
+        self._summaries.clear()
+
+    def log_summary(self):
+        for summary in self._summaries.values():
+            if summary.count > len(summary.samples):
+                self.logger.warning(
+                    "Warning repeated", template=summary.template, count=summary.count, logged=len(summary.samples)
+                )
+
+    def as_frame(self) -> pd.DataFrame:
+        """
+        Compact summary for the Warnings worksheet - one row per template with its count and sample messages.
+        """
+        return pd.DataFrame(
+            [
+                [str(summary), summary.count, "\n".join(summary.samples) if summary.count > 1 else ""]
+                for summary in self._summaries.values()
+            ],
+            columns=["Warnings", "Count", "Examples"],
+        )
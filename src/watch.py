@@ -0,0 +1,214 @@
+"""
+Long-running watch mode. The process keeps the authorized gspread session, NBP rates, parsers with their caches and
+checkpoints of the pipelines warm, and cheaply polls for changes:
+
+* Drive modification time of every spreadsheet is checked first (one small request),
+* only if it has changed, input worksheets are compared by content hash - small reference worksheets (rules,
+  mappings) whole, billings by the columns read by MBankParser - in two batch requests,
+* Baselinker is asked only for orders confirmed after the previous poll.
+
+Only parsers affected by the change are rerun, and only from the latest checkpoint that is not affected by it
+(see BaseParser.INPUT_WORKSHEETS).
+
+The state compared by the next poll is taken before parsers run, so edits made while they run are not lost. Writes of
+the parsers into their own input worksheets (e.g. refreshed product mappings) are then added to the state, so they do
+not trigger another run.
+"""
+
+import hashlib
+import json
+from time import sleep, time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import structlog
+
+from src.batch import BatchRunner
+from src.gdrive_connection.base import GSheetConnection
+from src.parsers.mbank.mbank_parser import hash_billing_contents
+
+# Worksheets that can be big - only columns read by the parser are hashed, other inputs are hashed whole
+BULK_WORKSHEETS = ("MbankBilling",)
+
+
+class SpreadsheetFingerprint:
+    def __init__(self, connection: GSheetConnection, watched_prefixes: Sequence[str]):
+        self.connection = connection
+        self.watched_prefixes = tuple(watched_prefixes)
+
+    def modified_time(self):
+        # Fetched from Drive on every call - Spreadsheet.lastUpdateTime is read only when the spreadsheet is opened
+        try:
+            return self.connection.spreadsheet.get_lastUpdateTime()
+        except AttributeError:
+            return None
+
+    def take(self, titles: Optional[Iterable[str]] = None) -> Dict[str, Tuple]:
+        """
+        :param titles: only these worksheets are fingerprinted (if they are watched) - all watched ones if not given
+        """
+        metadata = self.connection.spreadsheet.fetch_sheet_metadata()
+        watched = [
+            sheet["properties"]
+            for sheet in metadata["sheets"]
+            if sheet["properties"]["title"].startswith(self.watched_prefixes)
+            and (titles is None or sheet["properties"]["title"] in titles)
+        ]
+        fingerprints = {
+            properties["title"]: (
+                properties["sheetId"],
+                properties["gridProperties"]["rowCount"],
+                properties["gridProperties"]["columnCount"],
+            )
+            for properties in watched
+        }
+
+        bulk = [title for title in fingerprints if title.startswith(BULK_WORKSHEETS)]
+        for title, content_hash in zip(bulk, hash_billing_contents(self.connection.spreadsheet, bulk)):
+            fingerprints[title] += (content_hash,)
+
+        hashed = [title for title in fingerprints if not title.startswith(BULK_WORKSHEETS)]
+        if hashed:
+            value_ranges = self.connection.spreadsheet.values_batch_get([f"'{title}'" for title in hashed])
+            for title, value_range in zip(hashed, value_ranges["valueRanges"]):
+                content = json.dumps(value_range.get("values", []), ensure_ascii=False).encode()
+                fingerprints[title] += (hashlib.sha1(content).hexdigest(),)
+        return fingerprints
+
+
+def changed_worksheets(previous: Dict[str, Tuple], current: Dict[str, Tuple]) -> List[str]:
+    return sorted(
+        title for title in set(previous) | set(current) if previous.get(title) != current.get(title)
+    )
+
+
+class Watcher:
+    def __init__(
+        self,
+        spreadsheet_names: Sequence[str],
+        parser_names: Sequence[str],
+        baselinker_api_key: str = "APIKEY",
+        mbank_options: dict = None,
+        interval: float = 30,
+        **run_options,
+    ):
+        self.logger = structlog.getLogger(__name__)
+
+        self.batch = BatchRunner(
+            spreadsheet_names, parser_names, baselinker_api_key=baselinker_api_key, mbank_options=mbank_options
+        )
+        self.interval = interval
+        self.run_options = dict(run_options, keep_checkpoints=True)
+
+        self.parsers = {
+            (spreadsheet_name, parser_name): self.batch.create_parser(spreadsheet_name, parser_name)
+            for spreadsheet_name in self.batch.spreadsheet_names
+            for parser_name in self.batch.parser_names
+        }
+        self.fingerprints = {
+            spreadsheet_name: SpreadsheetFingerprint(
+                self.batch.connection(spreadsheet_name),
+                [
+                    prefix
+                    for (name, _), parser in self.parsers.items()
+                    if name == spreadsheet_name
+                    for prefix in parser.INPUT_WORKSHEETS
+                ],
+            )
+            for spreadsheet_name in self.batch.spreadsheet_names
+        }
+        self._modified_times = {}
+        self._snapshots = {}
+        self._orders_watermark = None
+
+    def _remember_state(self, spreadsheet_name: str, modified_time=None, snapshot: Dict[str, Tuple] = None):
+        """
+        Taken before parsers run - modified time first, so edits made while the worksheets are fingerprinted are seen
+        by the next poll.
+        """
+        fingerprint = self.fingerprints[spreadsheet_name]
+        self._modified_times[spreadsheet_name] = modified_time or fingerprint.modified_time()
+        self._snapshots[spreadsheet_name] = snapshot if snapshot is not None else fingerprint.take()
+        fingerprint.connection.written_worksheets.clear()
+
+    def _skip_own_writes(self, spreadsheet_name: str):
+        """
+        Adding input worksheets written by parsers to the state. The modified time is kept, so the next poll compares
+        the other worksheets, which could have been edited during the run.
+        """
+        fingerprint = self.fingerprints[spreadsheet_name]
+        written = set(fingerprint.connection.written_worksheets)
+        fingerprint.connection.written_worksheets.clear()
+        if written:
+            self._snapshots[spreadsheet_name].update(fingerprint.take(written))
+
+    def _run(self, spreadsheet_name: str, parser_name: str, resume_after=None):
+        self.logger.info(
+            "Running parser", spreadsheet=spreadsheet_name, parser=parser_name, resume_after=resume_after
+        )
+        try:
+            self.parsers[(spreadsheet_name, parser_name)].parse(resume_after=resume_after, **self.run_options)
+        except Exception:  # pylint: disable=broad-except
+            self.logger.exception("Parser failed", spreadsheet=spreadsheet_name, parser=parser_name)
+
+    def _has_new_orders(self) -> bool:
+        if self._orders_watermark is None:
+            return False
+        orders = self.batch.baselinker_api.get_orders(self.batch.baselinker_api_key, timestamp=self._orders_watermark)
+        return len(orders) > 0
+
+    def run_all(self):
+        self._orders_watermark = int(time())
+        for spreadsheet_name in self.batch.spreadsheet_names:
+            self._remember_state(spreadsheet_name)
+        for spreadsheet_name, parser_name in self.parsers:
+            self._run(spreadsheet_name, parser_name)
+        for spreadsheet_name in self.batch.spreadsheet_names:
+            self._skip_own_writes(spreadsheet_name)
+
+    def poll_once(self) -> int:
+        """
+        Checking all spreadsheets and Baselinker for changes and rerunning affected parsers.
+        :return: number of parser runs
+        """
+        runs = 0
+        poll_started_at = int(time())
+        new_orders = "baselinker" in self.batch.parser_names and self._has_new_orders()
+
+        for spreadsheet_name in self.batch.spreadsheet_names:
+            fingerprint = self.fingerprints[spreadsheet_name]
+            modified_time = fingerprint.modified_time()
+            changed, spreadsheet_runs = [], 0
+            if modified_time is None or modified_time != self._modified_times.get(spreadsheet_name):
+                snapshot = fingerprint.take()
+                changed = changed_worksheets(self._snapshots.get(spreadsheet_name, {}), snapshot)
+                self._remember_state(spreadsheet_name, modified_time, snapshot)
+
+            for (name, parser_name), parser in self.parsers.items():
+                if name != spreadsheet_name:
+                    continue
+                relevant = [title for title in changed if title.startswith(tuple(parser.INPUT_WORKSHEETS))]
+                if parser_name == "baselinker" and new_orders:
+                    self._run(spreadsheet_name, parser_name)
+                elif relevant:
+                    self.logger.info("Input worksheets changed", spreadsheet=spreadsheet_name, worksheets=relevant)
+                    self._run(spreadsheet_name, parser_name, resume_after=parser.resume_point(relevant))
+                else:
+                    continue
+                spreadsheet_runs += 1
+
+            runs += spreadsheet_runs
+            if spreadsheet_runs:
+                self._skip_own_writes(spreadsheet_name)
+
+        self._orders_watermark = poll_started_at
+        return runs
+
+    def run_forever(self):
+        self.run_all()
+        self.logger.info("Watching for changes", interval=self.interval)
+        while True:
+            sleep(self.interval)
+            try:
+                self.poll_once()
+            except Exception:  # pylint: disable=broad-except
+                self.logger.exception("Polling failed, retrying in the next cycle")